@@ -5,13 +5,17 @@ app
 from .actions import *
 from .context import *
 from .core import *
+from .export import *
 from .network import *
+from .rates import *
 from .render_spec import *
 
 __all__ = (
     actions.__all__
     + context.__all__
     + core.__all__
+    + export.__all__
     + render_spec.__all__
     + network.__all__
+    + rates.__all__
 )
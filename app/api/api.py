@@ -4,102 +4,770 @@ api.py
 The fastapi main app.
 """
 
-from fastapi import Depends, FastAPI, HTTPException, status
+import asyncio
+import base64
+import binascii
+import os
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Iterator, List, Literal, Optional, Tuple
 
-from ..domain.account import AccountStorage
-from ..network import get_exchange_rates
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Response, status
+from fastapi.responses import StreamingResponse
+
+from ..domain.async_storage import DB_WORKERS, AsyncAccountStorage
+from ..domain.backend import StorageBackend, enable_from_env, open_storage
+from ..domain.config import StorageConfig
+from ..domain.hashing import PinHasher
+from ..domain.locks import LOCK_STRIPES, AsyncAccountLocks
+from ..domain.session import SessionStore
+from ..domain.sharding import ShardedAccountStorage
+from ..export import ACCOUNT_FIELDS, TRANSACTION_FIELDS, encode_rows, gzip_stream
+from ..network import (
+    RatesRefresher,
+    RatesSnapshot,
+    get_exchange_rates_async,
+    get_rates_snapshot_async,
+)
+from ..rates import matrix_for
 from .models import (
+    AccountBatchCreateRequest,
+    AccountBatchCreateResponse,
+    AccountBatchCreateResult,
     AccountManipulationRequest,
     AccountManipulationResponse,
+    ConvertBatchRequest,
+    ConvertBatchResponse,
+    ConvertGetResponse,
+    CrossRateGetResponse,
+    LoginRequest,
+    LoginResponse,
+    MetricsGetResponse,
     RateGetResponse,
     RatesGetResponse,
+    TransactionBatchRequest,
+    TransactionBatchResponse,
+    TransactionEntry,
+    TransactionPageResponse,
+    TransactionResult,
 )
+from .payloads import Payload, payloads_for, rates_etag
 
 __all__ = []
 
-app = FastAPI(title="Bank Account Manager")
+_storage: Optional[StorageBackend] = None
+_storage_lock = threading.Lock()
+_async_storage: Optional[AsyncAccountStorage] = None
+_sessions = SessionStore()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Keep the exchange rates fresh in the background while the server runs.
+    Close the pooled database connections when the server shuts down.
+    """
+    global _storage, _async_storage
+    refresher = RatesRefresher()
+    refresher.start()
+    try:
+        yield
+    finally:
+        await refresher.stop()
+        with _storage_lock:
+            if _async_storage is not None:
+                _async_storage.close()
+                _async_storage = None
+            if _storage is not None:
+                _storage.close()
+                _storage = None
+
+
+app = FastAPI(title="Bank Account Manager", lifespan=lifespan)
+
+
+def get_storage() -> StorageBackend:
+    """
+    Share one storage, and so one connection pool, across requests.
+    BANK_SHARDS=<n> spreads the accounts over n sqlite files instead.
+    BANK_DURABILITY=strict|balanced|fast picks the StorageConfig profile.
+    BANK_DB is the sqlite file, bank.db by default.
+    BANK_ENGINE=memory keeps the accounts in memory instead, with a snapshot
+    and append log at BANK_DB only if it is set.
+    """
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            workers = int(os.getenv("BANK_HASH_WORKERS", os.cpu_count() or 1))
+            hasher = PinHasher(workers=workers)
+            config = StorageConfig.from_env()
+            db_path = os.getenv("BANK_DB")
+            shards = int(os.getenv("BANK_SHARDS", 1))
+            if shards > 1:
+                _storage = ShardedAccountStorage(
+                    db_path or "bank.db", shards, hasher=hasher, config=config
+                )
+            else:
+                _storage = open_storage(db_path, hasher=hasher, config=config)
+            enable_from_env(_storage, cache=True)
+        return _storage
+
+
+async def get_async_storage(
+    storage: StorageBackend = Depends(get_storage),
+) -> AsyncAccountStorage:
+    """
+    Awaitable view of whatever get_storage returns, so overriding get_storage
+    in tests swaps this one too. The view is rebuilt when the storage changes.
+    Mutations are serialized per account over BANK_LOCK_STRIPES locks, 0 turns that off.
+    """
+    global _async_storage
+    current = _async_storage
+    if current is not None and current.storage is storage:
+        return current
+    with _storage_lock:
+        if _async_storage is None or _async_storage.storage is not storage:
+            if _async_storage is not None:
+                _async_storage.close(wait=False)
+            workers = int(os.getenv("BANK_DB_WORKERS", DB_WORKERS))
+            stripes = int(os.getenv("BANK_LOCK_STRIPES", LOCK_STRIPES))
+            locks = AsyncAccountLocks(stripes) if stripes > 0 else None
+            _async_storage = AsyncAccountStorage(storage, workers, locks)
+        return _async_storage
+
+
+def get_sessions() -> SessionStore:
+    """
+    The store of tokens handed out by POST /accounts/{id}/login.
+    """
+    return _sessions
+
+
+def _bearer_token(authorization: Optional[str]) -> Optional[str]:
+    """
+    Pull the token out of an "Authorization: Bearer <token>" header.
+    """
+    if not authorization:
+        return None
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    return token.strip()
+
+
+async def is_authenticated(
+    account_id: int,
+    pin: Optional[str],
+    authorization: Optional[str],
+    storage: AsyncAccountStorage,
+    sessions: SessionStore,
+) -> bool:
+    """
+    True for a live session token of account_id or the right PIN.
+    """
+    token = _bearer_token(authorization)
+    if token is not None and sessions.resolve(token) == account_id:
+        return True
+    return pin is not None and bool(await storage.get_account(account_id, pin))
+
+
+async def authenticate(
+    account_id: int,
+    pin: Optional[str],
+    authorization: Optional[str],
+    storage: AsyncAccountStorage,
+    sessions: SessionStore,
+) -> None:
+    """
+    Accept either a live session token for account_id or the right PIN.
+    Raise 401 otherwise.
+    """
+    if not await is_authenticated(account_id, pin, authorization, storage, sessions):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="Wrong PIN or ID"
+        )
 
 
-def get_storage() -> AccountStorage:
-    return AccountStorage()
+@app.post("/accounts/{account_id}/login", response_model=LoginResponse)
+async def login(
+    account_id: int,
+    req: LoginRequest,
+    storage: AsyncAccountStorage = Depends(get_async_storage),
+    sessions: SessionStore = Depends(get_sessions),
+) -> LoginResponse:
+    """
+    Checks the pin once and returns a token to use instead of it.
+    """
+    if not await storage.get_account(account_id, req.pin):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="Wrong PIN or ID"
+        )
+    return LoginResponse(token=sessions.issue(account_id), expires_in=sessions.ttl)
+
+
+@app.post("/accounts/{account_id}/logout", status_code=status.HTTP_204_NO_CONTENT)
+def logout(
+    account_id: int,
+    authorization: Optional[str] = Header(default=None),
+    sessions: SessionStore = Depends(get_sessions),
+) -> Response:
+    """
+    Revokes the session token in the Authorization header.
+    """
+    token = _bearer_token(authorization)
+    if token is None or sessions.resolve(token) != account_id:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid session"
+        )
+    sessions.revoke(token)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+@app.post("/accounts:batch", response_model=AccountBatchCreateResponse)
+async def create_accounts(
+    req: AccountBatchCreateRequest,
+    storage: AsyncAccountStorage = Depends(get_async_storage),
+) -> AccountBatchCreateResponse:
+    """
+    Creates many accounts at once, reports the outcome of every row.
+    """
+    rows = [(a.id, a.pin, a.initial_balance) for a in req.accounts]
+    outcome = await storage.create_accounts(rows)
+    results = [
+        AccountBatchCreateResult(id=id, ok=err is None, error=err)
+        for id, err in outcome
+    ]
+    created = sum(r.ok for r in results)
+    return AccountBatchCreateResponse(
+        created=created, failed=len(results) - created, results=results
+    )
+
+
+def _export_response(
+    chunks: Iterator[List[Tuple[Any, ...]]],
+    fields: Tuple[str, ...],
+    fmt: str,
+    accept_encoding: Optional[str],
+    filename: str,
+) -> StreamingResponse:
+    """
+    Stream chunks of rows as ndjson or csv, gzipped when the client accepts it.
+    starlette pulls the generator from its threadpool, one chunk at a time.
+    """
+    body = encode_rows(chunks, fields, fmt)
+    headers = {"Content-Disposition": f'attachment; filename="{filename}.{fmt}"'}
+    if accept_encoding and "gzip" in accept_encoding.lower():
+        body = gzip_stream(body)
+        headers["Content-Encoding"] = "gzip"
+    media_type = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    return StreamingResponse(body, media_type=media_type, headers=headers)
+
+
+@app.get("/accounts:export")
+def export_accounts(
+    fmt: Literal["ndjson", "csv"] = Query(default="ndjson", alias="format"),
+    accept_encoding: Optional[str] = Header(default=None),
+    storage: StorageBackend = Depends(get_storage),
+) -> StreamingResponse:
+    """
+    Streams the id and balance of every account.
+    """
+    return _export_response(
+        storage.iter_accounts(), ACCOUNT_FIELDS, fmt, accept_encoding, "accounts"
+    )
+
+
+@app.get("/accounts/{account_id}/transactions:export")
+def export_transactions(
+    account_id: int,
+    fmt: Literal["ndjson", "csv"] = Query(default="ndjson", alias="format"),
+    accept_encoding: Optional[str] = Header(default=None),
+    storage: StorageBackend = Depends(get_storage),
+) -> StreamingResponse:
+    """
+    Streams the whole statement of account_id, oldest first.
+    """
+    if not storage.get_account_by_id(account_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Account not found"
+        )
+    return _export_response(
+        storage.iter_transactions(account_id),
+        TRANSACTION_FIELDS,
+        fmt,
+        accept_encoding,
+        f"account-{account_id}-transactions",
+    )
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    True if the If-None-Match header lists etag (weak comparison) or is "*".
+    """
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+def _account_etag(account_id: int, version: int) -> str:
+    """
+    Strong ETag of an account, changes with every write to its row.
+    """
+    return f'"acct-{account_id}-v{version}"'
+
+
+def _rates_cache_control(snapshot: RatesSnapshot) -> str:
+    """
+    Let clients and proxies keep a rates response until the table expires.
+    """
+    max_age = max(0, int(snapshot.expires_at - time.time()))
+    return f"public, max-age={max_age}"
+
+
+def _conditional(
+    response: Response,
+    if_none_match: Optional[str],
+    etag: str,
+    cache_control: Optional[str] = None,
+) -> Optional[Response]:
+    """
+    Put the validators on response.
+    Returns a bodiless 304 to send instead if the client already has etag.
+    """
+    headers = {"ETag": etag}
+    if cache_control is not None:
+        headers["Cache-Control"] = cache_control
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    response.headers.update(headers)
+    return None
 
 
 @app.get("/accounts/{account_id}", response_model=AccountManipulationResponse)
-def get_account_by_id(
-    account_id: int, storage: AccountStorage = Depends(get_storage)
-) -> AccountManipulationResponse:
+async def get_account_by_id(
+    account_id: int,
+    response: Response,
+    if_none_match: Optional[str] = Header(default=None),
+    storage: AsyncAccountStorage = Depends(get_async_storage),
+) -> Any:
     """
     Returns the account information directly using id.
+    Answers 304 when If-None-Match holds the current ETag.
+    A conditional request reads past the account cache, a stale version
+    must never confirm the client's copy.
     """
-    account = storage.get_account_by_id(account_id)
+    account = await storage.get_account_by_id(
+        account_id, fresh=if_none_match is not None
+    )
     if not account:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Account not found"
         )
+    etag = _account_etag(account.id, account.version)
+    not_modified = _conditional(response, if_none_match, etag, "no-cache")
+    if not_modified is not None:
+        return not_modified
     return AccountManipulationResponse(id=account.id, balance=account.get_balance())
 
 
+def _encode_cursor(cursor: Tuple[float, int]) -> str:
+    """
+    Turn a (timestamp, id) position into an opaque url-safe string.
+    """
+    timestamp, id = cursor
+    return base64.urlsafe_b64encode(f"{timestamp!r}:{id}".encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> Tuple[float, int]:
+    """
+    Reverse of _encode_cursor, raise 400 for anything it did not produce.
+    """
+    try:
+        timestamp, id = base64.urlsafe_b64decode(cursor).decode().split(":")
+        return float(timestamp), int(id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor"
+        )
+
+
+@app.get("/accounts/{account_id}/transactions", response_model=TransactionPageResponse)
+async def get_transactions(
+    account_id: int,
+    limit: int = Query(default=50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    storage: AsyncAccountStorage = Depends(get_async_storage),
+) -> TransactionPageResponse:
+    """
+    Returns the statement of account_id page by page, newest first.
+    """
+    before = _decode_cursor(cursor) if cursor is not None else None
+    if not await storage.get_account_by_id(account_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Account not found"
+        )
+    page, next_cursor = await storage.list_transactions(account_id, limit, before)
+    return TransactionPageResponse(
+        id=account_id,
+        transactions=[
+            TransactionEntry(
+                id=t.id,
+                kind=t.kind,
+                amount=t.amount,
+                balance=t.balance,
+                timestamp=t.timestamp,
+            )
+            for t in page
+        ],
+        next_cursor=_encode_cursor(next_cursor) if next_cursor else None,
+    )
+
+
+def _if_match_version(if_match: Optional[str], account_id: int) -> Optional[int]:
+    """
+    The account version an If-Match header asks for, None without a precondition.
+    Raise 412 for an ETag that can not be the one of account_id.
+    """
+    if if_match is None or if_match.strip() == "*":
+        return None
+    prefix = f'"acct-{account_id}-v'
+    etag = if_match.strip()
+    if etag.startswith(prefix) and etag.endswith('"'):
+        version = etag[len(prefix) : -1]
+        if version.isdigit():
+            return int(version)
+    raise HTTPException(
+        status_code=status.HTTP_412_PRECONDITION_FAILED, detail="ETag does not match"
+    )
+
+
+async def _apply_if_match(
+    account_id: int,
+    kind: str,
+    amount: int,
+    version: int,
+    response: Response,
+    storage: AsyncAccountStorage,
+) -> int:
+    """
+    Apply a deposit or withdraw guarded by If-Match and send the new ETag.
+    Raise 412 if the account moved past version, 404 / 400 like the plain path.
+    """
+    balance, err = await storage.apply_if_match(account_id, kind, amount, version)
+    if err == "Version mismatch":
+        raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED, detail=err)
+    if err == "Account not found":
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=err)
+    if balance is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=err)
+    response.headers["ETag"] = _account_etag(account_id, version + 1)
+    return balance
+
+
 @app.post("/accounts/{account_id}/deposit", response_model=AccountManipulationResponse)
-def deposit(
+async def deposit(
     account_id: int,
     req: AccountManipulationRequest,
-    storage: AccountStorage = Depends(get_storage),
+    response: Response,
+    authorization: Optional[str] = Header(default=None),
+    if_match: Optional[str] = Header(default=None),
+    storage: AsyncAccountStorage = Depends(get_async_storage),
+    sessions: SessionStore = Depends(get_sessions),
 ) -> AccountManipulationResponse:
     """
-    Deposits amount into account_id using pin and amount in req
+    Deposits amount into account_id using pin or session token and amount in req
+    With If-Match, only if the account is still at that ETag, 412 otherwise.
     """
-    account = storage.get_account(account_id, req.pin)
-    if not account:
+    version = _if_match_version(if_match, account_id)
+    await authenticate(account_id, req.pin, authorization, storage, sessions)
+    if version is not None:
+        balance = await _apply_if_match(
+            account_id, "deposit", req.amount, version, response, storage
+        )
+        return AccountManipulationResponse(id=account_id, balance=balance)
+    balance = await storage.apply_delta(account_id, req.amount)
+    if balance is None:
         raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED, detail="Wrong PIN or ID"
+            status_code=status.HTTP_404_NOT_FOUND, detail="Account not found"
         )
-    account.deposit(req.amount)
-    storage.update_balance(account)
-    return AccountManipulationResponse(id=account.id, balance=account.get_balance())
+    return AccountManipulationResponse(id=account_id, balance=balance)
 
 
 @app.post("/accounts/{account_id}/withdraw", response_model=AccountManipulationResponse)
-def withdraw(
+async def withdraw(
     account_id: int,
     req: AccountManipulationRequest,
-    storage: AccountStorage = Depends(get_storage),
+    response: Response,
+    authorization: Optional[str] = Header(default=None),
+    if_match: Optional[str] = Header(default=None),
+    storage: AsyncAccountStorage = Depends(get_async_storage),
+    sessions: SessionStore = Depends(get_sessions),
 ) -> AccountManipulationResponse:
     """
-    Withdraws amount from account_id using pin and amount in req
+    Withdraws amount from account_id using pin or session token and amount in req
+    With If-Match, only if the account is still at that ETag, 412 otherwise.
     """
-    account = storage.get_account(account_id, req.pin)
-    if not account:
+    version = _if_match_version(if_match, account_id)
+    await authenticate(account_id, req.pin, authorization, storage, sessions)
+    if version is not None:
+        balance = await _apply_if_match(
+            account_id, "withdraw", req.amount, version, response, storage
+        )
+        return AccountManipulationResponse(id=account_id, balance=balance)
+    balance = await storage.try_withdraw(account_id, req.amount)
+    if balance is None:
         raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED, detail="Wrong PIN or ID"
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Not enough balance"
         )
-    success, err_message = account.withdraw(req.amount)
-    if not success:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=err_message)
-    storage.update_balance(account)
-    return AccountManipulationResponse(id=account.id, balance=account.get_balance())
+    return AccountManipulationResponse(id=account_id, balance=balance)
 
 
-@app.get("/rates", response_model=RatesGetResponse)
-def get_rates() -> RatesGetResponse:
-    ok, rates, error = get_exchange_rates()
-    if not ok or not rates:
+@app.post("/transactions:batch", response_model=TransactionBatchResponse)
+async def apply_transactions(
+    req: TransactionBatchRequest,
+    authorization: Optional[str] = Header(default=None),
+    storage: AsyncAccountStorage = Depends(get_async_storage),
+    sessions: SessionStore = Depends(get_sessions),
+) -> TransactionBatchResponse:
+    """
+    Applies many deposits and withdraws in one database transaction.
+    Every (account, pin) pair is only checked once.
+    """
+    ops = req.operations
+    keys = list(dict.fromkeys((op.account_id, op.pin) for op in ops))
+    checks = await asyncio.gather(
+        *(
+            is_authenticated(id, pin, authorization, storage, sessions)
+            for id, pin in keys
+        )
+    )
+    verified = dict(zip(keys, checks))
+    auth_errors = [
+        None if verified[(op.account_id, op.pin)] else "Wrong PIN or ID" for op in ops
+    ]
+
+    atomic = req.mode == "atomic"
+    if atomic and any(auth_errors):
+        committed = False
+        outcome = [(None, err or "Rolled back") for err in auth_errors]
+    else:
+        allowed = [
+            (op.account_id, op.kind, op.amount)
+            for op, err in zip(ops, auth_errors)
+            if err is None
+        ]
+        committed, applied = await storage.apply_batch(allowed, atomic)
+        applied_iter = iter(applied)
+        outcome = [
+            next(applied_iter) if err is None else (None, err) for err in auth_errors
+        ]
+
+    return TransactionBatchResponse(
+        committed=committed,
+        results=[
+            TransactionResult(
+                account_id=op.account_id,
+                kind=op.kind,
+                amount=op.amount,
+                ok=err is None and committed,
+                balance=balance,
+                error=err,
+            )
+            for op, (balance, err) in zip(ops, outcome)
+        ],
+    )
+
+
+async def _rates_snapshot() -> RatesSnapshot:
+    """
+    The current rates table, raise 503 if there is none.
+    """
+    ok, snapshot, error = await get_rates_snapshot_async()
+    if not ok or snapshot is None or not snapshot.rates:
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=error
         )
-    return RatesGetResponse(base="USD", rates=rates)
+    return snapshot
+
+
+def _send_payload(
+    payload: Payload,
+    cache_control: str,
+    if_none_match: Optional[str],
+    accept_encoding: Optional[str],
+) -> Response:
+    """
+    Send prebuilt json bytes as they are, the gzipped copy if the client takes it.
+    Answers 304 when If-None-Match holds the ETag of the chosen variant.
+    """
+    gzipped = (
+        payload.gzipped is not None
+        and accept_encoding is not None
+        and "gzip" in accept_encoding.lower()
+    )
+    headers = {
+        "ETag": payload.gzip_etag if gzipped else payload.etag,
+        "Cache-Control": cache_control,
+    }
+    if payload.gzipped is not None:
+        headers["Vary"] = "Accept-Encoding"
+    if _etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    if gzipped:
+        headers["Content-Encoding"] = "gzip"
+    return Response(
+        content=payload.gzipped if gzipped else payload.body,
+        media_type="application/json",
+        headers=headers,
+    )
+
+
+@app.get("/rates", response_model=RatesGetResponse)
+async def get_rates(
+    if_none_match: Optional[str] = Header(default=None),
+    accept_encoding: Optional[str] = Header(default=None),
+) -> Response:
+    """
+    Returns the whole rates table, from bytes built once per table.
+    """
+    snapshot = await _rates_snapshot()
+    return _send_payload(
+        payloads_for(snapshot).table,
+        _rates_cache_control(snapshot),
+        if_none_match,
+        accept_encoding,
+    )
 
 
 @app.get("/rates/{currency_code}", response_model=RateGetResponse)
-def get_rate(currency_code: str) -> RateGetResponse:
-    ok, rates, error = get_exchange_rates()
+async def get_rate(
+    currency_code: str,
+    if_none_match: Optional[str] = Header(default=None),
+    accept_encoding: Optional[str] = Header(default=None),
+) -> Response:
+    """
+    Returns the rate of one currency, from bytes built once per table.
+    """
+    snapshot = await _rates_snapshot()
+    payload = payloads_for(snapshot).currencies.get(currency_code.upper())
+    if payload is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Currency Not Found"
+        )
+    return _send_payload(
+        payload, _rates_cache_control(snapshot), if_none_match, accept_encoding
+    )
+
+
+@app.get("/rates/{base}/{quote}", response_model=CrossRateGetResponse)
+async def get_cross_rate(
+    base: str,
+    quote: str,
+    response: Response,
+    if_none_match: Optional[str] = Header(default=None),
+) -> Any:
+    """
+    Returns how many units of quote one unit of base buys.
+    """
+    snapshot = await _rates_snapshot()
+    rate = matrix_for(snapshot.rates).rate(base, quote)
+    if rate is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Currency Not Found"
+        )
+    not_modified = _conditional(
+        response,
+        if_none_match,
+        rates_etag(snapshot, f"-{base.upper()}-{quote.upper()}"),
+        _rates_cache_control(snapshot),
+    )
+    if not_modified is not None:
+        return not_modified
+    return CrossRateGetResponse(base=base.upper(), quote=quote.upper(), rate=rate)
+
+
+@app.get("/convert", response_model=ConvertGetResponse)
+async def convert_amount(
+    amount: float,
+    base: str = Query(alias="from"),
+    quote: str = Query(alias="to"),
+) -> ConvertGetResponse:
+    """
+    Converts amount from one currency to another, e.g. /convert?amount=10&from=EUR&to=JPY
+    """
+    ok, rates, error = await get_exchange_rates_async()
     if not ok or rates is None:
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=error
         )
-    if currency_code.upper() not in rates:
+    rate = matrix_for(rates).rate(base, quote)
+    if rate is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Currency Not Found"
         )
-    return RateGetResponse(
-        base="USD", currency=currency_code.upper(), rate=rates[currency_code.upper()]
+    return ConvertGetResponse(
+        base=base.upper(),
+        quote=quote.upper(),
+        amount=amount,
+        rate=rate,
+        converted=amount * rate,
+    )
+
+
+@app.post("/convert:batch", response_model=ConvertBatchResponse)
+async def convert_batch(
+    req: ConvertBatchRequest,
+    storage: AsyncAccountStorage = Depends(get_async_storage),
+) -> ConvertBatchResponse:
+    """
+    Converts many balances, or the balances of many accounts, into every target at once.
+    """
+    ok, rates, error = await get_exchange_rates_async()
+    if not ok or rates is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=error
+        )
+    account_ids = None
+    missing = []
+    amounts = req.balances
+    if req.account_ids is not None:
+        batch = await storage.load_batch(req.account_ids)
+        rows = batch.positions(req.account_ids)
+        account_ids = batch.ids[rows[rows >= 0]].tolist()
+        missing = [id for id, row in zip(req.account_ids, rows.tolist()) if row < 0]
+        amounts = batch.balances[rows[rows >= 0]]
+    try:
+        values = matrix_for(rates).convert_many(amounts, req.base, req.targets)
+    except KeyError:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Currency Not Found"
+        )
+    return ConvertBatchResponse(
+        base=req.base.upper(),
+        targets=[t.upper() for t in req.targets],
+        account_ids=account_ids,
+        missing=missing,
+        values=values.tolist(),
+    )
+
+
+@app.get("/metrics", response_model=MetricsGetResponse)
+def get_metrics(
+    front: AsyncAccountStorage = Depends(get_async_storage),
+) -> MetricsGetResponse:
+    """
+    Returns counters that show how loaded the server is.
+    """
+    storage = front.storage
+    return MetricsGetResponse(
+        hashing=storage.hasher.metrics(),
+        ledger=storage.ledger.metrics() if storage.ledger is not None else None,
+        cache=storage.cache.metrics() if storage.cache is not None else None,
+        contention=storage.contention_metrics(),
+        locks=front.locks.metrics() if front.locks is not None else None,
     )
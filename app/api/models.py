@@ -6,9 +6,9 @@ Used to define the dataclass for fastapi
 
 from __future__ import annotations
 
-from typing import Dict
+from typing import Dict, List, Literal, Optional
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
 
 __all__ = []
 
@@ -41,10 +41,199 @@ class RateGetResponse(BaseModel):
     rate: float
 
 
+class MetricsGetResponse(BaseModel):
+    """
+    The dataclass that defines the response to get metrics.
+    """
+
+    hashing: Dict[str, int]
+    ledger: Optional[Dict[str, int]] = None
+    cache: Optional[Dict[str, int]] = None
+    contention: Optional[Dict[str, int]] = None
+    locks: Optional[Dict[str, int]] = None
+
+
+class CrossRateGetResponse(BaseModel):
+    """
+    The dataclass that defines the response to get the rate between two currencies.
+    """
+
+    base: str
+    quote: str
+    rate: float
+
+
+class ConvertGetResponse(BaseModel):
+    """
+    The dataclass that defines the response to converting an amount.
+    """
+
+    base: str
+    quote: str
+    amount: float
+    rate: float
+    converted: float
+
+
+class ConvertBatchRequest(BaseModel):
+    """
+    The dataclass that defines the request body for converting many balances.
+    Give either balances or account_ids, not both.
+    """
+
+    base: str = "USD"
+    targets: List[str] = Field(min_length=1)
+    balances: Optional[List[float]] = None
+    account_ids: Optional[List[int]] = None
+
+    @model_validator(mode="after")
+    def _one_source(self) -> "ConvertBatchRequest":
+        """
+        Reject requests with both or neither of balances and account_ids.
+        """
+        if (self.balances is None) == (self.account_ids is None):
+            raise ValueError("Give either balances or account_ids")
+        return self
+
+
+class ConvertBatchResponse(BaseModel):
+    """
+    The dataclass that defines the response to converting many balances.
+    values[n][k] is the n-th balance in targets[k].
+    account_ids lists the row order when accounts were asked for, missing the unknown ones.
+    """
+
+    base: str
+    targets: List[str]
+    account_ids: Optional[List[int]] = None
+    missing: List[int] = []
+    values: List[List[float]]
+
+
 class AccountManipulationRequest(BaseModel):
     """
     The dataclass that defines the request body for deposit and withdraw requests.
+    pin can be left out when a session token is sent instead.
     """
 
-    pin: str
+    pin: Optional[str] = None
     amount: int = Field(ge=1)
+
+
+class LoginRequest(BaseModel):
+    """
+    The dataclass that defines the request body for login.
+    """
+
+    pin: str
+
+
+class LoginResponse(BaseModel):
+    """
+    The dataclass that defines the session token returned by login.
+    """
+
+    token: str
+    expires_in: float
+
+
+class AccountCreateRequest(BaseModel):
+    """
+    The dataclass that defines one account to create.
+    """
+
+    id: int
+    pin: str = Field(min_length=1)
+    initial_balance: int = Field(default=0, ge=0)
+
+
+class AccountBatchCreateRequest(BaseModel):
+    """
+    The dataclass that defines the request body for creating accounts in bulk.
+    """
+
+    accounts: List[AccountCreateRequest]
+
+
+class AccountBatchCreateResult(BaseModel):
+    """
+    The dataclass that defines the outcome of creating one account of a batch.
+    """
+
+    id: int
+    ok: bool
+    error: Optional[str] = None
+
+
+class AccountBatchCreateResponse(BaseModel):
+    """
+    The dataclass that defines the response to creating accounts in bulk.
+    """
+
+    created: int
+    failed: int
+    results: List[AccountBatchCreateResult]
+
+
+class TransactionOperation(AccountManipulationRequest):
+    """
+    The dataclass that defines one deposit or withdraw of a batch.
+    """
+
+    account_id: int
+    kind: Literal["deposit", "withdraw"]
+
+
+class TransactionBatchRequest(BaseModel):
+    """
+    The dataclass that defines the request body for a batch of transactions.
+    atomic applies all operations or none, best_effort skips the failing ones.
+    """
+
+    mode: Literal["atomic", "best_effort"] = "atomic"
+    operations: List[TransactionOperation]
+
+
+class TransactionResult(BaseModel):
+    """
+    The dataclass that defines the outcome of one operation of a batch.
+    """
+
+    account_id: int
+    kind: str
+    amount: int
+    ok: bool
+    balance: Optional[int] = None
+    error: Optional[str] = None
+
+
+class TransactionBatchResponse(BaseModel):
+    """
+    The dataclass that defines the response to a batch of transactions.
+    """
+
+    committed: bool
+    results: List[TransactionResult]
+
+
+class TransactionEntry(BaseModel):
+    """
+    The dataclass that defines one row of an account statement.
+    """
+
+    id: int
+    kind: str
+    amount: int
+    balance: int
+    timestamp: float
+
+
+class TransactionPageResponse(BaseModel):
+    """
+    The dataclass that defines one page of an account statement, newest first.
+    Pass next_cursor back as cursor to get the following page.
+    """
+
+    id: int
+    transactions: List[TransactionEntry]
+    next_cursor: Optional[str] = None
@@ -0,0 +1,101 @@
+"""
+payloads.py
+
+Ready-made response bodies for the rates endpoints.
+The rates table changes at most once a day, so its json, a gzipped copy
+and the body of every single currency are built once per table
+and handed out as raw bytes afterwards.
+"""
+
+import gzip
+import json
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+from ..network import RatesSnapshot
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+__all__ = []
+
+# a single currency body is ~50 bytes, gzip would only make it bigger
+GZIP_MIN_SIZE = 512
+
+
+def dumps(obj: Any) -> bytes:
+    """
+    Compact json bytes, through orjson when it is installed.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":")).encode()
+
+
+def rates_etag(snapshot: RatesSnapshot, suffix: str = "") -> str:
+    """
+    Strong ETag of a rates resource, changes with every fetched table.
+    """
+    return f'"rates-{snapshot.timestamp!r}{suffix}"'
+
+
+@dataclass(frozen=True)
+class Payload:
+    """
+    A json body and its ETag, plus a gzipped copy and its own ETag for big bodies.
+    """
+
+    body: bytes
+    etag: str
+    gzipped: Optional[bytes] = None
+    gzip_etag: Optional[str] = None
+
+    @classmethod
+    def build(cls, obj: Any, etag: str) -> "Payload":
+        """
+        Encode obj once, gzipped as well when it is at least GZIP_MIN_SIZE bytes.
+        """
+        body = dumps(obj)
+        if len(body) < GZIP_MIN_SIZE:
+            return cls(body, etag)
+        return cls(body, etag, gzip.compress(body, mtime=0), etag[:-1] + '-gz"')
+
+
+class RatesPayloads:
+    """
+    Every body the rates endpoints can send for one snapshot.
+    """
+
+    def __init__(self, snapshot: RatesSnapshot) -> None:
+        self.snapshot = snapshot
+        self.table = Payload.build(
+            {"base": "USD", "rates": dict(snapshot.rates)}, rates_etag(snapshot)
+        )
+        self.currencies: Dict[str, Payload] = {
+            code: Payload.build(
+                {"base": "USD", "currency": code, "rate": rate},
+                rates_etag(snapshot, f"-{code}"),
+            )
+            for code, rate in snapshot.rates.items()
+        }
+
+
+_cached: Optional[Tuple[RatesSnapshot, RatesPayloads]] = None
+_cached_lock = threading.Lock()
+
+
+def payloads_for(snapshot: RatesSnapshot) -> RatesPayloads:
+    """
+    Return the payloads of a snapshot, built the first time that snapshot is seen.
+    """
+    global _cached
+    cached = _cached
+    if cached is not None and cached[0] is snapshot:
+        return cached[1]
+    with _cached_lock:
+        if _cached is None or _cached[0] is not snapshot:
+            _cached = (snapshot, RatesPayloads(snapshot))
+        return _cached[1]
@@ -0,0 +1,161 @@
+"""
+cli.py
+
+Command line tools for bulk work on the account database.
+
+python -m app.cli provision accounts.csv
+python -m app.cli provision accounts.jsonl --workers 8
+python -m app.cli export accounts --format csv --gzip -o accounts.csv.gz
+python -m app.cli export transactions --account 42
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from typing import Any, BinaryIO, Iterator, List, Optional, Tuple
+
+from .domain import PinHasher, StorageConfig, open_storage
+from .domain.account import CREATE_CHUNK_SIZE, EXPORT_CHUNK_SIZE
+from .export import ACCOUNT_FIELDS, TRANSACTION_FIELDS, encode_rows, gzip_stream
+
+__all__ = ["main"]
+
+
+def _to_int(value: Any) -> Any:
+    """
+    Turn value into an int if it looks like one, leave it for validation otherwise.
+    """
+    if isinstance(value, str):
+        try:
+            return int(value)
+        except ValueError:
+            return value
+    return value
+
+
+def read_accounts(path: str) -> Iterator[Tuple[Any, Any, Any]]:
+    """
+    Stream (id, pin, initial_balance) rows out of a .csv or .jsonl file.
+    The csv needs a header with id, pin and optionally initial_balance.
+    """
+    with open(path, "r", newline="") as f:
+        if path.endswith(".jsonl"):
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    record = {}
+                yield (
+                    record.get("id"),
+                    record.get("pin"),
+                    record.get("initial_balance", 0),
+                )
+        else:
+            for record in csv.DictReader(f):
+                yield (
+                    _to_int(record.get("id")),
+                    record.get("pin"),
+                    _to_int(record.get("initial_balance") or 0),
+                )
+
+
+def provision(args: argparse.Namespace) -> int:
+    """
+    Create every account in args.file, print the failures on stderr.
+    """
+    storage = open_storage(
+        args.db,
+        hasher=PinHasher(workers=args.workers),
+        config=StorageConfig.from_env(),
+    )
+    start = time.perf_counter()
+    try:
+        results = storage.create_accounts(
+            read_accounts(args.file), chunk_size=args.chunk_size
+        )
+    finally:
+        storage.close()
+    elapsed = time.perf_counter() - start
+
+    failed = [(id, err) for id, err in results if err is not None]
+    for id, err in failed:
+        print(f"{id}: {err}", file=sys.stderr)
+    print(
+        f"created {len(results) - len(failed)}, failed {len(failed)} "
+        f"in {elapsed:.1f}s"
+    )
+    return 1 if failed else 0
+
+
+def _write(chunks: Iterator[bytes], out: BinaryIO) -> None:
+    """
+    Write every chunk to out as it comes.
+    """
+    for chunk in chunks:
+        out.write(chunk)
+
+
+def export(args: argparse.Namespace) -> int:
+    """
+    Stream a table to args.output (stdout by default) as ndjson or csv.
+    """
+    storage = open_storage(args.db, pool_size=1, config=StorageConfig.from_env())
+    try:
+        if args.table == "accounts":
+            chunks = storage.iter_accounts(args.chunk_size)
+            fields = ACCOUNT_FIELDS
+        else:
+            chunks = storage.iter_transactions(args.account, args.chunk_size)
+            fields = TRANSACTION_FIELDS
+        body = encode_rows(chunks, fields, args.format)
+        if args.gzip:
+            body = gzip_stream(body)
+        if args.output in (None, "-"):
+            _write(body, sys.stdout.buffer)
+            sys.stdout.buffer.flush()
+        else:
+            with open(args.output, "wb") as out:
+                _write(body, out)
+    finally:
+        storage.close()
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Parse the command line and run the chosen command.
+    """
+    parser = argparse.ArgumentParser(prog="python -m app.cli")
+    parser.add_argument(
+        "--db",
+        default="bank.db",
+        help="sqlite database file, the snapshot with BANK_ENGINE=memory",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    p = commands.add_parser("provision", help="create accounts from a csv/jsonl file")
+    p.add_argument("file")
+    p.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    p.add_argument("--chunk-size", type=int, default=CREATE_CHUNK_SIZE)
+    p.set_defaults(func=provision)
+
+    p = commands.add_parser("export", help="stream accounts or transactions out")
+    p.add_argument("table", choices=["accounts", "transactions"])
+    p.add_argument("--account", type=int, help="only the transactions of this id")
+    p.add_argument("--format", choices=["ndjson", "csv"], default="ndjson")
+    p.add_argument("--gzip", action="store_true")
+    p.add_argument("-o", "--output", help="file to write, stdout by default")
+    p.add_argument("--chunk-size", type=int, default=EXPORT_CHUNK_SIZE)
+    p.set_defaults(func=export)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
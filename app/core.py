@@ -6,14 +6,30 @@ Implement the app class that deal with action and account.
 
 from __future__ import annotations
 
+from typing import Optional, Tuple
+
 from .actions import Action
 from .context import AppView
-from .domain import AccountStorage
+from .domain import (
+    BankAccount,
+    SessionStore,
+    StorageBackend,
+    StorageConfig,
+    enable_from_env,
+    open_storage,
+)
 from .network import get_exchange_rates
-from .render_spec import RenderSpec
+from .rates import matrix_for
+from .render_spec import RenderSpec, Status
 from .states import LoginState
 
-__all__ = ["App"]
+__all__ = ["App", "SessionExpired"]
+
+
+class SessionExpired(RuntimeError):
+    """
+    The session of the logged in account expired or was revoked.
+    """
 
 
 class App(AppView):
@@ -21,24 +37,51 @@ class App(AppView):
     Used to talk to Action and BankAccount. Leave the tui to state.
     """
 
-    def __init__(self) -> None:
-        self.storage = AccountStorage()
+    def __init__(
+        self,
+        sessions: Optional[SessionStore] = None,
+        storage: Optional[StorageBackend] = None,
+    ) -> None:
+        """
+        Without a storage, open the engine BANK_ENGINE asks for and turn on
+        the group commit ledger if enable_from_env finds it asked for.
+        The account cache stays off, the api may write the same file.
+        """
+        self._owns_storage = storage is None
+        if storage is None:
+            storage = open_storage(config=StorageConfig.from_env())
+            enable_from_env(storage)
+        self.storage = storage
+        self.sessions = sessions if sessions is not None else SessionStore()
         self._account = None
+        self._token: Optional[str] = None
         self.state = LoginState()
         self.state.on_enter()
 
+    def close(self) -> None:
+        """
+        Close the storage if the app opened it, flushing its ledger.
+        """
+        if self._owns_storage:
+            self.storage.close()
+
     def login(self, id: int, pin: str) -> bool:
         """
         Login using the database.
         If login failed, return False.
+        A session is opened in the same store the api uses.
         """
         acct = self.storage.get_account(id, pin)
         if not acct:
             return False
         self._account = acct
+        self._token = self.sessions.issue(acct.id)
         return True
 
     def logout(self) -> None:
+        if self._token is not None:
+            self.sessions.revoke(self._token)
+        self._token = None
         self._account = None
 
     @property
@@ -59,18 +102,20 @@ class App(AppView):
         Apply a deposit.
         """
         self._require_login()
-        self._account.deposit(amount)
-        self.storage.update_balance(self._account)
+        balance = self.storage.apply_delta(self._account.id, amount)
+        if balance is not None:
+            self._sync_balance(balance)
 
-    def withdraw(self, amount: int) -> None:
+    def withdraw(self, amount: int) -> Tuple[bool, Optional[str]]:
         """
         Apply a withdraw.
         """
         self._require_login()
-        ok, err = self._account.withdraw(amount)
-        if ok:
-            self.storage.update_balance(self._account)
-        return ok, err
+        balance = self.storage.try_withdraw(self._account.id, amount)
+        if balance is None:
+            return False, "Not enough balance"
+        self._sync_balance(balance)
+        return True, None
 
     def render(self) -> RenderSpec:
         """
@@ -81,23 +126,40 @@ class App(AppView):
     def dispatch(self, event: Action | str) -> None:
         """
         Call state based on Action or text.
+        An expired session sends the app back to login.
         """
         if event is None:
             return
-        if isinstance(event, str):
-            next_state = self.state.on_text(event, self)
-        elif isinstance(event, Action):
-            next_state = self.state.on_ui(event, self)
-        else:
-            return
+        try:
+            if isinstance(event, str):
+                next_state = self.state.on_text(event, self)
+            elif isinstance(event, Action):
+                next_state = self.state.on_ui(event, self)
+            else:
+                return
+        except SessionExpired as e:
+            next_state = LoginState(status=Status(kind="error", text=str(e)))
         self.state = next_state
 
+    def _sync_balance(self, balance: int) -> None:
+        """
+        Replace the logged in account with the balance sqlite returned.
+        """
+        self._account = BankAccount(
+            id=self._account.id, pin=self._account.pin, _balance=balance
+        )
+
     def _require_login(self) -> None:
         """
-        Needs login to perform
+        Needs login to perform, with a session that is still live.
+        Raises SessionExpired and logs out once it is not.
         """
         if self._account is None:
             raise RuntimeError("Log in first.")
+        if self._token is None or self.sessions.resolve(self._token) is None:
+            self._token = None
+            self._account = None
+            raise SessionExpired("Session expired, log in again.")
 
     def convert_balance_to(self, target: str) -> tuple[bool, str]:
         """
@@ -108,8 +170,7 @@ class App(AppView):
         ok, rates, err = get_exchange_rates(base=base, timeout=5.0)
         if not ok and rates is None:
             return False, (err or "Network unavailable")
-        rate_map = rates if rates else {}
-        rate = rate_map.get(target.upper())
+        rate = matrix_for(rates).rate(base, target) if rates else None
         if rate is None:
             return False, "Invalid or unsupported currency code"
 
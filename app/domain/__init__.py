@@ -1,6 +1,31 @@
 """
 domain
 """
+
 from .account import *
+from .async_storage import *
+from .backend import *
+from .batch import *
+from .cache import *
+from .config import *
+from .hashing import *
+from .ledger import *
+from .locks import *
+from .memory import *
+from .session import *
+from .sharding import *
 
-__all__ = account.__all__
+__all__ = (
+    account.__all__
+    + async_storage.__all__
+    + backend.__all__
+    + batch.__all__
+    + cache.__all__
+    + config.__all__
+    + hashing.__all__
+    + ledger.__all__
+    + locks.__all__
+    + memory.__all__
+    + session.__all__
+    + sharding.__all__
+)
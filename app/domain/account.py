@@ -4,25 +4,63 @@ account.py
 This module is used to define the back account class
 """
 
+import queue
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager, nullcontext
 from dataclasses import dataclass
-from typing import Optional, Tuple
+from itertools import islice
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
 
-import bcrypt
+from .batch import AccountBatch
+from .cache import CACHE_SIZE, CACHE_TTL, AccountCache
+from .config import DURABILITY_PROFILES, StorageConfig
+from .hashing import PinHasher
+from .ledger import (
+    GROUP_COMMIT_BATCH,
+    GROUP_COMMIT_DELAY_MS,
+    GroupCommitLedger,
+    WriteCoalescer,
+)
+from .locks import LOCK_STRIPES, AccountLocks
 
-__all__ = ["BankAccount", "AccountStorage"]
+__all__ = ["AccountExistsError", "BankAccount", "Transaction", "AccountStorage"]
 
+# Accounts per transaction in create_accounts and ids per query in get_balances,
+# kept under sqlite's 999 variables.
+CREATE_CHUNK_SIZE = 500
 
-@dataclass
+# Rows per fetchmany() round trip when streaming a whole table out.
+EXPORT_CHUNK_SIZE = 1000
+
+# How many times mutate() re-reads and retries after losing a compare-and-swap.
+MUTATE_RETRIES = 5
+
+
+@dataclass(slots=True)
 class BankAccount:
     """
     DataClass that defines the BankAccount.
-    has pin, id, _balance.
+    has pin, id, _balance and the version of the row it was read from.
+    Slotted, an account carries no __dict__.
     """
 
     id: int
     pin: str
     _balance: int
+    version: int = 0
 
     def deposit(self, amount: int) -> None:
         """
@@ -47,106 +85,855 @@ class BankAccount:
         return self._balance
 
 
+@dataclass
+class Transaction:
+    """
+    DataClass for one balance change of an account.
+    amount is signed, balance is the balance right after the change.
+    """
+
+    id: int
+    account_id: int
+    kind: str
+    amount: int
+    balance: int
+    timestamp: float
+
+
+class AccountExistsError(ValueError):
+    """
+    Raised by insert_account when the id already has an account, by every engine.
+    """
+
+
+def _account_row(cursor: sqlite3.Cursor, row: Tuple[Any, ...]) -> BankAccount:
+    """
+    Row factory for SELECT id, balance, version cursors,
+    builds the account positionally straight from the sqlite tuple.
+    """
+    return BankAccount(row[0], "", int(row[1]), row[2])
+
+
+def _validate_new_account(row: Tuple[Any, Any, Any]) -> Optional[str]:
+    """
+    Return why an (id, pin, initial_balance) row can not be created, None if it can.
+    """
+    id, pin, balance = row
+    if not isinstance(id, int) or isinstance(id, bool):
+        return "Invalid id"
+    if not isinstance(pin, str) or not pin:
+        return "Invalid pin"
+    if not isinstance(balance, int) or isinstance(balance, bool) or balance < 0:
+        return "Invalid initial balance"
+    return None
+
+
+def _check_new_accounts(
+    chunk: Sequence[Tuple[Any, Any, Any]],
+    existing: Callable[[Set[Any]], Set[Any]],
+) -> List[Optional[str]]:
+    """
+    The error of every row of a create_accounts chunk, None for the rows to create.
+    existing(ids) returns the ids among ids that are already taken.
+    """
+    errors: List[Optional[str]] = [_validate_new_account(row) for row in chunk]
+    seen = set()
+    for i, (id, _, _) in enumerate(chunk):
+        if errors[i] is None:
+            if id in seen:
+                errors[i] = "Duplicate id in batch"
+            seen.add(id)
+    taken = existing(seen) if seen else set()
+    for i, (id, _, _) in enumerate(chunk):
+        if errors[i] is None and id in taken:
+            errors[i] = "Account already exists"
+    return errors
+
+
+def _mutate(
+    storage: Any,
+    id: int,
+    read: Callable[[int], Optional[BankAccount]],
+    change: Callable[[BankAccount], Optional[str]],
+    kind: str,
+    retries: int,
+) -> Tuple[Optional[BankAccount], Optional[str]]:
+    """
+    The retry loop of mutate for any engine: read(id) loads the stored account,
+    storage.update_balance writes it back and storage.locks, if set, is held throughout.
+    """
+    with storage.locks.hold([id]) if storage.locks is not None else nullcontext():
+        for attempt in range(retries + 1):
+            if attempt:
+                storage._count("cas_retries")
+            account = read(id)
+            if account is None:
+                return None, "Account not found"
+            err = change(account)
+            if err is not None:
+                return None, err
+            if storage.update_balance(account, kind):
+                return account, None
+        storage._count("cas_conflicts")
+        return None, "Version conflict"
+
+
+def _record_in(
+    conn: sqlite3.Connection, rows: Iterable[Tuple[int, str, int, int]]
+) -> None:
+    """
+    Write (account id, kind, signed amount, resulting balance) rows to the
+    transactions table inside the open transaction of conn.
+    """
+    now = time.time()
+    conn.executemany(
+        "INSERT INTO transactions "
+        "(account_id, kind, amount, resulting_balance, timestamp) "
+        "VALUES (?, ?, ?, ?, ?)",
+        [(id, kind, amount, balance, now) for id, kind, amount, balance in rows],
+    )
+
+
+def _add_in(
+    conn: sqlite3.Connection, id: int, amount: int, version: Optional[int] = None
+) -> Optional[int]:
+    """
+    Add amount to the balance inside the open transaction of conn.
+    With version, only if the row is still at that version.
+    Returns the new balance, None if the account does not exist or moved on.
+    """
+    sql = "UPDATE accounts SET balance = balance + ?, version = version + 1 WHERE id=?"
+    params: Tuple[int, ...] = (amount, id)
+    if version is not None:
+        sql += " AND version=?"
+        params += (version,)
+    row = conn.execute(sql + " RETURNING balance", params).fetchone()
+    return int(row[0]) if row else None
+
+
+def _withdraw_in(
+    conn: sqlite3.Connection, id: int, amount: int, version: Optional[int] = None
+) -> Optional[int]:
+    """
+    Take amount out of the balance inside the open transaction of conn.
+    With version, only if the row is still at that version.
+    Returns the new balance, None if the account is missing, short of funds or moved on.
+    """
+    sql = (
+        "UPDATE accounts SET balance = balance - ?, version = version + 1 "
+        "WHERE id=? AND balance >= ?"
+    )
+    params: Tuple[int, ...] = (amount, id, amount)
+    if version is not None:
+        sql += " AND version=?"
+        params += (version,)
+    row = conn.execute(sql + " RETURNING balance", params).fetchone()
+    return int(row[0]) if row else None
+
+
+def _apply_in(
+    conn: sqlite3.Connection,
+    id: int,
+    kind: str,
+    amount: int,
+    version: Optional[int] = None,
+) -> Tuple[Optional[int], Optional[str]]:
+    """
+    Apply and record one deposit or withdraw inside the open transaction of conn.
+    With version, the account has to still be at that version.
+    Returns (balance, None) or (None, error).
+    """
+    if kind == "deposit":
+        balance = _add_in(conn, id, amount, version)
+        delta = amount
+    elif kind == "withdraw":
+        balance = _withdraw_in(conn, id, amount, version)
+        delta = -amount
+    else:
+        return None, "Unknown operation"
+    if balance is not None:
+        _record_in(conn, [(id, kind, delta, balance)])
+        return balance, None
+    row = conn.execute("SELECT version FROM accounts WHERE id=?", (id,)).fetchone()
+    if row is None:
+        return None, "Account not found"
+    if version is not None and row[0] != version:
+        return None, "Version mismatch"
+    return None, "Not enough balance"
+
+
+def _coalesce_in(
+    conn: sqlite3.Connection, id: int, ops: Sequence[Tuple[str, int]]
+) -> List[Tuple[Optional[int], Optional[str]]]:
+    """
+    Apply (kind, amount) ops to one account with a single UPDATE inside the open
+    transaction of conn. The ops are replayed in order on a BankAccount first,
+    a withdraw that would overdraw fails alone and the others still apply.
+    Returns a (balance, error) pair per op.
+    """
+    row = conn.execute("SELECT balance FROM accounts WHERE id=?", (id,)).fetchone()
+    if row is None:
+        return [(None, "Account not found")] * len(ops)
+    account = BankAccount(id=id, pin="", _balance=int(row[0]))
+    results: List[Tuple[Optional[int], Optional[str]]] = []
+    records = []
+    for kind, amount in ops:
+        if kind == "deposit":
+            account.deposit(amount)
+            delta = amount
+        elif kind == "withdraw":
+            ok, err = account.withdraw(amount)
+            if not ok:
+                results.append((None, err))
+                continue
+            delta = -amount
+        else:
+            results.append((None, "Unknown operation"))
+            continue
+        results.append((account.get_balance(), None))
+        records.append((id, kind, delta, account.get_balance()))
+    if records:
+        conn.execute(
+            "UPDATE accounts SET balance=?, version = version + ? WHERE id=?",
+            (account.get_balance(), len(records), id),
+        )
+        _record_in(conn, records)
+    return results
+
+
 class AccountStorage:
     """
     Persistent data stroage class
     """
 
-    def __init__(self, db_path: str = "bank.db") -> None:
+    def __init__(
+        self,
+        db_path: str = "bank.db",
+        pool_size: int = 8,
+        hasher: Optional[PinHasher] = None,
+        config: Optional[StorageConfig] = None,
+    ) -> None:
         """
         Create a database in db_path.
         Will try to create table accounts if not existed.
+        Keeps up to pool_size connections open and hands them out per call.
+        PINs are hashed by hasher, inline by default.
+        config sets up every connection, the balanced profile by default.
         """
         self.db_path = db_path
+        self.pool_size = pool_size
+        self.config = config if config is not None else StorageConfig()
+        self.hasher = hasher if hasher is not None else PinHasher()
+        self.ledger: Optional[GroupCommitLedger] = None
+        self.cache: Optional[AccountCache] = None
+        self.locks: Optional[AccountLocks] = None
+        self._contention = dict.fromkeys(
+            ("cas_failures", "cas_retries", "cas_conflicts", "version_mismatches"), 0
+        )
+        self._contention_lock = threading.Lock()
+        self._pool: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._opened: List[sqlite3.Connection] = []
+        self._pool_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._closed = False
         self._init_db()
 
     def _connect(self) -> sqlite3.Connection:
         """
         Tried to establish a connection with the sqlite database.
+        The connection may be used from any thread, but only by one at a time.
         """
-        return sqlite3.connect(self.db_path)
+        conn = sqlite3.connect(
+            self.db_path,
+            check_same_thread=False,
+            cached_statements=self.config.cached_statements,
+        )
+        for name, value in self.config.pragmas():
+            conn.execute(f"PRAGMA {name}={value}")
+        return conn
 
-    def _init_db(self) -> None:
+    @contextmanager
+    def _connection(self) -> Iterator[sqlite3.Connection]:
         """
-        Try to create table if not exists.
+        Borrow a connection from the pool, open a new one if the pool is not full yet.
+        Blocks until another caller gives one back otherwise.
         """
-        conn = self._connect()
+        if self._closed:
+            raise RuntimeError("Storage is closed.")
         try:
-            conn.execute(
-                """
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = None
+            with self._pool_lock:
+                if len(self._opened) < self.pool_size:
+                    conn = self._connect()
+                    self._opened.append(conn)
+            if conn is None:
+                conn = self._pool.get()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._pool.put(conn)
+
+    @contextmanager
+    def _writer(self, durable: bool = False) -> Iterator[sqlite3.Connection]:
+        """
+        Borrow a connection while holding the write lock of this database file.
+        sqlite lets one writer in per file anyway, queueing on a lock here is
+        cheaper than its busy handler sleeping and retrying.
+        With durable the commits on it fsync whatever the durability profile.
+        """
+        with self._write_lock, self._connection() as conn:
+            if not durable:
+                yield conn
+                return
+            conn.execute("PRAGMA synchronous=FULL")
+            try:
+                yield conn
+            finally:
+                if conn.in_transaction:
+                    conn.rollback()
+                conn.execute(
+                    f"PRAGMA synchronous={DURABILITY_PROFILES[self.config.durability]}"
+                )
+
+    def enable_group_commit(
+        self,
+        max_delay_ms: float = GROUP_COMMIT_DELAY_MS,
+        max_batch: int = GROUP_COMMIT_BATCH,
+        coalesce: bool = False,
+    ) -> None:
+        """
+        Send apply_delta and try_withdraw through a GroupCommitLedger,
+        which commits them in batches of up to max_batch every max_delay_ms.
+        With coalesce, a WriteCoalescer also folds the changes of one account
+        in a batch into a single UPDATE.
+        """
+        if self.ledger is None:
+            ledger = WriteCoalescer if coalesce else GroupCommitLedger
+            self.ledger = ledger(self, max_delay_ms, max_batch)
+
+    def ledger_for(self, id: int) -> Optional[GroupCommitLedger]:
+        """
+        The group commit ledger writes to account id go through, if any.
+        """
+        return self.ledger
+
+    def enable_cache(
+        self, max_entries: int = CACHE_SIZE, ttl: float = CACHE_TTL
+    ) -> None:
+        """
+        Serve get_account_by_id from an AccountCache of up to max_entries balances,
+        each kept for at most ttl seconds. Every write path invalidates it.
+        """
+        if self.cache is None:
+            self.cache = AccountCache(max_entries, ttl)
+
+    def enable_locks(self, stripes: int = LOCK_STRIPES) -> None:
+        """
+        Serialize mutate() per account on AccountLocks, so concurrent mutations
+        of a hot account queue up instead of losing compare-and-swaps.
+        """
+        if self.locks is None:
+            self.locks = AccountLocks(stripes)
+
+    def _invalidate(self, ids: Iterable[int]) -> None:
+        """
+        Tell the cache, if any, that ids were just written.
+        """
+        if self.cache is not None:
+            self.cache.invalidate(ids)
+
+    def close(self) -> None:
+        """
+        Flush the ledger, close every pooled connection and the hasher.
+        Each connection runs PRAGMA optimize first, so sqlite can refresh
+        the statistics of the indexes it used.
+        The storage can not be used afterwards.
+        """
+        if self.ledger is not None:
+            self.ledger.close()
+        with self._pool_lock:
+            self._closed = True
+            opened, self._opened = self._opened, []
+        for conn in opened:
+            if self.config.optimize_on_close:
+                conn.execute("PRAGMA optimize")
+            conn.close()
+        self.hasher.close()
+
+    def _init_db(self) -> None:
+        """
+        Try to create the accounts and transactions tables if not exists.
+        """
+        with self._connection() as conn:
+            conn.execute("""
                 CREATE TABLE IF NOT EXISTS accounts (
                     id INTEGER PRIMARY KEY,
                     pin TEXT NOT NULL,
-                    balance INTEGER NOT NULL DEFAULT 0
+                    balance INTEGER NOT NULL DEFAULT 0,
+                    version INTEGER NOT NULL DEFAULT 0
+                )
+                """)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(accounts)")}
+            if "version" not in columns:
+                # databases from before the version column
+                conn.execute(
+                    "ALTER TABLE accounts ADD COLUMN version INTEGER NOT NULL DEFAULT 0"
                 )
-                """
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS transactions (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    account_id INTEGER NOT NULL,
+                    kind TEXT NOT NULL,
+                    amount INTEGER NOT NULL,
+                    resulting_balance INTEGER NOT NULL,
+                    timestamp REAL NOT NULL
+                )
+                """)
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_transactions_account_time "
+                "ON transactions (account_id, timestamp)"
             )
             conn.commit()
-        finally:
-            conn.close()
 
     def create_account(self, id: int, pin: str, initial_balance: int = 0) -> None:
         """
         Create an account given id, pin, and initial_balance, by default the balance would be 0.
         """
-        salt = bcrypt.gensalt(rounds=12)
-        pin_hash = bcrypt.hashpw(pin.encode("utf-8"), salt).decode("utf-8")
+        self.insert_account(id, self.hasher.hash_pin(pin), initial_balance)
 
-        conn = self._connect()
-        try:
-            conn.execute(
-                "INSERT INTO accounts (id, pin, balance) VALUES (?, ?, ?)",
-                (id, pin_hash, initial_balance),
-            )
+    def create_accounts(
+        self,
+        accounts: Iterable[Tuple[Any, Any, Any]],
+        chunk_size: int = CREATE_CHUNK_SIZE,
+    ) -> List[Tuple[Any, Optional[str]]]:
+        """
+        Create many accounts from (id, pin, initial_balance) rows.
+        The rows are consumed chunk by chunk, each chunk is hashed on the hasher
+        and inserted in one transaction.
+        Returns (id, None) for each created account and (id, error) for each rejected row,
+        in the order of the input.
+        """
+        results: List[Tuple[Any, Optional[str]]] = []
+        rows = iter(accounts)
+        while chunk := list(islice(rows, chunk_size)):
+            results.extend(self._create_chunk(chunk))
+        return results
+
+    def _create_chunk(
+        self, chunk: List[Tuple[Any, Any, Any]]
+    ) -> List[Tuple[Any, Optional[str]]]:
+        """
+        Validate, hash and insert one chunk of create_accounts.
+        """
+        errors = _check_new_accounts(chunk, self._existing)
+
+        valid = [row for row, err in zip(chunk, errors) if err is None]
+        hashes = self.hasher.hash_many([pin for _, pin, _ in valid])
+        params = [(id, h, balance) for (id, _, balance), h in zip(valid, hashes)]
+        with self._writer() as conn:
+            try:
+                conn.executemany(
+                    "INSERT INTO accounts (id, pin, balance) VALUES (?, ?, ?)", params
+                )
+                _record_in(conn, [(id, "open", b, b) for id, _, b in params])
+                conn.commit()
+            except sqlite3.IntegrityError:
+                # someone else inserted one of the ids meanwhile, go row by row
+                conn.rollback()
+                failed = set()
+                for param in params:
+                    try:
+                        conn.execute(
+                            "INSERT INTO accounts (id, pin, balance) VALUES (?, ?, ?)",
+                            param,
+                        )
+                    except sqlite3.IntegrityError:
+                        failed.add(param[0])
+                opened = [p for p in params if p[0] not in failed]
+                _record_in(conn, [(id, "open", b, b) for id, _, b in opened])
+                conn.commit()
+                for i, (id, _, _) in enumerate(chunk):
+                    if errors[i] is None and id in failed:
+                        errors[i] = "Account already exists"
+        self._invalidate(id for id, _, _ in params)
+        return [(row[0], err) for row, err in zip(chunk, errors)]
+
+    def _existing(self, ids: Set[Any]) -> Set[Any]:
+        """
+        The ids among ids that have an account.
+        """
+        with self._connection() as conn:
+            placeholders = ",".join("?" * len(ids))
+            return {
+                row[0]
+                for row in conn.execute(
+                    f"SELECT id FROM accounts WHERE id IN ({placeholders})",
+                    tuple(ids),
+                )
+            }
+
+    def insert_account(self, id: int, pin_hash: str, initial_balance: int) -> None:
+        """
+        Insert an account row with an already hashed pin,
+        for callers that hash on their own like AsyncAccountStorage.
+        Raises AccountExistsError if the id is taken.
+        """
+        with self._writer() as conn:
+            try:
+                conn.execute(
+                    "INSERT INTO accounts (id, pin, balance) VALUES (?, ?, ?)",
+                    (id, pin_hash, initial_balance),
+                )
+            except sqlite3.IntegrityError as e:
+                conn.rollback()
+                raise AccountExistsError("Account already exists") from e
+            _record_in(conn, [(id, "open", initial_balance, initial_balance)])
             conn.commit()
-        finally:
-            conn.close()
+        self._invalidate([id])
+
+    def get_account_row(self, id: int) -> Optional[Tuple[int, str, int, int]]:
+        """
+        Return the (id, pin hash, balance, version) row of an account,
+        for callers that check the pin on their own like AsyncAccountStorage.
+        """
+        with self._connection() as conn:
+            return conn.execute(
+                "SELECT id, pin, balance, version FROM accounts WHERE id=?", (id,)
+            ).fetchone()
 
     def get_account(self, id: int, pin: str) -> Optional[BankAccount]:
         """
         Get an account by using id and pin.
         """
-        conn = self._connect()
-        try:
-            cur = conn.cursor()
-            cur.execute("SELECT id, pin, balance FROM accounts WHERE id=?", (id,))
-            row = cur.fetchone()
-            if not row:
-                return None
-
-            stored_hash = row[1].encode("utf-8")
-            if not bcrypt.checkpw(pin.encode("utf-8"), stored_hash):
-                return None
-
-            return BankAccount(id=row[0], pin=pin, _balance=int(row[2]))
-        finally:
-            conn.close()
+        row = self.get_account_row(id)
+        if not row or not self.hasher.check_pin(pin, row[1]):
+            return None
+        return BankAccount(id=row[0], pin=pin, _balance=int(row[2]), version=row[3])
 
     def get_account_by_id(self, id: int) -> Optional[BankAccount]:
         """
         Needed for GET /accounts/{id} without auth.
+        Read through the cache when enable_cache() was called.
+        """
+        if self.cache is not None:
+            cached = self.cache.get(id)
+            if cached is not None:
+                return BankAccount(id=id, pin="", _balance=cached[0], version=cached[1])
+            stamp = self.cache.stamp()
+        with self._connection() as conn:
+            cursor = conn.execute(
+                "SELECT id, balance, version FROM accounts WHERE id=?", (id,)
+            )
+            cursor.row_factory = _account_row
+            account = cursor.fetchone()
+        if account is None:
+            return None
+        if self.cache is not None:
+            self.cache.put(id, (account.get_balance(), account.version), stamp)
+        return account
+
+    def get_balances(self, ids: Optional[Iterable[int]] = None) -> Dict[int, int]:
+        """
+        Return {id: balance} for the given ids, or for every account without ids.
+        Unknown ids are left out.
+        """
+        with self._connection() as conn:
+            if ids is None:
+                return dict(conn.execute("SELECT id, balance FROM accounts"))
+            balances: Dict[int, int] = {}
+            ids = iter(ids)
+            while chunk := list(islice(ids, CREATE_CHUNK_SIZE)):
+                placeholders = ",".join("?" * len(chunk))
+                balances.update(
+                    conn.execute(
+                        f"SELECT id, balance FROM accounts WHERE id IN ({placeholders})",
+                        chunk,
+                    )
+                )
+            return balances
+
+    def load_batch(self, ids: Optional[Iterable[int]] = None) -> AccountBatch:
+        """
+        The given ids, or every account, as one AccountBatch. Unknown ids are left out.
         """
+        with self._connection() as conn:
+            if ids is None:
+                return AccountBatch.from_rows(
+                    conn.execute(
+                        "SELECT id, balance, version FROM accounts ORDER BY id"
+                    )
+                )
+            parts = []
+            ids = iter(ids)
+            while chunk := list(islice(ids, CREATE_CHUNK_SIZE)):
+                placeholders = ",".join("?" * len(chunk))
+                parts.append(
+                    AccountBatch.from_rows(
+                        conn.execute(
+                            "SELECT id, balance, version FROM accounts "
+                            f"WHERE id IN ({placeholders}) ORDER BY id",
+                            chunk,
+                        )
+                    )
+                )
+            return AccountBatch.concat(parts)
+
+    def _stream(
+        self, sql: str, params: Tuple[Any, ...], chunk_size: int
+    ) -> Iterator[List[Tuple[Any, ...]]]:
+        """
+        Run sql on a connection of its own and yield the rows chunk_size at a time.
+        The cursor stays open between chunks, so only one chunk is in memory,
+        and a long export does not hold one of the pooled connections.
+        """
+        if self._closed:
+            raise RuntimeError("Storage is closed.")
         conn = self._connect()
         try:
-            cur = conn.cursor()
-            cur.execute("SELECT id, balance FROM accounts WHERE id=?", (id,))
-            row = cur.fetchone()
-            if not row:
-                return None
-            return BankAccount(id=row[0], pin="", _balance=int(row[1]))
+            cursor = conn.execute(sql, params)
+            while rows := cursor.fetchmany(chunk_size):
+                yield rows
         finally:
             conn.close()
 
-    def update_balance(self, account: BankAccount) -> None:
+    def iter_accounts(
+        self, chunk_size: int = EXPORT_CHUNK_SIZE
+    ) -> Iterator[List[Tuple[int, int]]]:
         """
-        Update the balance in the database using the current account state.
+        Yield every account as chunks of (id, balance) rows ordered by id.
         """
-        conn = self._connect()
-        try:
-            conn.execute(
-                "UPDATE accounts SET balance=? WHERE id=?",
-                (account.get_balance(), account.id),
+        return self._stream(
+            "SELECT id, balance FROM accounts ORDER BY id", (), chunk_size
+        )
+
+    def iter_transactions(
+        self, account_id: Optional[int] = None, chunk_size: int = EXPORT_CHUNK_SIZE
+    ) -> Iterator[List[Tuple[int, int, str, int, int, float]]]:
+        """
+        Yield the transactions of account_id, or of every account, oldest first
+        as chunks of (id, account_id, kind, amount, balance, timestamp) rows.
+        """
+        sql = (
+            "SELECT id, account_id, kind, amount, resulting_balance, timestamp "
+            "FROM transactions "
+        )
+        if account_id is None:
+            return self._stream(sql + "ORDER BY id", (), chunk_size)
+        return self._stream(
+            sql + "WHERE account_id=? ORDER BY timestamp, id", (account_id,), chunk_size
+        )
+
+    def apply_delta(self, id: int, amount: int) -> Optional[int]:
+        """
+        Add amount (may be negative) to the balance inside sqlite.
+        Returns the new balance, or None if the account does not exist.
+        """
+        if self.ledger is not None:
+            return self.ledger.submit(id, "deposit", amount).result()[0]
+        with self._writer() as conn:
+            balance, _ = _apply_in(conn, id, "deposit", amount)
+            conn.commit()
+        if balance is not None:
+            self._invalidate([id])
+        return balance
+
+    def try_withdraw(self, id: int, amount: int) -> Optional[int]:
+        """
+        Take amount out of the balance only if there is enough of it.
+        Returns the new balance, or None if the account is missing or short of funds.
+        """
+        if self.ledger is not None:
+            return self.ledger.submit(id, "withdraw", amount).result()[0]
+        with self._writer() as conn:
+            balance, _ = _apply_in(conn, id, "withdraw", amount)
+            conn.commit()
+        if balance is not None:
+            self._invalidate([id])
+        return balance
+
+    def apply_batch(
+        self,
+        operations: Iterable[Tuple[int, str, int]],
+        atomic: bool = True,
+        durable: bool = False,
+    ) -> Tuple[bool, List[Tuple[Optional[int], Optional[str]]]]:
+        """
+        Apply (account id, "deposit" | "withdraw", amount) operations in one transaction.
+        Returns (committed, results) with a (balance, error) pair per operation.
+        With atomic, the first failing operation rolls the whole batch back,
+        otherwise failing operations are skipped and the rest is committed.
+        With durable the commit is fsynced even when the profile would not.
+        """
+        operations = list(operations)
+        results: List[Tuple[Optional[int], Optional[str]]] = []
+        with self._writer(durable) as conn:
+            for id, kind, amount in operations:
+                result = _apply_in(conn, id, kind, amount)
+                results.append(result)
+                if atomic and result[1] is not None:
+                    conn.rollback()
+                    failed = len(results) - 1
+                    return False, [
+                        result if i == failed else (None, "Rolled back")
+                        for i in range(len(operations))
+                    ]
+            conn.commit()
+        self._invalidate(
+            id for (id, _, _), (_, err) in zip(operations, results) if err is None
+        )
+        return True, results
+
+    def apply_coalesced(
+        self, operations: Iterable[Tuple[int, str, int]], durable: bool = False
+    ) -> List[Tuple[Optional[int], Optional[str]]]:
+        """
+        Apply (account id, "deposit" | "withdraw", amount) operations in one
+        transaction with one UPDATE per account, see _coalesce_in.
+        Failing operations are skipped. Returns a (balance, error) pair per operation.
+        durable as in apply_batch.
+        """
+        operations = list(operations)
+        positions: Dict[int, List[int]] = {}
+        for i, (id, _, _) in enumerate(operations):
+            positions.setdefault(id, []).append(i)
+        results: List[Tuple[Optional[int], Optional[str]]] = [
+            (None, None) for _ in operations
+        ]
+        with self._writer(durable) as conn:
+            # take the write lock of the file before reading the balances
+            conn.execute("BEGIN IMMEDIATE")
+            for id, indices in positions.items():
+                ops = [operations[i][1:] for i in indices]
+                for i, result in zip(indices, _coalesce_in(conn, id, ops)):
+                    results[i] = result
+            conn.commit()
+        self._invalidate(
+            id for (id, _, _), (_, err) in zip(operations, results) if err is None
+        )
+        return results
+
+    def _count(self, counter: str) -> None:
+        """
+        Bump one of the contention counters.
+        """
+        with self._contention_lock:
+            self._contention[counter] += 1
+
+    def contention_metrics(self) -> Dict[str, int]:
+        """
+        How often compare-and-swap writes lost against a concurrent write:
+        cas_failures by update_balance, cas_retries and cas_conflicts (gave up)
+        by mutate, version_mismatches by apply_if_match.
+        """
+        with self._contention_lock:
+            return dict(self._contention)
+
+    def update_balance(self, account: BankAccount, kind: str = "adjustment") -> bool:
+        """
+        Write the balance of account back if the row is still at account.version,
+        the difference is recorded as a transaction of kind.
+        Returns False, and writes nothing, if someone else wrote the row meanwhile
+        or it does not exist. account.version follows the row on success.
+        """
+        with self._writer() as conn:
+            # a plain SELECT does not open a transaction, the version check
+            # of the UPDATE is what guarantees nobody wrote in between
+            row = conn.execute(
+                "SELECT balance, version FROM accounts WHERE id=?", (account.id,)
+            ).fetchone()
+            updated = (
+                row is not None
+                and row[1] == account.version
+                and conn.execute(
+                    "UPDATE accounts SET balance=?, version = version + 1 "
+                    "WHERE id=? AND version=?",
+                    (account.get_balance(), account.id, account.version),
+                ).rowcount
+                == 1
             )
+            if not updated:
+                if row is not None:
+                    self._count("cas_failures")
+                return False
+            delta = account.get_balance() - int(row[0])
+            _record_in(conn, [(account.id, kind, delta, account.get_balance())])
             conn.commit()
-        finally:
-            conn.close()
+        account.version += 1
+        self._invalidate([account.id])
+        return True
+
+    def mutate(
+        self,
+        id: int,
+        change: Callable[[BankAccount], Optional[str]],
+        kind: str = "adjustment",
+        retries: int = MUTATE_RETRIES,
+    ) -> Tuple[Optional[BankAccount], Optional[str]]:
+        """
+        Load an account, let change() edit it and write it back with update_balance.
+        change returns an error to give up with, or None.
+        A lost compare-and-swap re-reads the account and runs change again,
+        up to retries times.
+        Returns (account, None) or (None, error), "Version conflict" once out of retries.
+        With enable_locks() the whole loop holds the lock of id.
+        """
+        return _mutate(self, id, self._read_account, change, kind, retries)
+
+    def _read_account(self, id: int) -> Optional[BankAccount]:
+        """
+        The account as stored, past the cache.
+        """
+        with self._connection() as conn:
+            cursor = conn.execute(
+                "SELECT id, balance, version FROM accounts WHERE id=?", (id,)
+            )
+            cursor.row_factory = _account_row
+            return cursor.fetchone()
+
+    def apply_if_match(
+        self, id: int, kind: str, amount: int, version: int
+    ) -> Tuple[Optional[int], Optional[str]]:
+        """
+        Deposit or withdraw only if the account is still at version, for clients
+        that do their own retries (If-Match). Skips the group commit ledger.
+        Returns (balance, None) or (None, error), "Version mismatch" if it moved on.
+        """
+        with self._writer() as conn:
+            balance, err = _apply_in(conn, id, kind, amount, version)
+            conn.commit()
+        if err == "Version mismatch":
+            self._count("version_mismatches")
+        if balance is not None:
+            self._invalidate([id])
+        return balance, err
+
+    def list_transactions(
+        self,
+        account_id: int,
+        limit: int = 50,
+        before: Optional[Tuple[float, int]] = None,
+    ) -> Tuple[List[Transaction], Optional[Tuple[float, int]]]:
+        """
+        Return a page of the transactions of an account, newest first.
+        before is the (timestamp, id) cursor of the last row of the previous page.
+        Returns (page, cursor of the next page or None on the last page).
+        Seeks through the (account_id, timestamp) index, so deep pages cost the same.
+        """
+        sql = (
+            "SELECT id, account_id, kind, amount, resulting_balance, timestamp "
+            "FROM transactions WHERE account_id=? "
+        )
+        params: Tuple[Any, ...] = (account_id,)
+        if before is not None:
+            sql += "AND (timestamp, id) < (?, ?) "
+            params += tuple(before)
+        sql += "ORDER BY timestamp DESC, id DESC LIMIT ?"
+        with self._connection() as conn:
+            rows = conn.execute(sql, params + (limit + 1,)).fetchall()
+        page = [Transaction(*row) for row in rows[:limit]]
+        cursor = (page[-1].timestamp, page[-1].id) if len(rows) > limit else None
+        return page, cursor
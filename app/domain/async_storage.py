@@ -0,0 +1,184 @@
+"""
+async_storage.py
+
+Awaitable front of an AccountStorage for the fastapi app.
+sqlite calls run on a small executor of its own, sized like the connection pool,
+and PIN hashing runs on the PinHasher, so a request that waits on either
+holds no threadpool thread and the event loop keeps serving the others.
+With AsyncAccountLocks, mutations of one account wait for each other on the loop
+before they take a database thread.
+"""
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import (
+    Any,
+    AsyncContextManager,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+from .account import BankAccount, Transaction
+from .batch import AccountBatch
+from .locks import AsyncAccountLocks
+
+__all__ = ["AsyncAccountStorage"]
+
+DB_WORKERS = 8
+
+T = TypeVar("T")
+
+
+class AsyncAccountStorage:
+    """
+    Wraps an AccountStorage (or ShardedAccountStorage) that stays the owner of
+    the connections, closing the wrapper only stops its executor.
+    locks, if given, serialize the mutations per account.
+    """
+
+    def __init__(
+        self,
+        storage: Any,
+        workers: int = DB_WORKERS,
+        locks: Optional[AsyncAccountLocks] = None,
+    ) -> None:
+        self.storage = storage
+        self.hasher = storage.hasher
+        self.locks = locks
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="db"
+        )
+
+    async def _run(self, fn: Callable[..., T], *args: Any) -> T:
+        """
+        Run a blocking storage call on the database executor.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(fn, *args))
+
+    def _hold(self, ids: Iterable[int]) -> AsyncContextManager[None]:
+        """
+        The locks of ids, or nothing without locks.
+        """
+        if self.locks is None:
+            return nullcontext()
+        return self.locks.hold(ids)
+
+    def close(self, wait: bool = True) -> None:
+        """
+        Stop the database executor, the running calls still finish.
+        """
+        self._executor.shutdown(wait=wait)
+
+    async def create_account(self, id: int, pin: str, initial_balance: int = 0) -> None:
+        """
+        Hash on the hasher, insert on the database executor.
+        """
+        pin_hash = await self.hasher.hash_pin_async(pin)
+        await self._run(self.storage.insert_account, id, pin_hash, initial_balance)
+
+    async def create_accounts(
+        self, accounts: Iterable[Tuple[Any, Any, Any]]
+    ) -> List[Tuple[Any, Optional[str]]]:
+        return await self._run(self.storage.create_accounts, list(accounts))
+
+    async def get_account(self, id: int, pin: str) -> Optional[BankAccount]:
+        """
+        Read on the database executor, check the pin on the hasher.
+        """
+        row = await self._run(self.storage.get_account_row, id)
+        if not row or not await self.hasher.check_pin_async(pin, row[1]):
+            return None
+        return BankAccount(id=row[0], pin=pin, _balance=int(row[2]), version=row[3])
+
+    async def get_account_by_id(
+        self, id: int, fresh: bool = False
+    ) -> Optional[BankAccount]:
+        """
+        With fresh, read the stored row past the account cache.
+        """
+        if not fresh:
+            return await self._run(self.storage.get_account_by_id, id)
+        row = await self._run(self.storage.get_account_row, id)
+        if not row:
+            return None
+        return BankAccount(id=row[0], pin="", _balance=int(row[2]), version=row[3])
+
+    async def get_balances(self, ids: Optional[Iterable[int]] = None) -> Dict[int, int]:
+        return await self._run(
+            self.storage.get_balances, None if ids is None else list(ids)
+        )
+
+    async def load_batch(self, ids: Optional[Iterable[int]] = None) -> AccountBatch:
+        return await self._run(
+            self.storage.load_batch, None if ids is None else list(ids)
+        )
+
+    async def _submit(self, id: int, kind: str, amount: int) -> Optional[int]:
+        """
+        Await the ledger future of a deposit or withdraw with group commit on.
+        """
+        future = self.storage.ledger_for(id).submit(id, kind, amount)
+        return (await asyncio.wrap_future(future))[0]
+
+    async def apply_delta(self, id: int, amount: int) -> Optional[int]:
+        """
+        The ledger orders its own writes, so that path takes no lock.
+        """
+        if self.storage.ledger_for(id) is not None:
+            return await self._submit(id, "deposit", amount)
+        async with self._hold([id]):
+            return await self._run(self.storage.apply_delta, id, amount)
+
+    async def try_withdraw(self, id: int, amount: int) -> Optional[int]:
+        if self.storage.ledger_for(id) is not None:
+            return await self._submit(id, "withdraw", amount)
+        async with self._hold([id]):
+            return await self._run(self.storage.try_withdraw, id, amount)
+
+    async def apply_batch(
+        self, operations: Iterable[Tuple[int, str, int]], atomic: bool = True
+    ) -> Tuple[bool, List[Tuple[Optional[int], Optional[str]]]]:
+        operations = list(operations)
+        async with self._hold(op[0] for op in operations):
+            return await self._run(self.storage.apply_batch, operations, atomic)
+
+    async def apply_if_match(
+        self, id: int, kind: str, amount: int, version: int
+    ) -> Tuple[Optional[int], Optional[str]]:
+        async with self._hold([id]):
+            return await self._run(
+                self.storage.apply_if_match, id, kind, amount, version
+            )
+
+    async def update_balance(
+        self, account: BankAccount, kind: str = "adjustment"
+    ) -> bool:
+        async with self._hold([account.id]):
+            return await self._run(self.storage.update_balance, account, kind)
+
+    async def mutate(
+        self,
+        id: int,
+        change: Callable[[BankAccount], Optional[str]],
+        kind: str = "adjustment",
+    ) -> Tuple[Optional[BankAccount], Optional[str]]:
+        async with self._hold([id]):
+            return await self._run(self.storage.mutate, id, change, kind)
+
+    async def list_transactions(
+        self,
+        account_id: int,
+        limit: int = 50,
+        before: Optional[Tuple[float, int]] = None,
+    ) -> Tuple[List[Transaction], Optional[Tuple[float, int]]]:
+        return await self._run(
+            self.storage.list_transactions, account_id, limit, before
+        )
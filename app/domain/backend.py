@@ -0,0 +1,246 @@
+"""
+backend.py
+
+What the api, the cli and the tui need from a storage engine,
+and open_storage to get the engine a StorageConfig asks for.
+"""
+
+from __future__ import annotations
+
+import os
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Protocol,
+    Tuple,
+)
+
+from .account import (
+    CREATE_CHUNK_SIZE,
+    EXPORT_CHUNK_SIZE,
+    MUTATE_RETRIES,
+    AccountStorage,
+    BankAccount,
+    Transaction,
+)
+from .batch import AccountBatch
+from .cache import CACHE_SIZE, CACHE_TTL, AccountCache
+from .config import StorageConfig
+from .hashing import PinHasher
+from .ledger import GROUP_COMMIT_BATCH, GROUP_COMMIT_DELAY_MS, GroupCommitLedger
+from .locks import LOCK_STRIPES, AccountLocks
+from .memory import MEMORY_PATH, MemoryAccountStorage
+
+__all__ = ["StorageBackend", "enable_from_env", "open_storage"]
+
+
+class StorageBackend(Protocol):
+    """
+    The public methods AccountStorage, MemoryAccountStorage and
+    ShardedAccountStorage share, all of them blocking.
+    AsyncAccountStorage wraps any of them for the event loop.
+    See AccountStorage for what each of them returns.
+    """
+
+    hasher: PinHasher
+    ledger: Optional[GroupCommitLedger]
+    cache: Optional[AccountCache]
+    locks: Optional[AccountLocks]
+
+    def enable_group_commit(
+        self,
+        max_delay_ms: float = GROUP_COMMIT_DELAY_MS,
+        max_batch: int = GROUP_COMMIT_BATCH,
+        coalesce: bool = False,
+    ) -> None:
+        """
+        Route apply_delta and try_withdraw through a ledger.
+        """
+
+    def ledger_for(self, id: int) -> Optional[GroupCommitLedger]:
+        """
+        The ledger that writes account id, None without group commit.
+        """
+
+    def enable_cache(
+        self, max_entries: int = CACHE_SIZE, ttl: float = CACHE_TTL
+    ) -> None:
+        """
+        Cache get_account_by_id, where the engine has anything to gain from it.
+        """
+
+    def enable_locks(self, stripes: int = LOCK_STRIPES) -> None:
+        """
+        Serialize mutate per account.
+        """
+
+    def close(self) -> None:
+        """
+        Flush and release everything, the storage can not be used afterwards.
+        """
+
+    def create_account(self, id: int, pin: str, initial_balance: int = 0) -> None:
+        """
+        Create one account.
+        """
+
+    def create_accounts(
+        self,
+        accounts: Iterable[Tuple[Any, Any, Any]],
+        chunk_size: int = CREATE_CHUNK_SIZE,
+    ) -> List[Tuple[Any, Optional[str]]]:
+        """
+        Create (id, pin, initial_balance) rows, an (id, error) pair each.
+        """
+
+    def insert_account(self, id: int, pin_hash: str, initial_balance: int) -> None:
+        """
+        Create one account with an already hashed pin,
+        AccountExistsError if the id is taken.
+        """
+
+    def get_account_row(self, id: int) -> Optional[Tuple[int, str, int, int]]:
+        """
+        The (id, pin hash, balance, version) of an account.
+        """
+
+    def get_account(self, id: int, pin: str) -> Optional[BankAccount]:
+        """
+        The account if the pin matches.
+        """
+
+    def get_account_by_id(self, id: int) -> Optional[BankAccount]:
+        """
+        The account without its pin.
+        """
+
+    def get_balances(self, ids: Optional[Iterable[int]] = None) -> Dict[int, int]:
+        """
+        Balance per id, of every account without ids.
+        """
+
+    def load_batch(self, ids: Optional[Iterable[int]] = None) -> AccountBatch:
+        """
+        The accounts as one AccountBatch.
+        """
+
+    def iter_accounts(
+        self, chunk_size: int = EXPORT_CHUNK_SIZE
+    ) -> Iterator[List[Tuple[int, int]]]:
+        """
+        Chunks of (id, balance) rows ordered by id.
+        """
+
+    def iter_transactions(
+        self, account_id: Optional[int] = None, chunk_size: int = EXPORT_CHUNK_SIZE
+    ) -> Iterator[List[Tuple[int, int, str, int, int, float]]]:
+        """
+        Chunks of transaction rows, of one account or all of them.
+        """
+
+    def apply_delta(self, id: int, amount: int) -> Optional[int]:
+        """
+        Add amount to the balance.
+        """
+
+    def try_withdraw(self, id: int, amount: int) -> Optional[int]:
+        """
+        Take amount out of the balance if there is enough of it.
+        """
+
+    def apply_batch(
+        self,
+        operations: Iterable[Tuple[int, str, int]],
+        atomic: bool = True,
+        durable: bool = False,
+    ) -> Tuple[bool, List[Tuple[Optional[int], Optional[str]]]]:
+        """
+        Apply (id, kind, amount) operations, all or nothing with atomic,
+        fsynced whatever the profile with durable.
+        """
+
+    def apply_coalesced(
+        self, operations: Iterable[Tuple[int, str, int]], durable: bool = False
+    ) -> List[Tuple[Optional[int], Optional[str]]]:
+        """
+        Apply (id, kind, amount) operations, failing ones are skipped.
+        """
+
+    def contention_metrics(self) -> Dict[str, int]:
+        """
+        The compare-and-swap counters.
+        """
+
+    def update_balance(self, account: BankAccount, kind: str = "adjustment") -> bool:
+        """
+        Write the balance back if the account is still at account.version.
+        """
+
+    def mutate(
+        self,
+        id: int,
+        change: Callable[[BankAccount], Optional[str]],
+        kind: str = "adjustment",
+        retries: int = MUTATE_RETRIES,
+    ) -> Tuple[Optional[BankAccount], Optional[str]]:
+        """
+        Read, change and write back an account, retrying lost races.
+        """
+
+    def apply_if_match(
+        self, id: int, kind: str, amount: int, version: int
+    ) -> Tuple[Optional[int], Optional[str]]:
+        """
+        Deposit or withdraw only if the account is still at version.
+        """
+
+    def list_transactions(
+        self,
+        account_id: int,
+        limit: int = 50,
+        before: Optional[Tuple[float, int]] = None,
+    ) -> Tuple[List[Transaction], Optional[Tuple[float, int]]]:
+        """
+        A page of the transactions of an account, newest first.
+        """
+
+
+def open_storage(
+    db_path: Optional[str] = None,
+    pool_size: int = 8,
+    hasher: Optional[PinHasher] = None,
+    config: Optional[StorageConfig] = None,
+) -> StorageBackend:
+    """
+    Open the engine config.engine names at db_path, sqlite without a config.
+    The memory engine keeps its snapshot at db_path, without one it keeps nothing.
+    """
+    if config is not None and config.engine == "memory":
+        return MemoryAccountStorage(db_path or MEMORY_PATH, pool_size, hasher, config)
+    return AccountStorage(db_path or "bank.db", pool_size, hasher, config)
+
+
+def enable_from_env(storage: StorageBackend, cache: bool = False) -> None:
+    """
+    Turn on what the environment asks for, the same for the api and the tui:
+    BANK_GROUP_COMMIT_MS=<ms> the group commit ledger (BANK_COALESCE=1 to fold
+    the writes of an account).
+    With cache, BANK_CACHE_SIZE / BANK_CACHE_TTL the account cache, off unless set.
+    The cache only sees the writes of this storage, turn it on only when nothing
+    else (another process, the tui, the cli) writes the same database.
+    """
+    group_commit_ms = os.getenv("BANK_GROUP_COMMIT_MS")
+    if group_commit_ms:
+        storage.enable_group_commit(
+            max_delay_ms=float(group_commit_ms),
+            coalesce=os.getenv("BANK_COALESCE", "0") == "1",
+        )
+    cache_size = int(os.getenv("BANK_CACHE_SIZE", 0))
+    if cache and cache_size > 0:
+        cache_ttl = float(os.getenv("BANK_CACHE_TTL", CACHE_TTL))
+        storage.enable_cache(max_entries=cache_size, ttl=cache_ttl)
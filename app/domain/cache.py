@@ -0,0 +1,112 @@
+"""
+cache.py
+
+Read-through cache of account rows for GET /accounts/{id}.
+Every write path of AccountStorage invalidates the ids it touched after committing,
+and a read that raced with such a write is not allowed to put its old value back.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+__all__ = ["AccountCache"]
+
+CACHE_SIZE = 10_000
+CACHE_TTL = 5.0
+
+
+class AccountCache:
+    """
+    Bounded id -> value map, AccountStorage keeps (balance, version) in it.
+    The least recently used entries are evicted first
+    and every entry expires ttl seconds after it was read from the database.
+
+    Readers take a stamp() before going to the database and hand it to put().
+    invalidate() bumps the stamp and leaves a tombstone with it, so a put whose
+    stamp is older than the last write of its id is dropped.
+    Tombstones are bounded as well, the newest evicted one becomes a floor
+    that older puts of any id have to clear.
+    """
+
+    def __init__(self, max_entries: int = CACHE_SIZE, ttl: float = CACHE_TTL) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[int, Tuple[Any, float]]" = OrderedDict()
+        self._tombstones: "OrderedDict[int, int]" = OrderedDict()
+        self._stamp = 0
+        self._floor = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stamp(self) -> int:
+        """
+        Current write stamp, take it before reading the database.
+        """
+        with self._lock:
+            return self._stamp
+
+    def get(self, id: int) -> Optional[Any]:
+        """
+        Return the cached value of id, None on a miss or an expired entry.
+        """
+        with self._lock:
+            entry = self._entries.get(id)
+            if entry is not None and entry[1] > time.monotonic():
+                self._entries.move_to_end(id)
+                self._hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[id]
+            self._misses += 1
+            return None
+
+    def put(self, id: int, value: Any, stamp: int) -> bool:
+        """
+        Cache a value read from the database after stamp() returned stamp.
+        Returns False if a write to id may have happened since, nothing is cached then.
+        """
+        with self._lock:
+            if max(self._floor, self._tombstones.get(id, 0)) > stamp:
+                return False
+            self._entries[id] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+            return True
+
+    def invalidate(self, ids: Iterable[int]) -> None:
+        """
+        Drop ids after a write to them was committed.
+        """
+        with self._lock:
+            self._stamp += 1
+            for id in ids:
+                self._entries.pop(id, None)
+                self._tombstones[id] = self._stamp
+                self._tombstones.move_to_end(id)
+                self._invalidations += 1
+            while len(self._tombstones) > self.max_entries:
+                _, stamp = self._tombstones.popitem(last=False)
+                self._floor = max(self._floor, stamp)
+
+    def metrics(self) -> Dict[str, int]:
+        """
+        Hit, miss and eviction counters.
+        """
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "invalidations": self._invalidations,
+            }
@@ -0,0 +1,77 @@
+"""
+config.py
+
+How AccountStorage opens its sqlite connections.
+The durability profile decides how often sqlite waits for fsync, the rest sizes
+the page cache, the memory map and the statement cache of every connection.
+engine picks the storage engine itself, see backend.open_storage.
+"""
+
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass
+from typing import Any, Tuple
+
+__all__ = ["StorageConfig"]
+
+# synchronous per durability profile, every profile runs in WAL mode:
+# strict waits for fsync on every commit, a power loss keeps everything committed.
+# balanced only fsyncs on checkpoints, a power loss may drop the last commits,
+# an application crash loses nothing.
+# fast never fsyncs, a power loss may drop many commits or corrupt the file.
+DURABILITY_PROFILES = {"strict": "FULL", "balanced": "NORMAL", "fast": "OFF"}
+
+# sqlite is AccountStorage, memory is MemoryAccountStorage
+ENGINES = ("sqlite", "memory")
+
+# Compiled statements kept per connection. The batch queries build their
+# IN (?, ?, ...) lists per chunk size, so leave room next to the fixed ones.
+STATEMENT_CACHE_SIZE = 256
+
+
+@dataclass(frozen=True)
+class StorageConfig:
+    """
+    Connection settings of an AccountStorage, balanced is what it used before.
+    cache_size is in KiB, mmap_size in bytes.
+    The memory engine only looks at durability, for its append log.
+    """
+
+    engine: str = "sqlite"
+    durability: str = "balanced"
+    cache_size: int = 16_000
+    mmap_size: int = 64 * 1024 * 1024
+    cached_statements: int = STATEMENT_CACHE_SIZE
+    optimize_on_close: bool = True
+
+    def __post_init__(self) -> None:
+        if self.engine not in ENGINES:
+            raise ValueError(f"engine must be one of {', '.join(ENGINES)}")
+        if self.durability not in DURABILITY_PROFILES:
+            raise ValueError(
+                f"durability must be one of {', '.join(DURABILITY_PROFILES)}"
+            )
+
+    @classmethod
+    def from_env(cls) -> StorageConfig:
+        """
+        BANK_ENGINE picks the engine and BANK_DURABILITY the profile,
+        the rest keeps its defaults.
+        """
+        return cls(
+            engine=os.getenv("BANK_ENGINE", "sqlite"),
+            durability=os.getenv("BANK_DURABILITY", "balanced"),
+        )
+
+    def pragmas(self) -> Tuple[Tuple[str, Any], ...]:
+        """
+        The pragmas to run on every new connection, in order.
+        """
+        return (
+            ("journal_mode", "WAL"),
+            ("synchronous", DURABILITY_PROFILES[self.durability]),
+            ("temp_store", "MEMORY"),
+            ("cache_size", -self.cache_size),  # negative means KiB
+            ("mmap_size", self.mmap_size),
+        )
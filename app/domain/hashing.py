@@ -0,0 +1,172 @@
+"""
+hashing.py
+
+Run the bcrypt work for PINs on a pool of processes,
+so hashing does not hold up the threads serving requests.
+"""
+
+import asyncio
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence
+
+import bcrypt
+
+__all__ = ["PinHasher"]
+
+BCRYPT_ROUNDS = 12
+
+
+def _hash_pin(pin: str, rounds: int) -> str:
+    """
+    Hash a pin with a fresh salt. Runs inside a worker process.
+    """
+    salt = bcrypt.gensalt(rounds=rounds)
+    return bcrypt.hashpw(pin.encode("utf-8"), salt).decode("utf-8")
+
+
+def _hash_pins(pins: Sequence[str], rounds: int) -> List[str]:
+    """
+    Hash a chunk of pins in one go, saves a round trip per pin.
+    """
+    return [_hash_pin(pin, rounds) for pin in pins]
+
+
+def _check_pin(pin: str, pin_hash: str) -> bool:
+    """
+    Check a pin against its stored hash. Runs inside a worker process.
+    """
+    return bcrypt.checkpw(pin.encode("utf-8"), pin_hash.encode("utf-8"))
+
+
+class PinHasher:
+    """
+    Hashes and checks PINs.
+    With workers=0 the work runs in the calling thread,
+    otherwise it is submitted to a pool of that many processes.
+    """
+
+    def __init__(self, workers: int = 0, rounds: int = BCRYPT_ROUNDS) -> None:
+        self.workers = workers
+        self.rounds = rounds
+        self._executor: Optional[ProcessPoolExecutor] = None
+        if workers > 0:
+            self._executor = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._max_pending = 0
+        self._completed = 0
+
+    @property
+    def pending(self) -> int:
+        """
+        Number of hashing jobs submitted but not finished yet, the queue depth.
+        """
+        return self._pending
+
+    def metrics(self) -> Dict[str, int]:
+        """
+        Counters to tell when hashing is saturated.
+        """
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "pending": self._pending,
+                "max_pending": self._max_pending,
+                "completed": self._completed,
+            }
+
+    def _started(self) -> None:
+        """
+        Count a job as queued.
+        """
+        with self._lock:
+            self._pending += 1
+            self._max_pending = max(self._max_pending, self._pending)
+
+    def _finished(self, _: object = None) -> None:
+        """
+        Count a job as done, also used as a future done callback.
+        """
+        with self._lock:
+            self._pending -= 1
+            self._completed += 1
+
+    def _submit(self, fn, *args) -> Future:
+        """
+        Run fn on the pool, or right here when there is no pool.
+        """
+        self._started()
+        if self._executor is None:
+            future: Future = Future()
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                self._finished()
+            return future
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(self._finished)
+        return future
+
+    async def _submit_async(self, fn, *args):
+        """
+        Await fn on the pool, or on a thread when there is no pool.
+        """
+        if self._executor is None:
+            self._started()
+            try:
+                return await asyncio.to_thread(fn, *args)
+            finally:
+                self._finished()
+        return await asyncio.wrap_future(self._submit(fn, *args))
+
+    def hash_pin(self, pin: str) -> str:
+        """
+        Return the bcrypt hash of pin.
+        """
+        return self._submit(_hash_pin, pin, self.rounds).result()
+
+    def hash_many(self, pins: Sequence[str]) -> List[str]:
+        """
+        Return the hashes of pins in the same order.
+        The pins are split in a few chunks per worker so all cores stay busy.
+        """
+        if not pins:
+            return []
+        chunk = max(1, -(-len(pins) // (max(self.workers, 1) * 4)))
+        futures = [
+            self._submit(_hash_pins, pins[i : i + chunk], self.rounds)
+            for i in range(0, len(pins), chunk)
+        ]
+        return [pin_hash for future in futures for pin_hash in future.result()]
+
+    def check_pin(self, pin: str, pin_hash: str) -> bool:
+        """
+        Return True if pin matches pin_hash.
+        """
+        return self._submit(_check_pin, pin, pin_hash).result()
+
+    async def hash_pin_async(self, pin: str) -> str:
+        """
+        Awaitable hash_pin.
+        """
+        return await self._submit_async(_hash_pin, pin, self.rounds)
+
+    async def check_pin_async(self, pin: str, pin_hash: str) -> bool:
+        """
+        Awaitable check_pin.
+        """
+        return await self._submit_async(_check_pin, pin, pin_hash)
+
+    def close(self) -> None:
+        """
+        Shut the worker processes down.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,190 @@
+"""
+ledger.py
+
+Group commit for balance changes.
+Mutations are appended to an in-memory ledger and a committer thread
+writes them to sqlite in one transaction every max_delay_ms or max_batch entries,
+so many writers share a single commit.
+WriteCoalescer goes one step further and folds the entries of one account
+into a single UPDATE of its row.
+"""
+
+from __future__ import annotations
+
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from .account import AccountStorage
+
+__all__ = ["GroupCommitLedger", "WriteCoalescer"]
+
+GROUP_COMMIT_DELAY_MS = 1
+GROUP_COMMIT_BATCH = 256
+
+
+@dataclass
+class LedgerEntry:
+    """
+    One pending mutation, its future resolves to (balance, error) once committed.
+    """
+
+    seq: int
+    account_id: int
+    kind: str
+    amount: int
+    future: Future = field(default_factory=Future)
+
+
+class GroupCommitLedger:
+    """
+    Append-only in-memory ledger in front of an AccountStorage.
+    """
+
+    def __init__(
+        self,
+        storage: "AccountStorage",
+        max_delay_ms: float = GROUP_COMMIT_DELAY_MS,
+        max_batch: int = GROUP_COMMIT_BATCH,
+    ) -> None:
+        self.storage = storage
+        self.max_delay = max_delay_ms / 1000
+        self.max_batch = max_batch
+        self._pending: List[LedgerEntry] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._closing = False
+        self._flushes = 0
+        self._committed = 0
+        self._thread = threading.Thread(
+            target=self._run, name="group-commit", daemon=True
+        )
+        self._thread.start()
+
+    def submit(
+        self, account_id: int, kind: str, amount: int
+    ) -> "Future[Tuple[Optional[int], Optional[str]]]":
+        """
+        Append a "deposit" or "withdraw" to the ledger.
+        The future resolves to (balance, None) or (None, error) once its transaction
+        is committed and fsynced, whatever the durability profile of the storage.
+        """
+        with self._cond:
+            if self._closing:
+                raise RuntimeError("Ledger is closed.")
+            entry = LedgerEntry(next(self._seq), account_id, kind, amount)
+            self._pending.append(entry)
+            if len(self._pending) == 1 or len(self._pending) >= self.max_batch:
+                self._cond.notify()
+        return entry.future
+
+    def metrics(self) -> Dict[str, int]:
+        """
+        Counters of the committer thread.
+        """
+        with self._cond:
+            return {
+                "pending": len(self._pending),
+                "flushes": self._flushes,
+                "committed": self._committed,
+            }
+
+    def _take_batch(self) -> Optional[List[LedgerEntry]]:
+        """
+        Wait for entries, then up to max_delay for the batch to fill.
+        Returns None once the ledger is closed and drained.
+        """
+        with self._cond:
+            while not self._pending and not self._closing:
+                self._cond.wait()
+            if not self._pending:
+                return None
+            deadline = time.monotonic() + self.max_delay
+            while len(self._pending) < self.max_batch and not self._closing:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = self._pending[: self.max_batch]
+            del self._pending[: self.max_batch]
+            return batch
+
+    def _run(self) -> None:
+        """
+        Committer loop, one transaction per batch.
+        """
+        while (batch := self._take_batch()) is not None:
+            self._flush(batch)
+
+    def _flush(self, batch: List[LedgerEntry]) -> None:
+        """
+        Write a batch in one transaction and resolve its futures.
+        """
+        ops = [(e.account_id, e.kind, e.amount) for e in batch]
+        try:
+            results = self._write(ops)
+        except Exception as e:
+            for entry in batch:
+                entry.future.set_exception(e)
+            return
+        with self._cond:
+            self._flushes += 1
+            self._committed += len(batch)
+        for entry, result in zip(batch, results):
+            entry.future.set_result(result)
+
+    def _write(
+        self, ops: List[Tuple[int, str, int]]
+    ) -> List[Tuple[Optional[int], Optional[str]]]:
+        """
+        Write (account id, kind, amount) ops in one durable transaction, one UPDATE each.
+        """
+        return self.storage.apply_batch(ops, atomic=False, durable=True)[1]
+
+    def close(self) -> None:
+        """
+        Flush what is left and stop the committer thread.
+        """
+        with self._cond:
+            self._closing = True
+            self._cond.notify()
+        self._thread.join()
+
+
+class WriteCoalescer(GroupCommitLedger):
+    """
+    Group commit ledger that writes every account of a batch with a single UPDATE.
+    The entries of an account are replayed in arrival order first, so each caller
+    still gets the balance right after its own change, and a withdraw is checked
+    against what the entries before it left.
+    """
+
+    def __init__(
+        self,
+        storage: "AccountStorage",
+        max_delay_ms: float = GROUP_COMMIT_DELAY_MS,
+        max_batch: int = GROUP_COMMIT_BATCH,
+    ) -> None:
+        self._updates = 0
+        super().__init__(storage, max_delay_ms, max_batch)
+
+    def _write(
+        self, ops: List[Tuple[int, str, int]]
+    ) -> List[Tuple[Optional[int], Optional[str]]]:
+        results = self.storage.apply_coalesced(ops, durable=True)
+        with self._cond:
+            self._updates += len({id for id, _, _ in ops})
+        return results
+
+    def metrics(self) -> Dict[str, int]:
+        """
+        Counters of the committer thread, updates is the number of row writes.
+        """
+        metrics = super().metrics()
+        with self._cond:
+            metrics["updates"] = self._updates
+        return metrics
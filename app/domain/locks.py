@@ -0,0 +1,140 @@
+"""
+locks.py
+
+Striped per-account locks for mutations of the same account.
+sqlite already serializes the writes, but the compare-and-swap paths of a hot account
+(payroll, merchant settlement) keep losing and retrying, and every waiter holds a
+database thread while it does. With these locks the callers of a hot account queue in
+process instead, while the other accounts go on in parallel.
+"""
+
+import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Dict, Iterable, Iterator, List
+
+__all__ = ["AccountLocks", "AsyncAccountLocks"]
+
+LOCK_STRIPES = 1024
+# upper bounds of the lock wait histogram, in microseconds
+WAIT_BUCKETS_US = (10, 100, 1_000, 10_000, 100_000)
+
+
+class _StripedLocks:
+    """
+    Maps account ids to a fixed number of stripes and keeps the wait histogram.
+    Two ids may share a stripe, that only costs some parallelism.
+    """
+
+    def __init__(self, stripes: int = LOCK_STRIPES) -> None:
+        if stripes < 1:
+            raise ValueError("stripes must be at least 1")
+        self.stripes = stripes
+        self._metrics_lock = threading.Lock()
+        self._acquired = 0
+        self._contended = 0
+        self._max_wait_us = 0
+        self._buckets = [0] * (len(WAIT_BUCKETS_US) + 1)
+
+    def stripes_of(self, ids: Iterable[int]) -> List[int]:
+        """
+        The stripes of ids without duplicates, in the order they must be taken.
+        Taking them in ascending order is what keeps two multi-account holders
+        from deadlocking each other.
+        """
+        return sorted({hash(id) % self.stripes for id in ids})
+
+    def _record(self, waited: float, contended: bool) -> None:
+        wait_us = int(waited * 1e6)
+        index = 0
+        while index < len(WAIT_BUCKETS_US) and wait_us > WAIT_BUCKETS_US[index]:
+            index += 1
+        with self._metrics_lock:
+            self._acquired += 1
+            self._contended += contended
+            self._max_wait_us = max(self._max_wait_us, wait_us)
+            self._buckets[index] += 1
+
+    def metrics(self) -> Dict[str, int]:
+        """
+        How often the locks were taken, how often someone had to wait and for how long.
+        """
+        with self._metrics_lock:
+            metrics = {
+                "acquired": self._acquired,
+                "contended": self._contended,
+                "max_wait_us": self._max_wait_us,
+            }
+            for bound, count in zip(WAIT_BUCKETS_US, self._buckets):
+                metrics[f"wait_le_{bound}us"] = count
+            metrics[f"wait_gt_{WAIT_BUCKETS_US[-1]}us"] = self._buckets[-1]
+            return metrics
+
+
+class AccountLocks(_StripedLocks):
+    """
+    Striped locks for threads.
+    """
+
+    def __init__(self, stripes: int = LOCK_STRIPES) -> None:
+        super().__init__(stripes)
+        self._locks = [threading.Lock() for _ in range(stripes)]
+
+    @contextmanager
+    def hold(self, ids: Iterable[int]) -> Iterator[None]:
+        """
+        Hold the locks of every id in ids for the duration of the block.
+        """
+        taken: List[threading.Lock] = []
+        contended = False
+        start = time.perf_counter()
+        try:
+            for stripe in self.stripes_of(ids):
+                lock = self._locks[stripe]
+                if not lock.acquire(blocking=False):
+                    contended = True
+                    lock.acquire()
+                taken.append(lock)
+            self._record(time.perf_counter() - start, contended)
+            yield
+        finally:
+            for lock in reversed(taken):
+                lock.release()
+
+
+class AsyncAccountLocks(_StripedLocks):
+    """
+    Striped locks for coroutines of one event loop, a waiter only parks its task.
+    They do not exclude holders of an AccountLocks, use one kind per storage.
+    """
+
+    def __init__(self, stripes: int = LOCK_STRIPES) -> None:
+        super().__init__(stripes)
+        self._locks = [asyncio.Lock() for _ in range(stripes)]
+        # a just released lock still goes to its waiters first, locked() misses them
+        self._waiting = [0] * stripes
+
+    @asynccontextmanager
+    async def hold(self, ids: Iterable[int]) -> AsyncIterator[None]:
+        """
+        Hold the locks of every id in ids for the duration of the block.
+        """
+        taken: List[asyncio.Lock] = []
+        contended = False
+        start = time.perf_counter()
+        try:
+            for stripe in self.stripes_of(ids):
+                lock = self._locks[stripe]
+                contended = contended or lock.locked() or self._waiting[stripe] > 0
+                self._waiting[stripe] += 1
+                try:
+                    await lock.acquire()
+                finally:
+                    self._waiting[stripe] -= 1
+                taken.append(lock)
+            self._record(time.perf_counter() - start, contended)
+            yield
+        finally:
+            for lock in reversed(taken):
+                lock.release()
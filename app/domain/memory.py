@@ -0,0 +1,609 @@
+"""
+memory.py
+
+Dict-based storage engine with the interface of AccountStorage,
+for load tests, throwaway sandboxes and read-heavy replicas.
+Everything lives in memory under one lock. Given a path, the state is kept
+as a json snapshot at that path plus an append-only log of every change since
+(path + "-log"), both read back on open. ":memory:" keeps nothing on disk.
+"""
+
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from itertools import islice
+from typing import (
+    IO,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from .account import (
+    CREATE_CHUNK_SIZE,
+    EXPORT_CHUNK_SIZE,
+    MUTATE_RETRIES,
+    AccountExistsError,
+    BankAccount,
+    Transaction,
+    _check_new_accounts,
+    _mutate,
+)
+from .batch import AccountBatch
+from .cache import CACHE_SIZE, CACHE_TTL, AccountCache
+from .config import StorageConfig
+from .hashing import PinHasher
+from .ledger import (
+    GROUP_COMMIT_BATCH,
+    GROUP_COMMIT_DELAY_MS,
+    GroupCommitLedger,
+    WriteCoalescer,
+)
+from .locks import LOCK_STRIPES, AccountLocks
+
+__all__ = ["MemoryAccountStorage"]
+
+MEMORY_PATH = ":memory:"
+
+# (account id, kind, signed amount, resulting balance), as _record_in takes them
+Record = Tuple[int, str, int, int]
+
+
+@dataclass(slots=True)
+class _Row:
+    """
+    What the accounts table holds for one id.
+    """
+
+    pin: str
+    balance: int
+    version: int = 0
+
+
+class MemoryAccountStorage:
+    """
+    AccountStorage look-alike that keeps the accounts and transactions in dicts.
+    pool_size is accepted for the same signature and ignored.
+    config.durability decides when the log is flushed: strict fsyncs every write,
+    balanced hands it to the OS, fast leaves it in the file buffer until close.
+    """
+
+    def __init__(
+        self,
+        db_path: str = MEMORY_PATH,
+        pool_size: int = 8,
+        hasher: Optional[PinHasher] = None,
+        config: Optional[StorageConfig] = None,
+    ) -> None:
+        self.db_path = db_path
+        self.hasher = hasher if hasher is not None else PinHasher()
+        self.config = config if config is not None else StorageConfig(engine="memory")
+        self.ledger: Optional[GroupCommitLedger] = None
+        self.cache: Optional[AccountCache] = None
+        self.locks: Optional[AccountLocks] = None
+        self._accounts: Dict[int, _Row] = {}
+        # every id, for iter_accounts, sorted again only once new ones came in
+        self._ids: List[int] = []
+        self._ids_sorted = True
+        self._transactions: List[Transaction] = []
+        self._by_account: Dict[int, List[Transaction]] = {}
+        self._contention = dict.fromkeys(
+            ("cas_failures", "cas_retries", "cas_conflicts", "version_mismatches"), 0
+        )
+        self._lock = threading.RLock()
+        self._log: Optional[IO[str]] = None
+        self._closed = False
+        if db_path != MEMORY_PATH:
+            self._load()
+            self.snapshot()
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        """
+        Hold the lock of the whole engine, refuse once closed.
+        """
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Storage is closed.")
+            yield
+
+    def _load(self) -> None:
+        """
+        Read the snapshot, then replay the log written after it.
+        A line cut short by a crash ends the replay, it was never acknowledged.
+        """
+        if os.path.exists(self.db_path):
+            with open(self.db_path, encoding="utf-8") as f:
+                state = json.load(f)
+            for id, pin, balance, version in state["accounts"]:
+                self._add_account(id, _Row(pin, balance, version))
+            for row in state["transactions"]:
+                self._add_transaction(Transaction(*row))
+        log_path = self.db_path + "-log"
+        if os.path.exists(log_path):
+            with open(log_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        break
+                    self._replay(entry)
+
+    def _replay(self, entry: List[Any]) -> None:
+        """
+        Apply one log entry, the transaction row plus the pin hash of an "open".
+        Entries the snapshot already holds, left by a crash right after
+        it was written, are skipped.
+        """
+        transaction = Transaction(*entry[:6])
+        if transaction.id <= len(self._transactions):
+            return
+        if transaction.kind == "open":
+            self._add_account(
+                transaction.account_id, _Row(entry[6], transaction.balance)
+            )
+        else:
+            row = self._accounts[transaction.account_id]
+            row.balance = transaction.balance
+            row.version += 1
+        self._add_transaction(transaction)
+
+    def snapshot(self) -> None:
+        """
+        Write the whole state to the snapshot file and start an empty log.
+        The snapshot replaces the old one only once it is complete on disk.
+        """
+        if self.db_path == MEMORY_PATH:
+            return
+        with self._lock:
+            state = {
+                "accounts": [
+                    [id, row.pin, row.balance, row.version]
+                    for id, row in self._accounts.items()
+                ],
+                "transactions": [
+                    [t.id, t.account_id, t.kind, t.amount, t.balance, t.timestamp]
+                    for t in self._transactions
+                ],
+            }
+            tmp_path = self.db_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(state, f, separators=(",", ":"))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.db_path)
+            if self._log is not None:
+                self._log.close()
+            self._log = open(self.db_path + "-log", "w", encoding="utf-8")
+
+    def _add_account(self, id: int, row: _Row) -> None:
+        self._accounts[id] = row
+        self._ids.append(id)
+        self._ids_sorted = False
+
+    def _sorted_ids(self) -> List[int]:
+        """
+        The ids in order. The new ids sit in a run at the end,
+        so sorting again is close to a single merge. Called with the lock held.
+        """
+        if not self._ids_sorted:
+            self._ids.sort()
+            self._ids_sorted = True
+        return self._ids
+
+    def _add_transaction(self, transaction: Transaction) -> None:
+        self._transactions.append(transaction)
+        self._by_account.setdefault(transaction.account_id, []).append(transaction)
+
+    def _commit(
+        self,
+        records: List[Record],
+        pins: Optional[List[str]] = None,
+        durable: bool = False,
+    ) -> None:
+        """
+        Turn records into transactions and append them to the log,
+        pins holds the pin hash of every record of an "open".
+        durable fsyncs the log whatever the durability profile.
+        Called with the lock held, after the rows were changed.
+        """
+        if not records:
+            return
+        now = time.time()
+        lines = []
+        for i, (id, kind, amount, balance) in enumerate(records):
+            entry: List[Any] = [
+                len(self._transactions) + 1,
+                id,
+                kind,
+                amount,
+                balance,
+                now,
+            ]
+            self._add_transaction(Transaction(*entry))
+            if pins is not None:
+                entry.append(pins[i])
+            lines.append(json.dumps(entry, separators=(",", ":")) + "\n")
+        if self._log is not None:
+            self._log.writelines(lines)
+            if durable or self.config.durability != "fast":
+                self._log.flush()
+            if durable or self.config.durability == "strict":
+                os.fsync(self._log.fileno())
+
+    def enable_group_commit(
+        self,
+        max_delay_ms: float = GROUP_COMMIT_DELAY_MS,
+        max_batch: int = GROUP_COMMIT_BATCH,
+        coalesce: bool = False,
+    ) -> None:
+        """
+        Same ledger as AccountStorage, here it batches the log flushes.
+        """
+        if self.ledger is None:
+            ledger = WriteCoalescer if coalesce else GroupCommitLedger
+            self.ledger = ledger(self, max_delay_ms, max_batch)
+
+    def ledger_for(self, id: int) -> Optional[GroupCommitLedger]:
+        """
+        The one ledger, there are no shards here.
+        """
+        return self.ledger
+
+    def enable_cache(
+        self, max_entries: int = CACHE_SIZE, ttl: float = CACHE_TTL
+    ) -> None:
+        """
+        Reads are served from memory already, there is nothing to cache.
+        """
+
+    def enable_locks(self, stripes: int = LOCK_STRIPES) -> None:
+        """
+        Serialize mutate per account with striped locks.
+        """
+        if self.locks is None:
+            self.locks = AccountLocks(stripes)
+
+    def close(self) -> None:
+        """
+        Flush the ledger, write a last snapshot and close the hasher.
+        The storage can not be used afterwards.
+        """
+        if self.ledger is not None:
+            self.ledger.close()
+        with self._lock:
+            if self._closed:
+                return
+            self.snapshot()
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+            self._closed = True
+        self.hasher.close()
+
+    def create_account(self, id: int, pin: str, initial_balance: int = 0) -> None:
+        """
+        Hash the pin and add one account.
+        """
+        self.insert_account(id, self.hasher.hash_pin(pin), initial_balance)
+
+    def create_accounts(
+        self,
+        accounts: Iterable[Tuple[Any, Any, Any]],
+        chunk_size: int = CREATE_CHUNK_SIZE,
+    ) -> List[Tuple[Any, Optional[str]]]:
+        """
+        Like AccountStorage.create_accounts, chunk by chunk.
+        """
+        results: List[Tuple[Any, Optional[str]]] = []
+        rows = iter(accounts)
+        while chunk := list(islice(rows, chunk_size)):
+            results.extend(self._create_chunk(chunk))
+        return results
+
+    def _create_chunk(
+        self, chunk: List[Tuple[Any, Any, Any]]
+    ) -> List[Tuple[Any, Optional[str]]]:
+        """
+        Validate, hash and add one chunk of create_accounts. The ids are checked
+        again under the lock, someone may have taken one while hashing.
+        """
+        errors = _check_new_accounts(chunk, self._existing)
+        valid = [i for i, err in enumerate(errors) if err is None]
+        hashes = self.hasher.hash_many([chunk[i][1] for i in valid])
+        records: List[Record] = []
+        pins = []
+        with self._locked():
+            for i, pin_hash in zip(valid, hashes):
+                id, _, balance = chunk[i]
+                if id in self._accounts:
+                    errors[i] = "Account already exists"
+                    continue
+                self._add_account(id, _Row(pin_hash, balance))
+                records.append((id, "open", balance, balance))
+                pins.append(pin_hash)
+            self._commit(records, pins)
+        return [(row[0], err) for row, err in zip(chunk, errors)]
+
+    def _existing(self, ids: Set[Any]) -> Set[Any]:
+        with self._locked():
+            return {id for id in ids if id in self._accounts}
+
+    def insert_account(self, id: int, pin_hash: str, initial_balance: int) -> None:
+        """
+        Add an account with an already hashed pin.
+        Raises AccountExistsError if the id is taken.
+        """
+        with self._locked():
+            if id in self._accounts:
+                raise AccountExistsError("Account already exists")
+            self._add_account(id, _Row(pin_hash, initial_balance))
+            self._commit([(id, "open", initial_balance, initial_balance)], [pin_hash])
+
+    def get_account_row(self, id: int) -> Optional[Tuple[int, str, int, int]]:
+        """
+        The (id, pin hash, balance, version) of an account, None if there is none.
+        """
+        with self._locked():
+            row = self._accounts.get(id)
+            return None if row is None else (id, row.pin, row.balance, row.version)
+
+    def get_account(self, id: int, pin: str) -> Optional[BankAccount]:
+        """
+        The account if the pin matches, the hash is checked outside the lock.
+        """
+        row = self.get_account_row(id)
+        if not row or not self.hasher.check_pin(pin, row[1]):
+            return None
+        return BankAccount(row[0], pin, row[2], row[3])
+
+    def get_account_by_id(self, id: int) -> Optional[BankAccount]:
+        """
+        The account without its pin.
+        """
+        with self._locked():
+            row = self._accounts.get(id)
+            return (
+                None if row is None else BankAccount(id, "", row.balance, row.version)
+            )
+
+    def get_balances(self, ids: Optional[Iterable[int]] = None) -> Dict[int, int]:
+        """
+        Balance per id, of every account without ids.
+        """
+        with self._locked():
+            if ids is None:
+                return {id: row.balance for id, row in self._accounts.items()}
+            return {
+                id: self._accounts[id].balance for id in ids if id in self._accounts
+            }
+
+    def load_batch(self, ids: Optional[Iterable[int]] = None) -> AccountBatch:
+        """
+        The accounts as one AccountBatch, unknown ids are left out.
+        """
+        with self._locked():
+            if ids is None:
+                ids = self._accounts.keys()
+            rows = [
+                (id, self._accounts[id].balance, self._accounts[id].version)
+                for id in set(ids)
+                if id in self._accounts
+            ]
+        return AccountBatch.from_rows(rows, len(rows))
+
+    def iter_accounts(
+        self, chunk_size: int = EXPORT_CHUNK_SIZE
+    ) -> Iterator[List[Tuple[int, int]]]:
+        """
+        Chunks of (id, balance) rows ordered by id, each read under the lock
+        from where the previous one stopped, like a keyset page.
+        """
+        last: Optional[int] = None
+        while True:
+            with self._locked():
+                all_ids = self._sorted_ids()
+                start = 0 if last is None else bisect.bisect_right(all_ids, last)
+                ids = all_ids[start : start + chunk_size]
+                chunk = [(id, self._accounts[id].balance) for id in ids]
+            if not chunk:
+                return
+            yield chunk
+            last = ids[-1]
+
+    def iter_transactions(
+        self, account_id: Optional[int] = None, chunk_size: int = EXPORT_CHUNK_SIZE
+    ) -> Iterator[List[Tuple[int, int, str, int, int, float]]]:
+        """
+        Chunks of transaction rows, oldest first. The lists only ever grow,
+        so a chunk is a slice, and rows added after the first chunk are left out.
+        """
+        with self._locked():
+            if account_id is None:
+                transactions = self._transactions
+            else:
+                transactions = self._by_account.get(account_id, [])
+            end = len(transactions)
+        for start in range(0, end, chunk_size):
+            with self._locked():
+                chunk = transactions[start : min(start + chunk_size, end)]
+            yield [
+                (t.id, t.account_id, t.kind, t.amount, t.balance, t.timestamp)
+                for t in chunk
+            ]
+
+    def _apply(
+        self, id: int, kind: str, amount: int, version: Optional[int] = None
+    ) -> Tuple[Optional[int], Optional[str], Optional[Record]]:
+        """
+        Change one row like _apply_in, with the lock held.
+        Returns (balance, error, record to commit).
+        """
+        if kind == "deposit":
+            delta = amount
+        elif kind == "withdraw":
+            delta = -amount
+        else:
+            return None, "Unknown operation", None
+        row = self._accounts.get(id)
+        if row is None:
+            return None, "Account not found", None
+        if version is not None and row.version != version:
+            return None, "Version mismatch", None
+        if kind == "withdraw" and row.balance < amount:
+            return None, "Not enough balance", None
+        row.balance += delta
+        row.version += 1
+        return row.balance, None, (id, kind, delta, row.balance)
+
+    def _apply_one(
+        self, id: int, kind: str, amount: int, version: Optional[int] = None
+    ) -> Tuple[Optional[int], Optional[str]]:
+        with self._locked():
+            balance, err, record = self._apply(id, kind, amount, version)
+            if record is not None:
+                self._commit([record])
+        return balance, err
+
+    def apply_delta(self, id: int, amount: int) -> Optional[int]:
+        """
+        Add amount to the balance, through the ledger if there is one.
+        """
+        if self.ledger is not None:
+            return self.ledger.submit(id, "deposit", amount).result()[0]
+        return self._apply_one(id, "deposit", amount)[0]
+
+    def try_withdraw(self, id: int, amount: int) -> Optional[int]:
+        """
+        Take amount out if the balance covers it, through the ledger if there is one.
+        """
+        if self.ledger is not None:
+            return self.ledger.submit(id, "withdraw", amount).result()[0]
+        return self._apply_one(id, "withdraw", amount)[0]
+
+    def apply_batch(
+        self,
+        operations: Iterable[Tuple[int, str, int]],
+        atomic: bool = True,
+        durable: bool = False,
+    ) -> Tuple[bool, List[Tuple[Optional[int], Optional[str]]]]:
+        """
+        Like AccountStorage.apply_batch, an atomic batch that fails puts the rows
+        it already changed back.
+        """
+        operations = list(operations)
+        results: List[Tuple[Optional[int], Optional[str]]] = []
+        records: List[Record] = []
+        undo: List[Tuple[_Row, int, int]] = []
+        with self._locked():
+            for id, kind, amount in operations:
+                row = self._accounts.get(id)
+                if row is not None:
+                    undo.append((row, row.balance, row.version))
+                balance, err, record = self._apply(id, kind, amount)
+                results.append((balance, err))
+                if record is not None:
+                    records.append(record)
+                elif atomic:
+                    for row, balance, version in reversed(undo):
+                        row.balance, row.version = balance, version
+                    failed = len(results) - 1
+                    return False, [
+                        results[failed] if i == failed else (None, "Rolled back")
+                        for i in range(len(operations))
+                    ]
+            self._commit(records, durable=durable)
+        return True, results
+
+    def apply_coalesced(
+        self, operations: Iterable[Tuple[int, str, int]], durable: bool = False
+    ) -> List[Tuple[Optional[int], Optional[str]]]:
+        """
+        There is no UPDATE to save here, the operations are applied in order
+        and one log write covers all of them.
+        """
+        return self.apply_batch(operations, atomic=False, durable=durable)[1]
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            self._contention[counter] += 1
+
+    def contention_metrics(self) -> Dict[str, int]:
+        """
+        The compare-and-swap counters.
+        """
+        with self._lock:
+            return dict(self._contention)
+
+    def update_balance(self, account: BankAccount, kind: str = "adjustment") -> bool:
+        """
+        Compare-and-swap on account.version, like AccountStorage.update_balance.
+        """
+        with self._locked():
+            row = self._accounts.get(account.id)
+            if row is None:
+                return False
+            if row.version != account.version:
+                self._count("cas_failures")
+                return False
+            delta = account.get_balance() - row.balance
+            row.balance = account.get_balance()
+            row.version += 1
+            self._commit([(account.id, kind, delta, row.balance)])
+        account.version += 1
+        return True
+
+    def mutate(
+        self,
+        id: int,
+        change: Callable[[BankAccount], Optional[str]],
+        kind: str = "adjustment",
+        retries: int = MUTATE_RETRIES,
+    ) -> Tuple[Optional[BankAccount], Optional[str]]:
+        """
+        Same contract as AccountStorage.mutate, change runs without the engine lock.
+        """
+        return _mutate(self, id, self.get_account_by_id, change, kind, retries)
+
+    def apply_if_match(
+        self, id: int, kind: str, amount: int, version: int
+    ) -> Tuple[Optional[int], Optional[str]]:
+        """
+        Deposit or withdraw only if the account is still at version.
+        """
+        balance, err = self._apply_one(id, kind, amount, version)
+        if err == "Version mismatch":
+            self._count("version_mismatches")
+        return balance, err
+
+    def list_transactions(
+        self,
+        account_id: int,
+        limit: int = 50,
+        before: Optional[Tuple[float, int]] = None,
+    ) -> Tuple[List[Transaction], Optional[Tuple[float, int]]]:
+        """
+        Newest first, with the same (timestamp, id) cursor as AccountStorage.
+        The transactions of an account are kept in that order, so a page is a bisect.
+        """
+        with self._locked():
+            history = self._by_account.get(account_id, [])
+            end = len(history)
+            if before is not None:
+                end = bisect.bisect_left(
+                    history, tuple(before), key=lambda t: (t.timestamp, t.id)
+                )
+            start = max(0, end - limit)
+            page = history[start:end][::-1]
+        cursor = (page[-1].timestamp, page[-1].id) if start > 0 else None
+        return page, cursor
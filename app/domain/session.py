@@ -0,0 +1,69 @@
+"""
+session.py
+
+Keep the sessions of accounts whose PIN was already checked,
+so the expensive bcrypt check only runs once per login.
+"""
+
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+__all__ = ["SessionStore"]
+
+SESSION_TTL = 15 * 60
+MAX_SESSIONS = 10_000
+
+
+class SessionStore:
+    """
+    In-memory token -> account id store.
+    Tokens expire after ttl seconds, the least recently used ones are dropped
+    once there are more than max_sessions.
+    """
+
+    def __init__(
+        self, ttl: float = SESSION_TTL, max_sessions: int = MAX_SESSIONS
+    ) -> None:
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def issue(self, account_id: int) -> str:
+        """
+        Create a new token for an account that just passed the PIN check.
+        """
+        token = secrets.token_urlsafe(32)
+        with self._lock:
+            self._sessions[token] = (account_id, time.monotonic() + self.ttl)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        return token
+
+    def resolve(self, token: str) -> Optional[int]:
+        """
+        Return the account id of a live token, None if unknown or expired.
+        """
+        with self._lock:
+            entry = self._sessions.get(token)
+            if entry is None:
+                return None
+            account_id, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._sessions[token]
+                return None
+            self._sessions.move_to_end(token)
+            return account_id
+
+    def revoke(self, token: str) -> bool:
+        """
+        Forget a token. Returns False if it was not known.
+        """
+        with self._lock:
+            return self._sessions.pop(token, None) is not None
@@ -0,0 +1,454 @@
+"""
+sharding.py
+
+Spread the accounts over several sqlite files, so writers to different
+accounts stop queueing on a single database lock.
+Account id % shards picks the file, every shard is a full AccountStorage
+with its own connection pool and write lock.
+"""
+
+import heapq
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from itertools import islice
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+)
+
+from .account import (
+    CREATE_CHUNK_SIZE,
+    EXPORT_CHUNK_SIZE,
+    MUTATE_RETRIES,
+    AccountStorage,
+    BankAccount,
+    Transaction,
+    _apply_in,
+)
+from .batch import AccountBatch
+from .cache import CACHE_SIZE, CACHE_TTL
+from .config import StorageConfig
+from .hashing import PinHasher
+from .ledger import GROUP_COMMIT_BATCH, GROUP_COMMIT_DELAY_MS, GroupCommitLedger
+from .locks import LOCK_STRIPES, AccountLocks
+
+__all__ = ["ShardedAccountStorage"]
+
+SHARDS = 4
+
+T = TypeVar("T")
+
+
+def _sum(counters: Iterable[Dict[str, int]]) -> Dict[str, int]:
+    """
+    Add up counter dicts key by key.
+    """
+    total: Dict[str, int] = {}
+    for counter in counters:
+        for name, value in counter.items():
+            total[name] = total.get(name, 0) + value
+    return total
+
+
+class _Combined:
+    """
+    Sums the metrics() of the ledgers or caches of every shard.
+    """
+
+    def __init__(self, parts: Sequence[Any]) -> None:
+        self.parts = parts
+
+    def metrics(self) -> Dict[str, int]:
+        return _sum(part.metrics() for part in self.parts)
+
+
+class ShardedAccountStorage:
+    """
+    AccountStorage look-alike over shards sqlite files named after db_path,
+    bank.db becomes bank-0.db, bank-1.db, ...
+    Calls about one account go to its shard, batches are split per shard
+    and the parts run in parallel.
+    """
+
+    def __init__(
+        self,
+        db_path: str = "bank.db",
+        shards: int = SHARDS,
+        pool_size: int = 8,
+        hasher: Optional[PinHasher] = None,
+        config: Optional[StorageConfig] = None,
+    ) -> None:
+        if config is not None and config.engine != "sqlite":
+            # cross shard batches hold the sqlite write lock of every shard
+            raise ValueError("Only the sqlite engine can be sharded")
+        self.db_path = db_path
+        self.hasher = hasher if hasher is not None else PinHasher()
+        self.config = config
+        self.locks: Optional[AccountLocks] = None
+        base, ext = os.path.splitext(db_path)
+        self.shards = [
+            self._open_shard(f"{base}-{i}{ext}", pool_size) for i in range(shards)
+        ]
+        self._executor = ThreadPoolExecutor(
+            max_workers=shards, thread_name_prefix="shard"
+        )
+
+    def _open_shard(self, path: str, pool_size: int) -> AccountStorage:
+        """
+        Open the storage of one shard, all of them share the hasher and config.
+        """
+        return AccountStorage(path, pool_size, hasher=self.hasher, config=self.config)
+
+    def shard_for(self, id: int) -> AccountStorage:
+        """
+        The shard that holds account id.
+        """
+        return self.shards[id % len(self.shards)]
+
+    def _index_for(self, id: Any) -> int:
+        """
+        Shard index of id, ids that are not ints go to shard 0 to be rejected there.
+        """
+        if isinstance(id, int) and not isinstance(id, bool):
+            return id % len(self.shards)
+        return 0
+
+    def _split(
+        self, items: Iterable[T], key: Callable[[T], Any]
+    ) -> Dict[int, List[int]]:
+        """
+        Positions of items per shard index, key gives the account id of an item.
+        """
+        parts: Dict[int, List[int]] = {}
+        for i, item in enumerate(items):
+            parts.setdefault(self._index_for(key(item)), []).append(i)
+        return parts
+
+    def _each(self, call: Callable[[int], T], indices: Iterable[int]) -> Dict[int, T]:
+        """
+        Run call(shard index) for the given shards in parallel, results by index.
+        """
+        futures = {i: self._executor.submit(call, i) for i in indices}
+        return {i: future.result() for i, future in futures.items()}
+
+    @property
+    def ledger(self) -> Optional[_Combined]:
+        ledgers = [shard.ledger for shard in self.shards if shard.ledger is not None]
+        return _Combined(ledgers) if ledgers else None
+
+    @property
+    def cache(self) -> Optional[_Combined]:
+        caches = [shard.cache for shard in self.shards if shard.cache is not None]
+        return _Combined(caches) if caches else None
+
+    def enable_group_commit(
+        self,
+        max_delay_ms: float = GROUP_COMMIT_DELAY_MS,
+        max_batch: int = GROUP_COMMIT_BATCH,
+        coalesce: bool = False,
+    ) -> None:
+        """
+        One group commit ledger per shard.
+        """
+        for shard in self.shards:
+            shard.enable_group_commit(max_delay_ms, max_batch, coalesce)
+
+    def ledger_for(self, id: int) -> Optional[GroupCommitLedger]:
+        return self.shard_for(id).ledger
+
+    def enable_cache(
+        self, max_entries: int = CACHE_SIZE, ttl: float = CACHE_TTL
+    ) -> None:
+        """
+        One account cache per shard, max_entries is split between them.
+        """
+        per_shard = max(1, max_entries // len(self.shards))
+        for shard in self.shards:
+            shard.enable_cache(per_shard, ttl)
+
+    def enable_locks(self, stripes: int = LOCK_STRIPES) -> None:
+        """
+        One AccountLocks shared by every shard.
+        """
+        if self.locks is None:
+            self.locks = AccountLocks(stripes)
+            for shard in self.shards:
+                shard.locks = self.locks
+
+    def close(self) -> None:
+        """
+        Close every shard, then the hasher they share.
+        """
+        for shard in self.shards:
+            shard.close()
+        self._executor.shutdown(wait=True)
+        self.hasher.close()
+
+    def create_account(self, id: int, pin: str, initial_balance: int = 0) -> None:
+        self.shard_for(id).create_account(id, pin, initial_balance)
+
+    def create_accounts(
+        self,
+        accounts: Iterable[Tuple[Any, Any, Any]],
+        chunk_size: int = CREATE_CHUNK_SIZE,
+    ) -> List[Tuple[Any, Optional[str]]]:
+        """
+        Like AccountStorage.create_accounts, every chunk is split per shard
+        and the shards insert their part in parallel.
+        """
+        results: List[Tuple[Any, Optional[str]]] = []
+        accounts = iter(accounts)
+        while chunk := list(islice(accounts, chunk_size * len(self.shards))):
+            parts = self._split(chunk, lambda row: row[0])
+            done = self._each(
+                lambda i: self.shards[i].create_accounts(
+                    [chunk[p] for p in parts[i]], chunk_size
+                ),
+                parts,
+            )
+            merged: List[Tuple[Any, Optional[str]]] = [None] * len(chunk)
+            for index, positions in parts.items():
+                for position, result in zip(positions, done[index]):
+                    merged[position] = result
+            results.extend(merged)
+        return results
+
+    def insert_account(self, id: int, pin_hash: str, initial_balance: int) -> None:
+        self.shard_for(id).insert_account(id, pin_hash, initial_balance)
+
+    def get_account_row(self, id: int) -> Optional[Tuple[int, str, int, int]]:
+        return self.shard_for(id).get_account_row(id)
+
+    def get_account(self, id: int, pin: str) -> Optional[BankAccount]:
+        return self.shard_for(id).get_account(id, pin)
+
+    def get_account_by_id(self, id: int) -> Optional[BankAccount]:
+        return self.shard_for(id).get_account_by_id(id)
+
+    def get_balances(self, ids: Optional[Iterable[int]] = None) -> Dict[int, int]:
+        """
+        {id: balance} for ids or every account, the shards are asked in parallel.
+        """
+        if ids is None:
+            parts = self._each(
+                lambda i: self.shards[i].get_balances(), range(len(self.shards))
+            )
+        else:
+            ids = list(ids)
+            split = self._split(ids, lambda id: id)
+            parts = self._each(
+                lambda i: self.shards[i].get_balances([ids[p] for p in split[i]]),
+                split,
+            )
+        balances: Dict[int, int] = {}
+        for part in parts.values():
+            balances.update(part)
+        return balances
+
+    def load_batch(self, ids: Optional[Iterable[int]] = None) -> AccountBatch:
+        """
+        One AccountBatch out of the batches of every shard, asked in parallel.
+        """
+        if ids is None:
+            parts = self._each(
+                lambda i: self.shards[i].load_batch(), range(len(self.shards))
+            )
+        else:
+            ids = list(ids)
+            split = self._split(ids, lambda id: id)
+            parts = self._each(
+                lambda i: self.shards[i].load_batch([ids[p] for p in split[i]]),
+                split,
+            )
+        return AccountBatch.concat(parts.values())
+
+    def _merged(
+        self,
+        streams: List[Iterator[List[Tuple[Any, ...]]]],
+        key: Callable[[Tuple[Any, ...]], Any],
+        chunk_size: int,
+    ) -> Iterator[List[Tuple[Any, ...]]]:
+        """
+        Merge sorted chunked streams of the shards into one, chunk_size rows at a time.
+        """
+        rows = heapq.merge(
+            *((row for chunk in stream for row in chunk) for stream in streams), key=key
+        )
+        while chunk := list(islice(rows, chunk_size)):
+            yield chunk
+
+    def iter_accounts(
+        self, chunk_size: int = EXPORT_CHUNK_SIZE
+    ) -> Iterator[List[Tuple[int, int]]]:
+        """
+        Every account of every shard in id order.
+        """
+        streams = [shard.iter_accounts(chunk_size) for shard in self.shards]
+        return self._merged(streams, lambda row: row[0], chunk_size)
+
+    def iter_transactions(
+        self, account_id: Optional[int] = None, chunk_size: int = EXPORT_CHUNK_SIZE
+    ) -> Iterator[List[Tuple[int, int, str, int, int, float]]]:
+        """
+        The transactions of one account, or of every shard in time order.
+        Transaction ids are only unique within a shard.
+        """
+        if account_id is not None:
+            return self.shard_for(account_id).iter_transactions(account_id, chunk_size)
+        streams = [shard.iter_transactions(None, chunk_size) for shard in self.shards]
+        return self._merged(streams, lambda row: row[5], chunk_size)
+
+    def apply_delta(self, id: int, amount: int) -> Optional[int]:
+        return self.shard_for(id).apply_delta(id, amount)
+
+    def try_withdraw(self, id: int, amount: int) -> Optional[int]:
+        return self.shard_for(id).try_withdraw(id, amount)
+
+    def apply_batch(
+        self,
+        operations: Iterable[Tuple[int, str, int]],
+        atomic: bool = True,
+        durable: bool = False,
+    ) -> Tuple[bool, List[Tuple[Optional[int], Optional[str]]]]:
+        """
+        Like AccountStorage.apply_batch, the operations of every shard run in parallel.
+        A batch that stays on one shard is a plain transaction of that shard.
+        An atomic batch over several shards takes their write locks in shard order,
+        applies every part on the calling thread, and commits all of them only if every operation worked.
+        The commits themselves are not atomic together, a crash between two of them
+        leaves the batch applied on some shards only.
+        """
+        operations = list(operations)
+        parts = self._split(operations, lambda op: op[0])
+        if len(parts) == 1:
+            index = next(iter(parts))
+            return self.shards[index].apply_batch(operations, atomic, durable)
+        if not atomic:
+            done = self._each(
+                lambda i: self.shards[i].apply_batch(
+                    [operations[p] for p in parts[i]], atomic=False, durable=durable
+                ),
+                parts,
+            )
+            return True, self._merge_results(len(operations), parts, done)
+        return self._apply_atomic(operations, parts, durable)
+
+    def apply_coalesced(
+        self, operations: Iterable[Tuple[int, str, int]], durable: bool = False
+    ) -> List[Tuple[Optional[int], Optional[str]]]:
+        """
+        Like AccountStorage.apply_coalesced, the shards run their part in parallel.
+        """
+        operations = list(operations)
+        parts = self._split(operations, lambda op: op[0])
+        done = self._each(
+            lambda i: (
+                True,
+                self.shards[i].apply_coalesced(
+                    [operations[p] for p in parts[i]], durable
+                ),
+            ),
+            parts,
+        )
+        return self._merge_results(len(operations), parts, done)
+
+    def _merge_results(
+        self,
+        count: int,
+        parts: Dict[int, List[int]],
+        done: Dict[int, Tuple[bool, List[Tuple[Optional[int], Optional[str]]]]],
+    ) -> List[Tuple[Optional[int], Optional[str]]]:
+        """
+        Put the per shard results of a batch back in the order of the operations.
+        """
+        results: List[Tuple[Optional[int], Optional[str]]] = [(None, None)] * count
+        for index, positions in parts.items():
+            for position, result in zip(positions, done[index][1]):
+                results[position] = result
+        return results
+
+    def _apply_atomic(
+        self,
+        operations: List[Tuple[int, str, int]],
+        parts: Dict[int, List[int]],
+        durable: bool = False,
+    ) -> Tuple[bool, List[Tuple[Optional[int], Optional[str]]]]:
+        """
+        Atomic apply_batch over several shards, see apply_batch.
+        """
+        with ExitStack() as stack:
+            # always lock in shard order so two batches can not wait on each other
+            conns = {
+                i: stack.enter_context(self.shards[i]._writer(durable))
+                for i in sorted(parts)
+            }
+
+            def prepare(index: int) -> List[Tuple[Optional[int], Optional[str]]]:
+                results = []
+                for position in parts[index]:
+                    result = _apply_in(conns[index], *operations[position])
+                    results.append(result)
+                    if result[1] is not None:
+                        break
+                return results
+
+            # on this thread, the pool workers may be waiting on the locks held here
+            prepared = {i: prepare(i) for i in sorted(parts)}
+            # each shard stopped at its first failure, the earliest of those
+            # is the one a single transaction would have stopped at
+            failures = {
+                parts[i][len(results) - 1]: results[-1]
+                for i, results in prepared.items()
+                if results[-1][1] is not None
+            }
+            if failures:
+                # leaving the ExitStack rolls every shard back
+                failed = min(failures)
+                return False, [
+                    failures[failed] if i == failed else (None, "Rolled back")
+                    for i in range(len(operations))
+                ]
+            for i in sorted(parts):
+                conns[i].commit()
+        for i, positions in parts.items():
+            self.shards[i]._invalidate(operations[p][0] for p in positions)
+        return True, self._merge_results(
+            len(operations), parts, {i: (True, r) for i, r in prepared.items()}
+        )
+
+    def contention_metrics(self) -> Dict[str, int]:
+        return _sum(shard.contention_metrics() for shard in self.shards)
+
+    def update_balance(self, account: BankAccount, kind: str = "adjustment") -> bool:
+        return self.shard_for(account.id).update_balance(account, kind)
+
+    def mutate(
+        self,
+        id: int,
+        change: Callable[[BankAccount], Optional[str]],
+        kind: str = "adjustment",
+        retries: int = MUTATE_RETRIES,
+    ) -> Tuple[Optional[BankAccount], Optional[str]]:
+        return self.shard_for(id).mutate(id, change, kind, retries)
+
+    def apply_if_match(
+        self, id: int, kind: str, amount: int, version: int
+    ) -> Tuple[Optional[int], Optional[str]]:
+        return self.shard_for(id).apply_if_match(id, kind, amount, version)
+
+    def list_transactions(
+        self,
+        account_id: int,
+        limit: int = 50,
+        before: Optional[Tuple[float, int]] = None,
+    ) -> Tuple[List[Transaction], Optional[Tuple[float, int]]]:
+        return self.shard_for(account_id).list_transactions(account_id, limit, before)
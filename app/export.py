@@ -0,0 +1,69 @@
+"""
+export.py
+
+Turn chunks of database rows into NDJSON or CSV bytes, optionally gzipped,
+one chunk at a time so an export never holds more than a chunk in memory.
+Used by GET /accounts:export and python -m app.cli export.
+"""
+
+import csv
+import io
+import json
+import zlib
+from typing import Any, Iterable, Iterator, List, Sequence, Tuple
+
+__all__ = ["ACCOUNT_FIELDS", "TRANSACTION_FIELDS", "encode_rows", "gzip_stream"]
+
+ACCOUNT_FIELDS = ("id", "balance")
+TRANSACTION_FIELDS = ("id", "account_id", "kind", "amount", "balance", "timestamp")
+
+FORMATS = ("ndjson", "csv")
+
+
+def _ndjson(chunk: List[Tuple[Any, ...]], fields: Sequence[str]) -> bytes:
+    """
+    One json object per row, one row per line.
+    """
+    return "".join(
+        json.dumps(dict(zip(fields, row)), separators=(",", ":")) + "\n"
+        for row in chunk
+    ).encode()
+
+
+def _csv(chunk: List[Tuple[Any, ...]]) -> bytes:
+    """
+    The rows of chunk as csv lines.
+    """
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerows(chunk)
+    return buffer.getvalue().encode()
+
+
+def encode_rows(
+    chunks: Iterable[List[Tuple[Any, ...]]], fields: Sequence[str], fmt: str = "ndjson"
+) -> Iterator[bytes]:
+    """
+    Yield the bytes of every chunk of rows in fmt ("ndjson" or "csv").
+    A csv export starts with a header line of fields.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format {fmt!r}")
+    if fmt == "csv":
+        yield _csv([tuple(fields)])
+        for chunk in chunks:
+            yield _csv(chunk)
+    else:
+        for chunk in chunks:
+            yield _ndjson(chunk, fields)
+
+
+def gzip_stream(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """
+    Gzip a stream of bytes on the fly.
+    wbits=31 makes zlib write the gzip header and trailer.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        if data := compressor.compress(chunk):
+            yield data
+    yield compressor.flush()
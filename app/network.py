@@ -4,76 +4,601 @@ network.py
 Call the api and get the exchange rate
 save the cache into a json file
 Updated every 24 hours
+
+The rates are kept in memory once loaded,
+the json file is only read on a cold start.
+RatesRefresher renews them in the background before they expire,
+an expired table is still served for STALE_GRACE while a refresh runs.
+
+Both the sync (requests) and async (httpx) paths keep their connections open,
+retry with jittered backoff and stop calling the api while the circuit breaker is open.
 """
 
+import asyncio
 import json
 import os
+import random
+import threading
 import time
-from typing import Dict, Optional, Tuple
+from concurrent.futures import Future
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Dict, Mapping, Optional, Set, Tuple
 
+import httpx
 import requests
 from dotenv import load_dotenv
 
-__all__ = ["get_exchange_rates"]
+__all__ = [
+    "get_exchange_rates",
+    "get_exchange_rates_async",
+    "get_rates_snapshot_async",
+    "refresh_rates",
+    "refresh_rates_async",
+    "CircuitBreaker",
+    "ExchangeRateClient",
+    "RatesRefresher",
+    "RatesSnapshot",
+]
 
 API_URL = "https://v6.exchangerate-api.com/v6/{API_KEY}/latest/USD"
 CACHE_FILE = "exchange_cache.json"
 CACHE_TTL = 24 * 60 * 60
+# how long after CACHE_TTL a table may still be served while it is being refreshed
+STALE_GRACE = 60 * 60
+# refresh this long before the table expires
+REFRESH_MARGIN = 60 * 60
+# wait this long before trying again after a failed refresh
+RETRY_INTERVAL = 60
+# attempts per fetch, and the base of the exponential backoff between them
+FETCH_ATTEMPTS = 3
+FETCH_BACKOFF = 0.2
+# consecutive failed fetches that open the circuit, and how long it stays open
+BREAKER_THRESHOLD = 5
+BREAKER_RESET = 30.0
+
+load_dotenv()
+
+
+@dataclass(frozen=True, eq=False)
+class RatesSnapshot:
+    """
+    An immutable rates table and the time it was fetched.
+    """
+
+    rates: Mapping[str, float]
+    timestamp: float
+
+    @property
+    def expires_at(self) -> float:
+        """
+        When the table stops being fresh.
+        """
+        return self.timestamp + CACHE_TTL
+
+    def is_fresh(self) -> bool:
+        """
+        True while the table is younger than CACHE_TTL.
+        """
+        return time.time() < self.expires_at
+
+    def is_usable(self) -> bool:
+        """
+        True while the table is fresh or only stale by less than STALE_GRACE.
+        """
+        return time.time() < self.expires_at + STALE_GRACE
+
+
+_snapshot: Optional[RatesSnapshot] = None
+_disk_checked = False
+_snapshot_lock = threading.Lock()
+_inflight: Optional[Future] = None
+_inflight_lock = threading.Lock()
+
+
+def _make_snapshot(rates: Dict[str, float], timestamp: float) -> RatesSnapshot:
+    """
+    Freeze a rates dict into a snapshot.
+    """
+    return RatesSnapshot(rates=MappingProxyType(dict(rates)), timestamp=timestamp)
 
 
 # Add an api client
 # load_cahce and save cache are private methods
-def load_cache() -> Dict[str, float] | None:
+def load_cache() -> Optional[RatesSnapshot]:
     """
-    If file not exists or over 24 hours, return None
-    Else load json, read 'rates' and return dict
+    If file not exists, return None
+    Else load json, read 'timestamp' and 'rates' into a snapshot
     """
     if not os.path.exists(CACHE_FILE):
         return None
-    with open(CACHE_FILE, "r") as f:
-        data = json.load(f)
-    if time.time() - data["timestamp"] > CACHE_TTL:
+    try:
+        with open(CACHE_FILE, "r") as f:
+            data = json.load(f)
+        return _make_snapshot(data["rates"], float(data["timestamp"]))
+    except (OSError, ValueError, KeyError, TypeError):
         return None
-    return data["rates"]
 
 
-def save_cache(rates) -> None:
+def save_cache(snapshot: RatesSnapshot) -> None:
     """
     Dump the json to file
     """
     with open(CACHE_FILE, "w") as f:
-        json.dump({"timestamp": time.time(), "rates": rates}, f)
+        json.dump({"timestamp": snapshot.timestamp, "rates": dict(snapshot.rates)}, f)
+
+
+def _cached_snapshot() -> Optional[RatesSnapshot]:
+    """
+    Return the in-memory snapshot, reading the json file the first time only.
+    """
+    global _snapshot, _disk_checked
+    if _snapshot is None and not _disk_checked:
+        with _snapshot_lock:
+            if _snapshot is None and not _disk_checked:
+                _snapshot = load_cache()
+                _disk_checked = True
+    return _snapshot
+
+
+def _store_snapshot(snapshot: RatesSnapshot) -> None:
+    """
+    Swap in a new snapshot and persist it for the next cold start.
+    """
+    global _snapshot
+    with _snapshot_lock:
+        _snapshot = snapshot
+    save_cache(snapshot)
+
+
+class CircuitBreaker:
+    """
+    Stops calls to a failing service.
+    After threshold failures in a row the circuit opens and calls are refused,
+    after reset_after seconds one trial call is let through (half open),
+    a success closes the circuit again.
+    """
+
+    def __init__(
+        self, threshold: int = BREAKER_THRESHOLD, reset_after: float = BREAKER_RESET
+    ) -> None:
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self._opened_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        """
+        "closed", "open" or "half_open".
+        """
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_after:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        """
+        True if a call may go out now.
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at >= self.reset_after:
+                # let this one call through, keep the others out until it is back
+                self._opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self) -> None:
+        """
+        Close the circuit.
+        """
+        with self._lock:
+            self.failures = 0
+            self._opened_at = None
+
+    def record_failure(self) -> None:
+        """
+        Count a failure, open the circuit once there are threshold of them.
+        """
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self._opened_at = time.monotonic()
+
+
+_breaker = CircuitBreaker()
+_session = requests.Session()
+
+
+def _backoff(attempt: int) -> float:
+    """
+    Full jitter: a random wait up to FETCH_BACKOFF * 2 ** attempt.
+    """
+    return random.uniform(0, FETCH_BACKOFF * 2 ** (attempt - 1))
+
+
+def _parse_rates(data: object) -> Optional[RatesSnapshot]:
+    """
+    Turn the api json into a snapshot, None if it does not look right.
+    """
+    rates = data.get("conversion_rates") if isinstance(data, dict) else None
+    if not isinstance(rates, dict):
+        return None
+    try:
+        return _make_snapshot({k: float(v) for k, v in rates.items()}, time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _fetch(key: str, timeout: float) -> Tuple[Optional[RatesSnapshot], Optional[str]]:
+    """
+    Ask the api for a new table over the shared requests session.
+    Returns (snapshot, None) or (None, error).
+    """
+    if not _breaker.allow():
+        return (None, "Exchange rate api unavailable")
+    err = None
+    for attempt in range(FETCH_ATTEMPTS):
+        if attempt:
+            time.sleep(_backoff(attempt))
+        try:
+            resp = _session.get(API_URL.format(API_KEY=key), timeout=timeout)
+        except requests.Timeout:
+            err = "Network timeout"
+            continue
+        except requests.RequestException as e:
+            err = f"Network error: {e}"
+            continue
+        if resp.status_code >= 500:
+            err = f"Network error: {resp.status_code} from api"
+            continue
+        break
+    else:
+        _breaker.record_failure()
+        return (None, err)
+
+    _breaker.record_success()
+    if resp.status_code >= 400:
+        return (None, f"Network error: {resp.status_code} from api")
+    try:
+        snapshot = _parse_rates(resp.json())
+    except ValueError:
+        snapshot = None
+    if snapshot is None:
+        return (None, "Bad API response")
+    _store_snapshot(snapshot)
+    return (snapshot, None)
+
+
+class ExchangeRateClient:
+    """
+    Async client for the exchange rate api.
+    Keeps a pooled httpx connection open between fetches.
+    Bound to the event loop it was created on.
+    """
+
+    def __init__(self, breaker: Optional[CircuitBreaker] = None) -> None:
+        self.breaker = breaker if breaker is not None else _breaker
+        self.loop = asyncio.get_running_loop()
+        self._client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=4, max_keepalive_connections=2)
+        )
+
+    async def fetch(
+        self, key: str, timeout: float
+    ) -> Tuple[Optional[RatesSnapshot], Optional[str]]:
+        """
+        Async version of the fetch: (snapshot, None) or (None, error).
+        """
+        if not self.breaker.allow():
+            return (None, "Exchange rate api unavailable")
+        err = None
+        for attempt in range(FETCH_ATTEMPTS):
+            if attempt:
+                await asyncio.sleep(_backoff(attempt))
+            try:
+                resp = await self._client.get(
+                    API_URL.format(API_KEY=key), timeout=timeout
+                )
+            except httpx.TimeoutException:
+                err = "Network timeout"
+                continue
+            except httpx.HTTPError as e:
+                err = f"Network error: {e}"
+                continue
+            if resp.status_code >= 500:
+                err = f"Network error: {resp.status_code} from api"
+                continue
+            break
+        else:
+            self.breaker.record_failure()
+            return (None, err)
+
+        self.breaker.record_success()
+        if resp.status_code >= 400:
+            return (None, f"Network error: {resp.status_code} from api")
+        try:
+            snapshot = _parse_rates(resp.json())
+        except ValueError:
+            snapshot = None
+        if snapshot is None:
+            return (None, "Bad API response")
+        # save_cache writes the json file, keep that off the event loop
+        await asyncio.to_thread(_store_snapshot, snapshot)
+        return (snapshot, None)
+
+    async def aclose(self) -> None:
+        """
+        Close the pooled connections.
+        """
+        await self._client.aclose()
+
+
+_async_client: Optional[ExchangeRateClient] = None
+_background: Set[asyncio.Task] = set()
+
+
+async def _client_for_loop() -> ExchangeRateClient:
+    """
+    Return the shared async client, a new one if the loop changed.
+    The client of the old loop is closed.
+    """
+    global _async_client
+    loop = asyncio.get_running_loop()
+    if _async_client is None or _async_client.loop is not loop:
+        old, _async_client = _async_client, ExchangeRateClient()
+        if old is not None:
+            await _retire(old)
+    return _async_client
+
+
+async def _retire(client: ExchangeRateClient) -> None:
+    """
+    Close a client of another loop, on that loop if it still runs,
+    otherwise here since nothing else can use its connections any more.
+    """
+    if client.loop.is_running():
+        asyncio.run_coroutine_threadsafe(client.aclose(), client.loop)
+    else:
+        await client.aclose()
+
+
+async def close_async_client() -> None:
+    """
+    Close the shared async client, used on server shutdown.
+    """
+    global _async_client
+    client, _async_client = _async_client, None
+    if client is None:
+        return
+    if client.loop is asyncio.get_running_loop():
+        await client.aclose()
+    else:
+        await _retire(client)
+
+
+def _lead_refresh() -> Tuple[bool, Future]:
+    """
+    Return (True, future) if the caller has to do the fetch and resolve future,
+    (False, future) of the running fetch otherwise.
+    """
+    global _inflight
+    with _inflight_lock:
+        if _inflight is not None:
+            return False, _inflight
+        _inflight = Future()
+        return True, _inflight
+
+
+def _end_refresh() -> None:
+    """
+    Let the next caller start a new fetch.
+    """
+    global _inflight
+    with _inflight_lock:
+        _inflight = None
+
+
+def refresh_rates(
+    timeout: float = 5.0,
+) -> Tuple[Optional[RatesSnapshot], Optional[str]]:
+    """
+    Fetch a new table now. Returns (snapshot, None) or (None, error).
+    Callers that arrive while a fetch is running wait for that fetch
+    instead of starting their own.
+    """
+    key = os.getenv("EXCHANGE_API_KEY")
+    if not key:
+        return (None, "Missing EXCHANGE_API_KEY")
+
+    leader, future = _lead_refresh()
+    if not leader:
+        return future.result()
+    try:
+        result = _fetch(key, timeout)
+        future.set_result(result)
+        return result
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        _end_refresh()
+
+
+async def refresh_rates_async(
+    timeout: float = 5.0,
+) -> Tuple[Optional[RatesSnapshot], Optional[str]]:
+    """
+    Awaitable refresh_rates, shares in-flight fetches with the sync version.
+    """
+    key = os.getenv("EXCHANGE_API_KEY")
+    if not key:
+        return (None, "Missing EXCHANGE_API_KEY")
+
+    leader, future = _lead_refresh()
+    if not leader:
+        return await asyncio.wrap_future(future)
+    try:
+        client = await _client_for_loop()
+        result = await client.fetch(key, timeout)
+        future.set_result(result)
+        return result
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        _end_refresh()
+
+
+def _refresh_in_background(timeout: float) -> None:
+    """
+    Start a refresh on a thread unless one is already running.
+    """
+    if _inflight is None:
+        threading.Thread(target=refresh_rates, args=(timeout,), daemon=True).start()
+
+
+def _refresh_in_background_async(timeout: float) -> None:
+    """
+    Start a refresh task on the running loop unless one is already running.
+    """
+    if _inflight is None:
+        task = asyncio.get_running_loop().create_task(refresh_rates_async(timeout))
+        _background.add(task)
+        task.add_done_callback(_background.discard)
+
+
+def _usable_snapshot() -> Optional[RatesSnapshot]:
+    """
+    The cached snapshot if it is fresh or only a little stale.
+    """
+    snapshot = _cached_snapshot()
+    return snapshot if snapshot is not None and snapshot.is_usable() else None
+
+
+def _needs_refresh(snapshot: RatesSnapshot) -> bool:
+    """
+    True once a snapshot is inside REFRESH_MARGIN of expiring.
+    """
+    return time.time() >= snapshot.expires_at - REFRESH_MARGIN
 
 
 def get_exchange_rates(
     base: str = "USD", timeout: float = 5.0
-) -> Tuple[bool, Optional[Dict[str, float]], Optional[str]]:
+) -> Tuple[bool, Optional[Mapping[str, float]], Optional[str]]:
     """
     Returns (ok, rates, error). Uses cache first. On failure, (False, None, 'message').
+    The rates mapping is read only and shared between callers.
+    A table close to or past expiry is still returned while it is renewed in the background,
+    only a missing or too old table makes the caller wait for the api.
     """
-    # Move the following two lines to main.py
-    load_dotenv()
-    key = os.getenv("EXCHANGE_API_KEY")
-    if not key:
+    usable = _usable_snapshot()
+    if not os.getenv("EXCHANGE_API_KEY"):
         # still allow cache use if present
-        cached = load_cache()
-        return (False, cached, "Missing EXCHANGE_API_KEY")
+        return (False, usable.rates if usable else None, "Missing EXCHANGE_API_KEY")
 
-    cached = load_cache()
-    if cached:
-        return (True, cached, None)
+    if usable:
+        if _needs_refresh(usable):
+            _refresh_in_background(timeout)
+        return (True, usable.rates, None)
 
-    try:
-        resp = requests.get(API_URL.format(API_KEY=key, base=base), timeout=timeout)
-        resp.raise_for_status()
-        data = resp.json()
-        rates = data.get("conversion_rates")
-        if not isinstance(rates, dict):
-            return (False, cached, "Bad API response")
-        rates = {k: float(v) for k, v in rates.items()}
-        save_cache(rates)
-        return (True, rates, None)
-    except requests.Timeout:
-        return (False, cached, "Network timeout")
-    except requests.RequestException as e:
-        return (False, cached, f"Network error: {e}")
+    fetched, err = refresh_rates(timeout)
+    if fetched is None:
+        return (False, None, err)
+    return (True, fetched.rates, None)
+
+
+async def get_rates_snapshot_async(
+    timeout: float = 5.0,
+) -> Tuple[bool, Optional[RatesSnapshot], Optional[str]]:
+    """
+    get_exchange_rates_async that returns the whole snapshot,
+    for callers that need to know when the table was fetched.
+    """
+    usable = _usable_snapshot()
+    if not os.getenv("EXCHANGE_API_KEY"):
+        return (False, usable, "Missing EXCHANGE_API_KEY")
+
+    if usable:
+        if _needs_refresh(usable):
+            _refresh_in_background_async(timeout)
+        return (True, usable, None)
+
+    fetched, err = await refresh_rates_async(timeout)
+    if fetched is None:
+        return (False, None, err)
+    return (True, fetched, None)
+
+
+async def get_exchange_rates_async(
+    base: str = "USD", timeout: float = 5.0
+) -> Tuple[bool, Optional[Mapping[str, float]], Optional[str]]:
+    """
+    Awaitable get_exchange_rates for the api, never blocks the event loop.
+    """
+    ok, snapshot, err = await get_rates_snapshot_async(timeout)
+    return (ok, snapshot.rates if snapshot else None, err)
+
+
+class RatesRefresher:
+    """
+    Asyncio task that renews the rates REFRESH_MARGIN before they expire,
+    so requests never wait for the api. Started from the fastapi lifespan.
+    """
+
+    def __init__(
+        self, margin: float = REFRESH_MARGIN, retry: float = RETRY_INTERVAL
+    ) -> None:
+        if not 0 <= margin < CACHE_TTL:
+            # a fresh table would be due again at once, refreshing in a tight loop
+            raise ValueError("margin must be at least 0 and below CACHE_TTL")
+        self.margin = margin
+        self.retry = retry
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """
+        Start refreshing on the running event loop.
+        """
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Cancel the task, wait for it to end and close the http client.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await close_async_client()
+
+    def _delay(self) -> float:
+        """
+        Seconds until the next refresh is due, 0 if it is due now.
+        """
+        if not os.getenv("EXCHANGE_API_KEY"):
+            return self.retry
+        snapshot = _cached_snapshot()
+        if snapshot is None:
+            return 0
+        return max(0.0, snapshot.expires_at - self.margin - time.time())
+
+    async def _run(self) -> None:
+        """
+        Sleep until a refresh is due, refresh, repeat.
+        """
+        while True:
+            delay = self._delay()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            snapshot, _ = await refresh_rates_async()
+            if snapshot is None:
+                await asyncio.sleep(self.retry)
@@ -0,0 +1,135 @@
+"""
+rates.py
+
+Cross rates between any two currencies.
+The api only gives rates against USD, so a matrix of every pair
+is built once per rates table and looked up by index afterwards.
+"""
+
+from __future__ import annotations
+
+import threading
+from typing import List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .domain import StorageBackend
+from .network import get_exchange_rates
+
+__all__ = ["RateMatrix", "matrix_for", "convert", "convert_many", "convert_accounts"]
+
+
+class RateMatrix:
+    """
+    matrix[i, j] is how many units of codes[j] one unit of codes[i] buys.
+    """
+
+    def __init__(self, usd_rates: Mapping[str, float]) -> None:
+        self.codes = tuple(usd_rates)
+        self.index = {code: i for i, code in enumerate(self.codes)}
+        usd = np.fromiter(usd_rates.values(), dtype=np.float64, count=len(self.codes))
+        self.matrix = usd[np.newaxis, :] / usd[:, np.newaxis]
+        self.matrix.setflags(write=False)
+
+    def __contains__(self, code: str) -> bool:
+        return code in self.index
+
+    def rate(self, base: str, quote: str) -> Optional[float]:
+        """
+        Units of quote per unit of base, None if either code is unknown.
+        """
+        i = self.index.get(base.upper())
+        j = self.index.get(quote.upper())
+        if i is None or j is None:
+            return None
+        return float(self.matrix[i, j])
+
+    def convert(self, amount: float, base: str, quote: str) -> Optional[float]:
+        """
+        amount of base expressed in quote, None if either code is unknown.
+        """
+        rate = self.rate(base, quote)
+        return None if rate is None else amount * rate
+
+    def convert_many(
+        self, amounts: np.ndarray, base: str, quotes: Sequence[str]
+    ) -> np.ndarray:
+        """
+        Convert every amount of base into every quote in one pass.
+        Returns an (len(amounts), len(quotes)) array.
+        Raises KeyError for an unknown code.
+        """
+        i = self.index[base.upper()]
+        columns = [self.index[quote.upper()] for quote in quotes]
+        amounts = np.asarray(amounts, dtype=np.float64)
+        return np.multiply.outer(amounts, self.matrix[i, columns])
+
+
+_cached: Optional[Tuple[Mapping[str, float], RateMatrix]] = None
+_cached_lock = threading.Lock()
+
+
+def matrix_for(usd_rates: Mapping[str, float]) -> RateMatrix:
+    """
+    Return the matrix of a rates table, built the first time that table is seen.
+    The tables from network.py are shared objects, so identity tells a refresh apart.
+    """
+    global _cached
+    cached = _cached
+    if cached is not None and cached[0] is usd_rates:
+        return cached[1]
+    with _cached_lock:
+        if _cached is None or _cached[0] is not usd_rates:
+            _cached = (usd_rates, RateMatrix(usd_rates))
+        return _cached[1]
+
+
+def convert(
+    amount: float, from_code: str, to_code: str
+) -> Tuple[bool, Optional[float], Optional[str]]:
+    """
+    Returns (ok, converted, error) for amount of from_code in to_code.
+    """
+    _, rates, err = get_exchange_rates()
+    if rates is None:
+        return False, None, (err or "Network unavailable")
+    converted = matrix_for(rates).convert(amount, from_code, to_code)
+    if converted is None:
+        return False, None, "Invalid or unsupported currency code"
+    return True, converted, None
+
+
+def convert_many(
+    amounts: Sequence[float], quotes: Sequence[str], base: str = "USD"
+) -> Tuple[bool, Optional[np.ndarray], Optional[str]]:
+    """
+    Returns (ok, matrix, error), matrix[n, k] is amounts[n] of base in quotes[k].
+    """
+    _, rates, err = get_exchange_rates()
+    if rates is None:
+        return False, None, (err or "Network unavailable")
+    try:
+        return True, matrix_for(rates).convert_many(amounts, base, quotes), None
+    except KeyError:
+        return False, None, "Invalid or unsupported currency code"
+
+
+def convert_accounts(
+    storage: StorageBackend,
+    quotes: Sequence[str],
+    ids: Optional[Sequence[int]] = None,
+    base: str = "USD",
+) -> Tuple[bool, Optional[List[int]], Optional[np.ndarray], Optional[str]]:
+    """
+    Returns (ok, ids, matrix, error) for the balances of ids, or of every account.
+    Row n of matrix belongs to ids[n], unknown ids are left out.
+    """
+    batch = storage.load_batch(ids)
+    if ids is None:
+        found, amounts = batch.ids.tolist(), batch.balances
+    else:
+        rows = batch.positions(ids)
+        rows = rows[rows >= 0]
+        found, amounts = batch.ids[rows].tolist(), batch.balances[rows]
+    ok, values, err = convert_many(amounts, quotes, base)
+    return ok, (found if ok else None), values, err
@@ -92,7 +92,7 @@ class MenuState(State):
                     case "CONVERT":
                         return InputCurrencyState()
                     case "LOGOUT":
-                        ctx.logout
+                        ctx.logout()
                         return LoginState()
                     case "QUIT":
                         return QuitState()
@@ -0,0 +1,91 @@
+"""
+bench_accounts.py
+
+Memory and construction time of many accounts read from sqlite:
+a BankAccount with a __dict__ built by keyword (how reads used to work),
+the slotted BankAccount built by the row factory, and one AccountBatch.
+
+Run with: python -m benchmarks.bench_accounts
+"""
+
+import gc
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable
+
+from app.domain import AccountBatch, AccountStorage, PinHasher
+from app.domain.account import _account_row
+
+ACCOUNTS = 200_000
+
+
+@dataclass
+class DictAccount:
+    """
+    BankAccount as it was before it got slots.
+    """
+
+    id: int
+    pin: str
+    _balance: int
+    version: int = 0
+
+
+def by_keyword(conn: sqlite3.Connection) -> list:
+    return [
+        DictAccount(id=row[0], pin="", _balance=int(row[1]), version=row[2])
+        for row in conn.execute("SELECT id, balance, version FROM accounts")
+    ]
+
+
+def by_row_factory(conn: sqlite3.Connection) -> list:
+    cursor = conn.execute("SELECT id, balance, version FROM accounts")
+    cursor.row_factory = _account_row
+    return cursor.fetchall()
+
+
+def as_batch(conn: sqlite3.Connection) -> AccountBatch:
+    return AccountBatch.from_rows(
+        conn.execute("SELECT id, balance, version FROM accounts ORDER BY id")
+    )
+
+
+def measure(name: str, build: Callable[[sqlite3.Connection], Any], path: str) -> None:
+    """
+    Print how long build takes and how much memory its result holds on to.
+    """
+    conn = sqlite3.connect(path)
+    build(conn)  # warm the page cache
+    gc.collect()
+    start = time.perf_counter()
+    build(conn)
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    tracemalloc.start()
+    result = build(conn)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"{name:<20} {elapsed * 1e3:8.1f} ms  {size / 2**20:8.1f} MiB"
+        f"  {size / len(result):6.1f} B/account"
+    )
+    conn.close()
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / "bench.db")
+        storage = AccountStorage(path, hasher=PinHasher(rounds=4))
+        storage.create_accounts((id, "1234", id % 1000) for id in range(ACCOUNTS))
+        storage.close()
+        measure("dict, by keyword", by_keyword, path)
+        measure("slots, row factory", by_row_factory, path)
+        measure("AccountBatch", as_batch, path)
+
+
+if __name__ == "__main__":
+    main()
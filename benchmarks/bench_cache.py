@@ -0,0 +1,69 @@
+"""
+bench_cache.py
+
+Compare the p50/p99 latency of AccountStorage.get_account_by_id with and without
+the AccountCache, for a dashboard-like load: a few hot accounts polled over and over
+while a writer thread keeps depositing into some of them.
+
+Run with: python -m benchmarks.bench_cache
+"""
+
+import random
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from app.domain import AccountStorage, PinHasher
+
+ACCOUNTS = 2_000
+HOT = 200
+READS = 50_000
+
+
+def writer(storage: AccountStorage, stop: threading.Event) -> None:
+    """
+    Deposit into random hot accounts until stop is set.
+    """
+    rng = random.Random(1)
+    while not stop.is_set():
+        storage.apply_delta(rng.randrange(HOT), 1)
+        time.sleep(0.001)
+
+
+def run(name: str, storage: AccountStorage) -> None:
+    """
+    Time READS reads of hot accounts and print the percentiles.
+    """
+    rng = random.Random(0)
+    ids = [rng.randrange(HOT) for _ in range(READS)]
+    stop = threading.Event()
+    thread = threading.Thread(target=writer, args=(storage, stop))
+    thread.start()
+    timings = []
+    for id in ids:
+        start = time.perf_counter()
+        storage.get_account_by_id(id)
+        timings.append(time.perf_counter() - start)
+    stop.set()
+    thread.join()
+    q = statistics.quantiles(timings, n=100)
+    print(f"{name:<10} p50 {q[49] * 1e6:8.1f} us   p99 {q[98] * 1e6:8.1f} us")
+    if storage.cache is not None:
+        print(f"{'':<10} {storage.cache.metrics()}")
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / "bench.db")
+        storage = AccountStorage(path, hasher=PinHasher(rounds=4))
+        storage.create_accounts((id, "1234", 100) for id in range(ACCOUNTS))
+        run("sqlite", storage)
+        storage.enable_cache()
+        run("cached", storage)
+        storage.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+bench_coalesce.py
+
+Bursts of deposits into a few merchant accounts, with a withdraw now and then,
+from many threads: one commit per call, the group commit ledger
+and the WriteCoalescer that writes every account once per batch.
+Connections run with synchronous=FULL so every commit waits for fsync.
+
+Run with: python -m benchmarks.bench_coalesce
+"""
+
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from app.domain import AccountStorage, PinHasher
+
+from .bench_group_commit import FullSyncStorage
+
+THREADS = 64
+OPS = 10_000
+MERCHANTS = 4
+
+
+def one(storage: AccountStorage, i: int) -> None:
+    if i % 10 == 9:
+        storage.try_withdraw(i % MERCHANTS, 5)
+    else:
+        storage.apply_delta(i % MERCHANTS, 1)
+
+
+def run(name: str, storage: AccountStorage) -> None:
+    """
+    Fire OPS mutations from THREADS threads and print the throughput.
+    """
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=THREADS) as pool:
+        list(pool.map(lambda i: one(storage, i), range(OPS)))
+    elapsed = time.perf_counter() - start
+    line = f"{name:<16} {OPS / elapsed:10.1f} ops/s"
+    if storage.ledger is not None:
+        metrics = storage.ledger.metrics()
+        line += f"  ({metrics['flushes']} commits"
+        if "updates" in metrics:
+            line += f", {metrics['updates']} row updates"
+        line += ")"
+    print(line)
+
+
+def main() -> None:
+    for name, ledger in (
+        ("commit per call", None),
+        ("group commit", False),
+        ("coalesced", True),
+    ):
+        with tempfile.TemporaryDirectory() as tmp:
+            storage = FullSyncStorage(
+                str(Path(tmp) / "bench.db"),
+                pool_size=THREADS,
+                hasher=PinHasher(rounds=4),
+            )
+            storage.create_accounts((i, "0000", 0) for i in range(MERCHANTS))
+            if ledger is not None:
+                storage.enable_group_commit(max_batch=1024, coalesce=ledger)
+            run(name, storage)
+            storage.close()
+
+
+if __name__ == "__main__":
+    main()
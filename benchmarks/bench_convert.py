@@ -0,0 +1,47 @@
+"""
+bench_convert.py
+
+Time RateMatrix.convert_many on 1M balances x 20 currencies,
+against converting them one by one like App.convert_balance_to does.
+
+Run with: python -m benchmarks.bench_convert
+"""
+
+import json
+import time
+
+import numpy as np
+
+from app.rates import RateMatrix
+
+BALANCES = 1_000_000
+TARGETS = 20
+LOOP_BALANCES = 10_000
+
+
+def main() -> None:
+    with open("exchange_cache.json") as f:
+        rates = json.load(f)["rates"]
+    targets = list(rates)[:TARGETS]
+    balances = np.random.default_rng(0).integers(0, 1_000_000, BALANCES)
+
+    start = time.perf_counter()
+    matrix = RateMatrix(rates)
+    print(f"build matrix    {(time.perf_counter() - start) * 1e3:8.2f} ms")
+
+    start = time.perf_counter()
+    values = matrix.convert_many(balances, "USD", targets)
+    elapsed = time.perf_counter() - start
+    print(f"convert_many    {elapsed * 1e3:8.2f} ms for {values.shape}")
+
+    sample = balances[:LOOP_BALANCES].tolist()
+    start = time.perf_counter()
+    for balance in sample:
+        for target in targets:
+            balance * rates[target]
+    loop = (time.perf_counter() - start) * BALANCES / LOOP_BALANCES
+    print(f"python loop     {loop * 1e3:8.2f} ms (extrapolated)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+bench_engines.py
+
+Deposits/sec and get_balances/sec of the sqlite engine next to the memory engine,
+kept only in memory and with its snapshot and append log on disk.
+
+Run with: python -m benchmarks.bench_engines
+"""
+
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+from app.domain import PinHasher, StorageBackend, StorageConfig, open_storage
+
+THREADS = 8
+OPS = 5_000
+READS = 500
+ACCOUNTS = 1_000
+
+ENGINES = (
+    ("sqlite", "bench.db", StorageConfig()),
+    ("memory", None, StorageConfig(engine="memory")),
+    ("memory + log", "bench.json", StorageConfig(engine="memory")),
+)
+
+
+def run(name: str, storage: StorageBackend) -> None:
+    """
+    Fire OPS deposits from THREADS threads, then READS full balance reads.
+    """
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=THREADS) as pool:
+        list(pool.map(lambda i: storage.apply_delta(i % ACCOUNTS, 1), range(OPS)))
+    writes = OPS / (time.perf_counter() - start)
+    start = time.perf_counter()
+    for _ in range(READS):
+        storage.get_balances()
+    reads = READS / (time.perf_counter() - start)
+    print(f"{name:<14} {writes:10.1f} deposits/s {reads:10.1f} get_balances/s")
+
+
+def main() -> None:
+    for name, file, config in ENGINES:
+        with tempfile.TemporaryDirectory() as tmp:
+            path: Optional[str] = str(Path(tmp) / file) if file else None
+            storage = open_storage(
+                path, pool_size=THREADS, hasher=PinHasher(rounds=4), config=config
+            )
+            storage.create_accounts((i, "0000", 0) for i in range(ACCOUNTS))
+            run(name, storage)
+            storage.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+bench_group_commit.py
+
+Durable mutations/sec from many threads with one commit per call
+against the group commit ledger.
+Connections run with synchronous=FULL so every commit waits for fsync.
+
+Run with: python -m benchmarks.bench_group_commit
+"""
+
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from app.domain import AccountStorage, PinHasher
+
+THREADS = 32
+
+
+class FullSyncStorage(AccountStorage):
+    """
+    Storage that fsyncs on every commit.
+    """
+
+    def _connect(self):
+        conn = super()._connect()
+        conn.execute("PRAGMA synchronous=FULL")
+        return conn
+
+OPS = 5000
+ACCOUNTS = 100
+
+
+def run(name: str, storage: AccountStorage) -> None:
+    """
+    Fire OPS deposits from THREADS threads and print the throughput.
+    """
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=THREADS) as pool:
+        list(pool.map(lambda i: storage.apply_delta(i % ACCOUNTS, 1), range(OPS)))
+    elapsed = time.perf_counter() - start
+    line = f"{name:<16} {OPS / elapsed:10.1f} ops/s"
+    if storage.ledger is not None:
+        flushes = storage.ledger.metrics()["flushes"]
+        line += f"  ({flushes} commits, {OPS / flushes:.1f} ops per commit)"
+    print(line)
+
+
+def main() -> None:
+    for group_commit in (False, True):
+        with tempfile.TemporaryDirectory() as tmp:
+            storage = FullSyncStorage(
+                str(Path(tmp) / "bench.db"),
+                pool_size=THREADS,
+                hasher=PinHasher(rounds=4),
+            )
+            storage.create_accounts((i, "0000", 0) for i in range(ACCOUNTS))
+            if group_commit:
+                storage.enable_group_commit()
+            run("group commit" if group_commit else "commit per call", storage)
+            storage.close()
+
+
+if __name__ == "__main__":
+    main()
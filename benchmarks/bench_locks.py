@@ -0,0 +1,86 @@
+"""
+bench_locks.py
+
+Run read-modify-write mutations through AsyncAccountStorage with and without
+AsyncAccountLocks. A few hot accounts take half of the load, many cold ones the rest.
+Prints throughput, the p50/p99 latency of hot and cold calls and how many
+compare-and-swaps had to be retried or were given up.
+
+Run with: python -m benchmarks.bench_locks
+"""
+
+import asyncio
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from app.domain import (
+    AccountStorage,
+    AsyncAccountLocks,
+    AsyncAccountStorage,
+    BankAccount,
+    PinHasher,
+)
+
+HOT = 4
+COLD = 1_000
+OPERATIONS = 5_000
+IN_FLIGHT = 64
+
+
+def add_one(account: BankAccount) -> Optional[str]:
+    account.deposit(1)
+    return None
+
+
+async def load(front: AsyncAccountStorage) -> Dict[str, List[float]]:
+    """
+    Send OPERATIONS mutations, at most IN_FLIGHT at a time, timings per kind.
+    """
+    rng = random.Random(0)
+    ids = [
+        rng.randrange(HOT) if rng.random() < 0.5 else HOT + rng.randrange(COLD)
+        for _ in range(OPERATIONS)
+    ]
+    timings: Dict[str, List[float]] = {"hot": [], "cold": []}
+    gate = asyncio.Semaphore(IN_FLIGHT)
+
+    async def one(id: int) -> None:
+        async with gate:
+            start = time.perf_counter()
+            await front.mutate(id, add_one)
+            timings["hot" if id < HOT else "cold"].append(time.perf_counter() - start)
+
+    await asyncio.gather(*(one(id) for id in ids))
+    return timings
+
+
+def run(name: str, path: str, locks: Optional[AsyncAccountLocks]) -> None:
+    storage = AccountStorage(path, hasher=PinHasher(rounds=4))
+    storage.create_accounts((id, "1234", 0) for id in range(HOT + COLD))
+    front = AsyncAccountStorage(storage, locks=locks)
+    start = time.perf_counter()
+    timings = asyncio.run(load(front))
+    elapsed = time.perf_counter() - start
+    front.close()
+    print(f"{name:<8} {OPERATIONS / elapsed:8.0f} ops/s")
+    for kind, values in timings.items():
+        q = statistics.quantiles(values, n=100)
+        print(f"  {kind:<6} p50 {q[49] * 1e3:8.2f} ms   p99 {q[98] * 1e3:8.2f} ms")
+    print(f"  {storage.contention_metrics()}")
+    if locks is not None:
+        print(f"  {locks.metrics()}")
+    storage.close()
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        run("no locks", str(Path(tmp) / "plain.db"), None)
+        run("locks", str(Path(tmp) / "locked.db"), AsyncAccountLocks())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+bench_payloads.py
+
+Serialization cost per GET /rates request: building a RatesGetResponse and letting
+fastapi validate and encode it (the old behaviour), against handing out the bytes
+that payloads.py built once for the table.
+
+Run with: python -m benchmarks.bench_payloads
+"""
+
+import time
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from app.api.models import RatesGetResponse
+from app.api.payloads import payloads_for
+from app.network import _make_snapshot
+
+CALLS = 5000
+CURRENCIES = 160
+
+
+def run(name: str, call) -> None:
+    """
+    Time CALLS calls and print the cost of one.
+    """
+    call()
+    start = time.perf_counter()
+    for _ in range(CALLS):
+        call()
+    elapsed = time.perf_counter() - start
+    print(f"{name:<24} {elapsed / CALLS * 1e6:8.2f} us/request")
+
+
+def main() -> None:
+    rates = {f"C{i:03}": 1 + i / 7 for i in range(CURRENCIES)}
+    snapshot = _make_snapshot(rates, time.time())
+
+    def per_request() -> bytes:
+        model = RatesGetResponse(base="USD", rates=snapshot.rates)
+        return JSONResponse(jsonable_encoder(model)).body
+
+    def prebuilt() -> bytes:
+        return payloads_for(snapshot).table.body
+
+    def prebuilt_gzip() -> bytes:
+        return payloads_for(snapshot).table.gzipped
+
+    print(f"GET /rates with {CURRENCIES} currencies")
+    run("pydantic per request", per_request)
+    run("prebuilt bytes", prebuilt)
+    run("prebuilt gzip", prebuilt_gzip)
+    table = payloads_for(snapshot).table
+    print(f"body {len(table.body)} bytes, gzipped {len(table.gzipped)} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+bench_profiles.py
+
+Commit-per-call deposits/sec under each StorageConfig durability profile,
+plus the balanced profile without a statement cache, to show what re-parsing costs.
+
+Run with: python -m benchmarks.bench_profiles
+"""
+
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from app.domain import AccountStorage, PinHasher, StorageConfig
+
+THREADS = 8
+OPS = 5_000
+ACCOUNTS = 100
+
+PROFILES = (
+    ("strict", StorageConfig(durability="strict"), "fsync per commit"),
+    ("balanced", StorageConfig(), "may drop last commits on power loss"),
+    ("fast", StorageConfig(durability="fast"), "may corrupt on power loss"),
+    (
+        "balanced, no stmt cache",
+        StorageConfig(cached_statements=0),
+        "same as balanced",
+    ),
+)
+
+
+def run(name: str, storage: AccountStorage, durability: str) -> None:
+    """
+    Fire OPS deposits from THREADS threads and print the throughput.
+    """
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=THREADS) as pool:
+        list(pool.map(lambda i: storage.apply_delta(i % ACCOUNTS, 1), range(OPS)))
+    elapsed = time.perf_counter() - start
+    print(f"{name:<24} {OPS / elapsed:10.1f} ops/s   {durability}")
+
+
+def main() -> None:
+    for name, config, durability in PROFILES:
+        with tempfile.TemporaryDirectory() as tmp:
+            storage = AccountStorage(
+                str(Path(tmp) / "bench.db"),
+                pool_size=THREADS,
+                hasher=PinHasher(rounds=4),
+                config=config,
+            )
+            storage.create_accounts((i, "0000", 0) for i in range(ACCOUNTS))
+            run(name, storage, durability)
+            storage.close()
+
+
+if __name__ == "__main__":
+    main()
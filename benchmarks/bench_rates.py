@@ -0,0 +1,63 @@
+"""
+bench_rates.py
+
+Latency of GET /rates/{code} when the rates json is re-read on every call
+(the old behaviour) against the in-memory snapshot.
+
+Run with: python -m benchmarks.bench_rates
+"""
+
+import json
+import os
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from fastapi.testclient import TestClient
+
+import app.network as network
+from app.api.api import app
+
+REQUESTS = 2000
+
+
+def run(name: str, call, cold: bool) -> None:
+    """
+    Time REQUESTS calls, with cold the in-memory snapshot is dropped before each.
+    """
+    timings = []
+    for _ in range(REQUESTS):
+        if cold:
+            network._snapshot = None
+            network._disk_checked = False
+        start = time.perf_counter()
+        call()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    p50 = statistics.median(timings) * 1e6
+    p99 = timings[int(len(timings) * 0.99)] * 1e6
+    print(f"{name:<16} p50 {p50:8.1f}us  p99 {p99:8.1f}us")
+
+
+def main() -> None:
+    with open("exchange_cache.json") as f:
+        rates = json.load(f)["rates"]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "exchange_cache.json"
+        path.write_text(json.dumps({"timestamp": time.time(), "rates": rates}))
+        network.CACHE_FILE = str(path)
+        os.environ.setdefault("EXCHANGE_API_KEY", "bench")
+        print("get_exchange_rates()")
+        run("json per call", network.get_exchange_rates, cold=True)
+        run("in-memory", network.get_exchange_rates, cold=False)
+
+        print("GET /rates/EUR")
+        with TestClient(app) as client:
+            call = lambda: client.get("/rates/EUR").raise_for_status()
+            run("json per call", call, cold=True)
+            run("in-memory", call, cold=False)
+
+
+if __name__ == "__main__":
+    main()
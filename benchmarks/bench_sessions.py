@@ -0,0 +1,55 @@
+"""
+bench_sessions.py
+
+Compare requests/sec of POST /accounts/{id}/deposit authenticated by PIN
+(one bcrypt check per request) against a session token from login.
+
+Run with: python -m benchmarks.bench_sessions
+"""
+
+import tempfile
+import time
+from pathlib import Path
+
+from fastapi.testclient import TestClient
+
+from app.api.api import app, get_storage
+from app.domain import AccountStorage
+
+REQUESTS = 50
+
+
+def run(name: str, client: TestClient, **kwargs) -> None:
+    """
+    Fire REQUESTS deposits and print the throughput.
+    """
+    start = time.perf_counter()
+    for _ in range(REQUESTS):
+        resp = client.post("/accounts/1/deposit", **kwargs)
+        assert resp.status_code == 200
+    elapsed = time.perf_counter() - start
+    print(f"{name:<10} {REQUESTS / elapsed:10.1f} req/s")
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = AccountStorage(str(Path(tmp) / "bench.db"))
+        storage.create_account(1, "1234", 0)
+        app.dependency_overrides[get_storage] = lambda: storage
+        with TestClient(app) as client:
+            run("pin", client, json={"pin": "1234", "amount": 1})
+            token = client.post("/accounts/1/login", json={"pin": "1234"}).json()[
+                "token"
+            ]
+            run(
+                "token",
+                client,
+                json={"amount": 1},
+                headers={"Authorization": f"Bearer {token}"},
+            )
+        app.dependency_overrides.clear()
+        storage.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+bench_shards.py
+
+Durable deposits/sec from many threads into 1, 2, 4 and 8 sqlite shards.
+Connections run with synchronous=FULL, so every commit waits for its fsync
+and writers of different shards wait for theirs side by side.
+
+Run with: python -m benchmarks.bench_shards
+"""
+
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from app.domain import AccountStorage, PinHasher, ShardedAccountStorage
+
+from .bench_group_commit import FullSyncStorage
+
+THREADS = 32
+OPS = 4000
+ACCOUNTS = 512
+
+
+class FullSyncShards(ShardedAccountStorage):
+    """
+    Sharded storage whose shards fsync on every commit.
+    """
+
+    def _open_shard(self, path: str, pool_size: int) -> AccountStorage:
+        return FullSyncStorage(path, pool_size, hasher=self.hasher)
+
+
+def run(shards: int) -> float:
+    """
+    Fire OPS deposits from THREADS threads and return the throughput.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = FullSyncShards(
+            str(Path(tmp) / "bench.db"),
+            shards=shards,
+            pool_size=THREADS,
+            hasher=PinHasher(rounds=4),
+        )
+        storage.create_accounts((i, "0000", 0) for i in range(ACCOUNTS))
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=THREADS) as pool:
+            list(pool.map(lambda i: storage.apply_delta(i % ACCOUNTS, 1), range(OPS)))
+        elapsed = time.perf_counter() - start
+        storage.close()
+    return OPS / elapsed
+
+
+def main() -> None:
+    base = None
+    for shards in (1, 2, 4, 8):
+        throughput = run(shards)
+        base = base or throughput
+        print(f"{shards} shards {throughput:10.1f} ops/s  x{throughput / base:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+bench_storage.py
+
+Compare requests/sec of GET /accounts/{id} with a pooled AccountStorage
+against the old behaviour of a new storage and connection per call.
+
+Run with: python -m benchmarks.bench_storage
+"""
+
+import sqlite3
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from fastapi.testclient import TestClient
+
+from app.api.api import app, get_storage
+from app.domain import AccountStorage
+
+REQUESTS = 2000
+
+
+class ConnectPerCallStorage(AccountStorage):
+    """
+    The storage as it used to be: connect and close on every call.
+    """
+
+    @contextmanager
+    def _connection(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+
+def run(name: str, make_storage) -> None:
+    """
+    Fire REQUESTS reads through the api and print the throughput.
+    """
+    app.dependency_overrides[get_storage] = make_storage
+    with TestClient(app) as client:
+        client.get("/accounts/1")
+        start = time.perf_counter()
+        for _ in range(REQUESTS):
+            client.get("/accounts/1")
+        elapsed = time.perf_counter() - start
+    app.dependency_overrides.clear()
+    print(f"{name:<20} {REQUESTS / elapsed:10.1f} req/s")
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = str(Path(tmp) / "bench.db")
+        pooled = AccountStorage(db_path)
+        pooled.create_account(1, "1234", 100)
+
+        # old get_storage built a fresh storage for every request
+        run("connect-per-call", lambda: ConnectPerCallStorage(db_path))
+        run("pooled", lambda: pooled)
+        pooled.close()
+
+
+if __name__ == "__main__":
+    main()
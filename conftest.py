@@ -4,14 +4,26 @@ import pytest
 from fastapi.testclient import TestClient
 
 from app.api.api import app, get_storage
-from app.domain import AccountStorage
+from app.domain import StorageConfig, open_storage
 
 
-@pytest.fixture
-def test_storage(tmp_path: Path):
+def pytest_configure(config):
+    config.addinivalue_line(
+        "markers", "sqlite_only: looks at sqlite internals, skipped on other engines"
+    )
+
+
+@pytest.fixture(params=["sqlite", "memory"])
+def test_storage(request, tmp_path: Path):
+    """
+    Every test that takes a storage runs once per engine.
+    """
+    if request.param != "sqlite" and request.node.get_closest_marker("sqlite_only"):
+        pytest.skip("sqlite only")
     db_path = tmp_path / "test_bank.db"
-    storage = AccountStorage(str(db_path))
-    return storage
+    storage = open_storage(str(db_path), config=StorageConfig(engine=request.param))
+    yield storage
+    storage.close()
 
 
 @pytest.fixture
@@ -14,17 +14,20 @@ def main():
     tui = TUI()
     event = None
 
-    with tui.session():
-        spec0 = app.render()
-        tui.draw(spec0)
-
-        while True:
-            app.dispatch(event)
-            spec = app.render()
-            tui.draw(spec)
-            if spec.should_quit:
-                break
-            event = tui.read()
+    try:
+        with tui.session():
+            spec0 = app.render()
+            tui.draw(spec0)
+
+            while True:
+                app.dispatch(event)
+                spec = app.render()
+                tui.draw(spec)
+                if spec.should_quit:
+                    break
+                event = tui.read()
+    finally:
+        app.close()
 
 
 if __name__ == "__main__":
@@ -5,6 +5,12 @@ Used to test the fastapi endpoint call.
 
 """
 
+import json
+
+import pytest
+
+from app.domain import AccountStorage
+
 
 def test_get_account_not_found(client):
     resp = client.get("/accounts/1")
@@ -76,3 +82,277 @@ def test_wrong_pin(client, test_storage):
     )
 
     assert resp.status_code == 401
+
+
+def test_login_token_replaces_pin(client, test_storage):
+    test_storage.create_account(
+        id=5,
+        pin="3333",
+        initial_balance=100,
+    )
+
+    resp = client.post("/accounts/5/login", json={"pin": "3333"})
+    assert resp.status_code == 200
+    headers = {"Authorization": f"Bearer {resp.json()['token']}"}
+
+    resp = client.post("/accounts/5/deposit", json={"amount": 20}, headers=headers)
+    assert resp.status_code == 200
+    assert resp.json() == {"id": 5, "balance": 120}
+
+    resp = client.post("/accounts/5/withdraw", json={"amount": 50}, headers=headers)
+    assert resp.status_code == 200
+    assert resp.json()["balance"] == 70
+
+
+def test_token_is_bound_to_its_account(client, test_storage):
+    test_storage.create_account(id=6, pin="4444", initial_balance=100)
+    test_storage.create_account(id=7, pin="5555", initial_balance=100)
+
+    token = client.post("/accounts/6/login", json={"pin": "4444"}).json()["token"]
+    resp = client.post(
+        "/accounts/7/withdraw",
+        json={"amount": 10},
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert resp.status_code == 401
+
+
+def test_logout_revokes_token(client, test_storage):
+    test_storage.create_account(id=8, pin="6666", initial_balance=100)
+
+    token = client.post("/accounts/8/login", json={"pin": "6666"}).json()["token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    assert client.post("/accounts/8/logout", headers=headers).status_code == 204
+
+    resp = client.post("/accounts/8/deposit", json={"amount": 10}, headers=headers)
+    assert resp.status_code == 401
+
+
+def test_login_wrong_pin(client, test_storage):
+    test_storage.create_account(id=9, pin="7777", initial_balance=100)
+
+    resp = client.post("/accounts/9/login", json={"pin": "0000"})
+    assert resp.status_code == 401
+
+
+def test_metrics_reports_hashing_queue(client, test_storage):
+    test_storage.create_account(id=10, pin="8888", initial_balance=0)
+
+    resp = client.get("/metrics")
+    assert resp.status_code == 200
+    assert resp.json()["hashing"]["pending"] == 0
+    assert resp.json()["hashing"]["completed"] == 1
+
+
+def test_batch_create_accounts(client, test_storage):
+    test_storage.create_account(id=11, pin="1111", initial_balance=0)
+
+    resp = client.post(
+        "/accounts:batch",
+        json={
+            "accounts": [
+                {"id": 11, "pin": "1111"},
+                {"id": 12, "pin": "1212", "initial_balance": 50},
+            ]
+        },
+    )
+    assert resp.status_code == 200
+    body = resp.json()
+    assert body["created"] == 1
+    assert body["failed"] == 1
+    assert body["results"][0] == {
+        "id": 11,
+        "ok": False,
+        "error": "Account already exists",
+    }
+
+    resp = client.get("/accounts/12")
+    assert resp.json() == {"id": 12, "balance": 50}
+
+
+def test_transactions_batch(client, test_storage):
+    test_storage.create_account(id=13, pin="1313", initial_balance=100)
+    test_storage.create_account(id=14, pin="1414", initial_balance=0)
+    operations = [
+        {"account_id": 13, "kind": "withdraw", "amount": 60, "pin": "1313"},
+        {"account_id": 14, "kind": "deposit", "amount": 60, "pin": "1414"},
+        {"account_id": 13, "kind": "withdraw", "amount": 60, "pin": "1313"},
+    ]
+
+    resp = client.post("/transactions:batch", json={"operations": operations})
+    assert resp.status_code == 200
+    body = resp.json()
+    assert body["committed"] is False
+    assert [r["error"] for r in body["results"]] == [
+        "Rolled back",
+        "Rolled back",
+        "Not enough balance",
+    ]
+
+    resp = client.post(
+        "/transactions:batch",
+        json={"mode": "best_effort", "operations": operations},
+    )
+    body = resp.json()
+    assert body["committed"] is True
+    assert [r["balance"] for r in body["results"]] == [40, 60, None]
+    assert client.get("/accounts/14").json()["balance"] == 60
+
+
+def test_transactions_batch_checks_pins(client, test_storage):
+    test_storage.create_account(id=15, pin="1515", initial_balance=0)
+
+    resp = client.post(
+        "/transactions:batch",
+        json={
+            "mode": "best_effort",
+            "operations": [
+                {"account_id": 15, "kind": "deposit", "amount": 5, "pin": "0000"},
+                {"account_id": 15, "kind": "deposit", "amount": 0, "pin": "1515"},
+            ],
+        },
+    )
+    assert resp.status_code == 422
+
+    resp = client.post(
+        "/transactions:batch",
+        json={
+            "mode": "best_effort",
+            "operations": [
+                {"account_id": 15, "kind": "deposit", "amount": 5, "pin": "0000"},
+                {"account_id": 15, "kind": "deposit", "amount": 7, "pin": "1515"},
+            ],
+        },
+    )
+    results = resp.json()["results"]
+    assert results[0]["error"] == "Wrong PIN or ID"
+    assert results[1]["balance"] == 7
+
+
+def test_account_transactions_pagination(client, test_storage):
+    test_storage.create_account(id=16, pin="1616", initial_balance=0)
+    for amount in range(1, 6):
+        test_storage.apply_delta(16, amount)
+
+    resp = client.get("/accounts/16/transactions", params={"limit": 2})
+    assert resp.status_code == 200
+    body = resp.json()
+    assert [t["amount"] for t in body["transactions"]] == [5, 4]
+    assert body["transactions"][0]["balance"] == 15
+
+    amounts = []
+    while body["next_cursor"] is not None:
+        resp = client.get(
+            "/accounts/16/transactions",
+            params={"limit": 2, "cursor": body["next_cursor"]},
+        )
+        body = resp.json()
+        amounts += [t["amount"] for t in body["transactions"]]
+    assert amounts == [3, 2, 1, 0]
+
+    resp = client.get("/accounts/16/transactions", params={"cursor": "nope"})
+    assert resp.status_code == 400
+    assert client.get("/accounts/99/transactions").status_code == 404
+
+
+def test_export_accounts(client, test_storage):
+    test_storage.create_accounts([(17, "1717", 70), (18, "1818", 80)])
+
+    resp = client.get("/accounts:export")
+    assert resp.status_code == 200
+    assert resp.headers["content-type"] == "application/x-ndjson"
+    assert resp.headers["content-encoding"] == "gzip"
+    assert [json.loads(line) for line in resp.text.splitlines()] == [
+        {"id": 17, "balance": 70},
+        {"id": 18, "balance": 80},
+    ]
+
+    resp = client.get(
+        "/accounts:export",
+        params={"format": "csv"},
+        headers={"Accept-Encoding": "identity"},
+    )
+    assert "content-encoding" not in resp.headers
+    assert resp.text == "id,balance\n17,70\n18,80\n"
+
+    resp = client.get("/accounts/18/transactions:export", params={"format": "csv"})
+    assert resp.text.splitlines()[0] == "id,account_id,kind,amount,balance,timestamp"
+    assert client.get("/accounts/99/transactions:export").status_code == 404
+
+
+def test_account_conditional_get(client, test_storage):
+    test_storage.create_account(id=19, pin="1919", initial_balance=0)
+
+    resp = client.get("/accounts/19")
+    etag = resp.headers["etag"]
+    assert etag == '"acct-19-v0"'
+    resp = client.get("/accounts/19", headers={"If-None-Match": f'"x", {etag}'})
+    assert resp.status_code == 304
+    assert resp.content == b""
+
+    client.post("/accounts/19/deposit", json={"pin": "1919", "amount": 1})
+    resp = client.get("/accounts/19", headers={"If-None-Match": etag})
+    assert resp.status_code == 200
+    assert resp.headers["etag"] == '"acct-19-v1"'
+
+
+@pytest.mark.sqlite_only
+def test_conditional_get_reads_past_the_cache(client, test_storage):
+    """
+    Another writer of the file bumps the version behind the cache's back,
+    a conditional GET must not answer 304 for the old one.
+    """
+    test_storage.enable_cache()
+    test_storage.create_account(id=21, pin="2121", initial_balance=100)
+    etag = client.get("/accounts/21").headers["etag"]
+
+    other = AccountStorage(test_storage.db_path)
+    other.apply_delta(21, 50)
+    other.close()
+
+    resp = client.get("/accounts/21", headers={"If-None-Match": etag})
+    assert resp.status_code == 200
+    assert resp.headers["etag"] == '"acct-21-v1"'
+    assert resp.json()["balance"] == 150
+
+
+def test_if_match_on_mutations(client, test_storage):
+    test_storage.create_account(id=20, pin="2020", initial_balance=10)
+    etag = client.get("/accounts/20").headers["etag"]
+
+    resp = client.post(
+        "/accounts/20/deposit",
+        json={"pin": "2020", "amount": 5},
+        headers={"If-Match": etag},
+    )
+    assert resp.status_code == 200
+    assert resp.json()["balance"] == 15
+    assert resp.headers["etag"] == '"acct-20-v1"'
+
+    resp = client.post(
+        "/accounts/20/withdraw",
+        json={"pin": "2020", "amount": 5},
+        headers={"If-Match": etag},
+    )
+    assert resp.status_code == 412
+    resp = client.post(
+        "/accounts/20/withdraw",
+        json={"pin": "2020", "amount": 5},
+        headers={"If-Match": '"acct-21-v1"'},
+    )
+    assert resp.status_code == 412
+    assert client.get("/accounts/20").json()["balance"] == 15
+    assert client.get("/metrics").json()["contention"]["version_mismatches"] == 1
+
+
+def test_async_storage_wraps_the_overridden_storage(client, test_storage):
+    test_storage.create_account(id=22, pin="2222", initial_balance=0)
+    resp = client.post("/accounts/22/deposit", json={"pin": "2222", "amount": 9})
+    assert resp.status_code == 200
+    assert test_storage.get_account_by_id(22).get_balance() == 9
+
+
+def test_metrics_report_lock_waits(client, test_storage):
+    test_storage.create_account(id=23, pin="2323", initial_balance=0)
+    client.post("/accounts/23/deposit", json={"pin": "2323", "amount": 1})
+    assert client.get("/metrics").json()["locks"]["acquired"] == 1
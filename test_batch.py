@@ -0,0 +1,49 @@
+"""
+test_batch.py
+
+Used to implement pytest for the slotted BankAccount and AccountBatch
+"""
+
+import pytest
+
+from app.domain import AccountBatch, BankAccount, ShardedAccountStorage
+
+
+def test_bank_account_has_no_dict():
+    account = BankAccount(1, "", 10)
+    assert not hasattr(account, "__dict__")
+    with pytest.raises(AttributeError):
+        account.nickname = "payroll"
+
+
+def test_batch_from_rows_sorts_and_finds_positions():
+    batch = AccountBatch.from_rows([(5, 50, 1), (2, 20, 0), (9, 90, 3)])
+    assert batch.ids.tolist() == [2, 5, 9]
+    assert batch.balances.tolist() == [20, 50, 90]
+    assert batch.positions([9, 3, 2, 9]).tolist() == [2, -1, 0, 2]
+    assert batch.account(1) == BankAccount(5, "", 50, 1)
+    assert batch.total() == 160
+    assert batch.to_dict() == {2: 20, 5: 50, 9: 90}
+    with pytest.raises(ValueError):
+        batch.balances[0] = 0
+    assert AccountBatch.from_rows([]).positions([1]).tolist() == [-1]
+
+
+def test_load_batch_matches_get_balances(test_storage):
+    test_storage.create_accounts((id, "1234", id * 10) for id in range(1, 8))
+    test_storage.apply_delta(3, 5)
+    batch = test_storage.load_batch([7, 3, 42, 3])
+    assert batch.ids.tolist() == [3, 7]
+    assert batch.versions.tolist() == [1, 0]
+    assert test_storage.load_batch().to_dict() == test_storage.get_balances()
+    assert [a.id for a in test_storage.load_batch([2, 1])] == [1, 2]
+
+
+def test_sharded_load_batch_merges_shards(tmp_path):
+    storage = ShardedAccountStorage(str(tmp_path / "bank.db"), shards=3)
+    try:
+        storage.create_accounts((id, "1234", id) for id in range(10))
+        assert storage.load_batch().ids.tolist() == list(range(10))
+        assert storage.load_batch([8, 1, 5]).balances.tolist() == [1, 5, 8]
+    finally:
+        storage.close()
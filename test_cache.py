@@ -0,0 +1,96 @@
+"""
+test_cache.py
+
+Used to implement pytest for the AccountCache and its use by AccountStorage
+"""
+
+import time
+
+import pytest
+
+from app.domain import AccountCache, AccountStorage, BankAccount, enable_from_env
+
+
+def test_cache_evicts_least_recently_used():
+    """
+    The entry that was read last survives, the other one is evicted.
+    """
+    cache = AccountCache(max_entries=2)
+    cache.put(1, 10, cache.stamp())
+    cache.put(2, 20, cache.stamp())
+    assert cache.get(1) == 10
+    cache.put(3, 30, cache.stamp())
+    assert cache.get(2) is None
+    assert cache.get(1) == 10
+    assert cache.metrics()["evictions"] == 1
+
+
+def test_cache_entries_expire():
+    """
+    An entry is a miss once its ttl is over.
+    """
+    cache = AccountCache(ttl=0.05)
+    cache.put(1, 10, cache.stamp())
+    time.sleep(0.1)
+    assert cache.get(1) is None
+    assert len(cache) == 0
+
+
+def test_cache_refuses_reads_older_than_a_write():
+    """
+    A read that started before a write can not put its value back.
+    """
+    cache = AccountCache(max_entries=2)
+    stamp = cache.stamp()
+    cache.invalidate([1])
+    assert not cache.put(1, 10, stamp)
+    assert cache.put(2, 20, stamp)
+
+    # once the tombstone of 1 is evicted the floor still catches the old read
+    cache.invalidate([2])
+    cache.invalidate([3])
+    assert not cache.put(1, 10, stamp)
+    assert cache.put(1, 11, cache.stamp())
+
+
+@pytest.mark.sqlite_only
+def test_storage_cache_sees_every_write(test_storage):
+    """
+    Reads through the cache never return a balance older than the last write.
+    """
+    test_storage.enable_cache()
+    test_storage.create_accounts([(1, "1111", 100), (2, "2222", 0)])
+    assert test_storage.get_account_by_id(1).get_balance() == 100
+    assert test_storage.get_account_by_id(1).get_balance() == 100
+
+    test_storage.apply_delta(1, 5)
+    assert test_storage.get_account_by_id(1).get_balance() == 105
+    test_storage.try_withdraw(1, 5)
+    assert test_storage.get_account_by_id(1).get_balance() == 100
+    test_storage.apply_batch([(1, "withdraw", 50), (2, "deposit", 50)])
+    assert test_storage.get_account_by_id(1).get_balance() == 50
+    assert test_storage.get_account_by_id(2).get_balance() == 50
+    test_storage.update_balance(BankAccount(1, "", 7, version=3))
+    assert test_storage.get_account_by_id(1).get_balance() == 7
+
+    metrics = test_storage.cache.metrics()
+    assert metrics["hits"] == 1
+    assert metrics["misses"] == 6
+
+
+def test_cache_is_opt_in(tmp_path, monkeypatch):
+    """
+    Only the api turns the cache on, and only when BANK_CACHE_SIZE asks for it.
+    """
+    storage = AccountStorage(str(tmp_path / "bank.db"))
+    try:
+        monkeypatch.delenv("BANK_CACHE_SIZE", raising=False)
+        enable_from_env(storage, cache=True)
+        assert storage.cache is None
+        monkeypatch.setenv("BANK_CACHE_SIZE", "100")
+        enable_from_env(storage)
+        assert storage.cache is None
+        enable_from_env(storage, cache=True)
+        assert storage.cache.max_entries == 100
+    finally:
+        storage.close()
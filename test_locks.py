@@ -0,0 +1,85 @@
+"""
+test_locks.py
+
+Used to implement pytest for the striped account locks
+"""
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from app.domain import AccountLocks, AsyncAccountLocks, AsyncAccountStorage
+
+
+def test_stripes_are_taken_in_order_without_duplicates():
+    locks = AccountLocks(stripes=8)
+    assert locks.stripes_of([9, 3, 1, 17]) == [1, 3]
+
+
+def test_opposite_multi_account_holders_do_not_deadlock():
+    """
+    Two threads locking the same accounts in opposite order both get through.
+    """
+    locks = AccountLocks(stripes=16)
+    done = []
+
+    def worker(ids):
+        for _ in range(500):
+            with locks.hold(ids):
+                pass
+        done.append(ids)
+
+    threads = [
+        threading.Thread(target=worker, args=([1, 2],)),
+        threading.Thread(target=worker, args=([2, 1],)),
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+    assert len(done) == 2
+    assert locks.metrics()["acquired"] == 1000
+
+
+def test_mutate_with_locks_never_retries(test_storage):
+    """
+    With locks on, parallel mutations of one account queue up instead of racing.
+    """
+    test_storage.create_account(id=1, pin="1234", initial_balance=0)
+    test_storage.enable_locks()
+
+    def add_one(account):
+        account.deposit(1)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda _: test_storage.mutate(1, add_one), range(80)))
+    assert all(err is None for _, err in results)
+    assert test_storage.get_account_by_id(1).get_balance() == 80
+    assert test_storage.contention_metrics()["cas_retries"] == 0
+    assert test_storage.locks.metrics()["acquired"] == 80
+
+
+def test_async_locks_serialize_and_record_waits(test_storage):
+    """
+    Coroutines of a hot account wait on the loop, the waits land in the histogram.
+    """
+    test_storage.create_account(id=1, pin="1234", initial_balance=0)
+    test_storage.create_account(id=2, pin="1234", initial_balance=0)
+    locks = AsyncAccountLocks(stripes=4)
+    front = AsyncAccountStorage(test_storage, workers=4, locks=locks)
+
+    async def scenario():
+        await asyncio.gather(
+            *(front.apply_delta(1, 1) for _ in range(20)),
+            front.apply_batch([(1, "deposit", 5), (2, "deposit", 5)]),
+        )
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        front.close()
+    assert test_storage.get_balances([1, 2]) == {1: 25, 2: 5}
+    metrics = locks.metrics()
+    assert metrics["acquired"] == 21
+    assert metrics["contended"] > 0
+    assert sum(v for k, v in metrics.items() if k.startswith("wait_")) == 21
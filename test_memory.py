@@ -0,0 +1,117 @@
+"""
+test_memory.py
+
+Used to implement pytest for the persistence of MemoryAccountStorage and open_storage
+"""
+
+import pytest
+
+from app.core import App
+from app.domain import (
+    AccountStorage,
+    MemoryAccountStorage,
+    PinHasher,
+    ShardedAccountStorage,
+    StorageConfig,
+    open_storage,
+)
+
+
+def open_memory(path, durability="balanced"):
+    config = StorageConfig(engine="memory", durability=durability)
+    return open_storage(str(path), hasher=PinHasher(rounds=4), config=config)
+
+
+def test_open_storage_picks_the_engine(tmp_path):
+    sqlite = open_storage(str(tmp_path / "bank.db"))
+    memory = open_storage(config=StorageConfig(engine="memory"))
+    assert isinstance(sqlite, AccountStorage)
+    assert isinstance(memory, MemoryAccountStorage)
+    sqlite.close()
+    memory.close()
+    assert not (tmp_path / "bank.db-log").exists()
+    with pytest.raises(ValueError):
+        StorageConfig(engine="redis")
+    with pytest.raises(ValueError):
+        ShardedAccountStorage(
+            str(tmp_path / "shard.db"), config=StorageConfig(engine="memory")
+        )
+
+
+def test_memory_state_survives_reopen(tmp_path):
+    """
+    Whatever was written before close is read back, snapshot and log alike.
+    """
+    path = tmp_path / "bank.json"
+    storage = open_memory(path, "strict")
+    storage.create_accounts([(1, "1234", 10), (2, "5678", 0)])
+    storage.apply_delta(1, 5)
+    storage.apply_batch([(1, "withdraw", 3), (2, "deposit", 7)])
+    storage.snapshot()
+    storage.try_withdraw(2, 2)
+    before = storage.list_transactions(2)[0]
+    # no close, the last write is only in the log
+    storage._log.close()
+
+    reopened = open_memory(path)
+    try:
+        assert reopened.get_balances() == {1: 12, 2: 5}
+        assert reopened.get_account(2, "5678").version == 2
+        assert reopened.list_transactions(2)[0] == before
+        reopened.apply_delta(2, 1)
+        assert reopened.list_transactions(2)[0][0].id == 7
+    finally:
+        reopened.close()
+
+
+def test_memory_replay_stops_at_a_torn_line(tmp_path):
+    path = tmp_path / "bank.json"
+    storage = open_memory(path)
+    storage.create_account(1, "1234", 10)
+    storage.apply_delta(1, 5)
+    storage._log.write('[3,1,"deposit",1')
+    storage._log.close()
+
+    reopened = open_memory(path)
+    assert reopened.get_balances() == {1: 15}
+    reopened.close()
+
+
+def test_memory_replay_skips_what_the_snapshot_holds(tmp_path):
+    """
+    A crash between writing the snapshot and emptying the log replays nothing twice.
+    """
+    path = tmp_path / "bank.json"
+    storage = open_memory(path)
+    storage.create_account(1, "1234", 10)
+    storage.apply_delta(1, 5)
+    log = (tmp_path / "bank.json-log").read_text()
+    storage.close()
+    (tmp_path / "bank.json-log").write_text(log)
+
+    reopened = open_memory(path)
+    assert reopened.get_balances() == {1: 15}
+    assert len(reopened.list_transactions(1)[0]) == 2
+    reopened.close()
+
+
+def test_app_uses_the_storage_it_is_given():
+    storage = MemoryAccountStorage(hasher=PinHasher(rounds=4))
+    storage.create_account(1, "1234", 10)
+    app = App(storage=storage)
+    assert app.login(1, "1234")
+    app.deposit(5)
+    assert app.balance == 15
+    assert storage.get_balances() == {1: 15}
+    storage.close()
+
+
+def test_memory_iter_accounts_reads_chunk_by_chunk():
+    storage = MemoryAccountStorage(hasher=PinHasher(rounds=4))
+    storage.create_accounts((id, "1234", id) for id in (5, 3, 9, 1, 7))
+    chunks = storage.iter_accounts(chunk_size=2)
+    assert next(chunks) == [(1, 1), (3, 3)]
+    storage.create_account(2, "1234", 2)
+    storage.create_account(8, "1234", 8)
+    assert list(chunks) == [[(5, 5), (7, 7)], [(8, 8), (9, 9)]]
+    storage.close()
@@ -0,0 +1,371 @@
+"""
+test_network.py
+
+Used to implement pytest for the exchange rates cache
+"""
+
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import app.network as network
+from app.api.payloads import payloads_for
+from app.rates import (
+    RateMatrix,
+    convert,
+    convert_accounts,
+    convert_many,
+    matrix_for,
+)
+
+
+@pytest.fixture
+def rates_file(tmp_path, monkeypatch):
+    """
+    Point the cache at a fresh json file and forget what is in memory.
+    """
+    path = tmp_path / "exchange_cache.json"
+    path.write_text(
+        json.dumps({"timestamp": time.time(), "rates": {"USD": 1.0, "EUR": 0.5}})
+    )
+    monkeypatch.setattr(network, "CACHE_FILE", str(path))
+    monkeypatch.setattr(network, "_snapshot", None)
+    monkeypatch.setattr(network, "_disk_checked", False)
+    monkeypatch.setenv("EXCHANGE_API_KEY", "test")
+    return path
+
+
+@pytest.fixture
+def rates_server(monkeypatch):
+    """
+    A local stand-in for the exchange rate api that counts its hits.
+    Set server.delay to make it slow, server.failures to answer 503 that many times.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            server.hits += 1
+            time.sleep(server.delay)
+            if server.failures > 0:
+                server.failures -= 1
+                self.send_response(503)
+                self.end_headers()
+                return
+            body = json.dumps({"conversion_rates": {"USD": 1, "EUR": 0.9}}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.hits = 0
+    server.delay = 0.0
+    server.failures = 0
+    monkeypatch.setattr(network, "FETCH_BACKOFF", 0.001)
+    monkeypatch.setattr(network, "_breaker", network.CircuitBreaker())
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(
+        network,
+        "API_URL",
+        f"http://127.0.0.1:{server.server_port}/{{API_KEY}}/latest/USD",
+    )
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _wait_for_refresh():
+    """
+    Wait until no refresh is in flight.
+    """
+    for _ in range(100):
+        if network._inflight is None:
+            return
+        time.sleep(0.01)
+
+
+def test_rates_file_is_read_once(rates_file, monkeypatch):
+    """
+    Only the first call touches the json file.
+    """
+    calls = []
+    load_cache = network.load_cache
+    monkeypatch.setattr(network, "load_cache", lambda: calls.append(1) or load_cache())
+
+    for _ in range(5):
+        ok, rates, err = network.get_exchange_rates()
+        assert ok and err is None
+        assert rates["EUR"] == 0.5
+    assert len(calls) == 1
+
+    with pytest.raises(TypeError):
+        rates["EUR"] = 2.0
+
+
+def test_rates_endpoint_uses_memory_cache(rates_file, client):
+    resp = client.get("/rates/eur")
+    assert resp.status_code == 200
+    assert resp.json() == {"base": "USD", "currency": "EUR", "rate": 0.5}
+
+    rates_file.unlink()
+    resp = client.get("/rates")
+    assert resp.status_code == 200
+    assert resp.json()["rates"] == {"USD": 1.0, "EUR": 0.5}
+
+
+def test_rates_conditional_get(rates_file, client):
+    resp = client.get("/rates")
+    etag = resp.headers["etag"]
+    max_age = int(resp.headers["cache-control"].split("max-age=")[1])
+    assert 0 < max_age <= network.CACHE_TTL
+
+    resp = client.get("/rates", headers={"If-None-Match": etag})
+    assert resp.status_code == 304
+    assert resp.content == b""
+    assert resp.headers["etag"] == etag
+
+    resp = client.get("/rates/eur", headers={"If-None-Match": etag})
+    assert resp.status_code == 200
+    resp = client.get("/rates/eur", headers={"If-None-Match": resp.headers["etag"]})
+    assert resp.status_code == 304
+
+    network._store_snapshot(network._make_snapshot({"USD": 1.0}, time.time() + 1))
+    resp = client.get("/rates", headers={"If-None-Match": etag})
+    assert resp.status_code == 200
+    assert resp.headers["etag"] != etag
+
+
+def test_rates_payloads_are_built_once_per_table(rates_file, client):
+    rates = {f"C{i:02}": i / 7 for i in range(160)}
+    network._store_snapshot(network._make_snapshot(rates, time.time()))
+
+    resp = client.get("/rates", headers={"Accept-Encoding": "gzip"})
+    assert resp.headers["content-encoding"] == "gzip"
+    assert resp.headers["etag"].endswith('-gz"')
+    assert resp.json() == {"base": "USD", "rates": rates}
+    resp = client.get("/rates", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in resp.headers
+    assert resp.json()["rates"] == rates
+
+    resp = client.get("/rates/c07")
+    assert resp.json() == {"base": "USD", "currency": "C07", "rate": 1.0}
+    assert "content-encoding" not in resp.headers
+
+    snapshot = network._usable_snapshot()
+    assert payloads_for(snapshot) is payloads_for(snapshot)
+
+
+def test_concurrent_misses_share_one_fetch(rates_file, rates_server):
+    """
+    A cold cache hit by many callers at once only calls the api once.
+    """
+    rates_file.unlink()
+    rates_server.delay = 0.2
+    with ThreadPoolExecutor(max_workers=10) as pool:
+        results = list(pool.map(lambda _: network.get_exchange_rates(), range(10)))
+    assert all(ok and rates["EUR"] == 0.9 for ok, rates, _ in results)
+    assert rates_server.hits == 1
+
+
+def test_stale_rates_served_while_refreshing(rates_file, rates_server):
+    """
+    An expired table is returned right away and renewed in the background.
+    """
+    rates_file.write_text(
+        json.dumps(
+            {
+                "timestamp": time.time() - network.CACHE_TTL - 1,
+                "rates": {"USD": 1.0, "EUR": 0.5},
+            }
+        )
+    )
+    rates_server.delay = 0.2
+
+    start = time.perf_counter()
+    ok, rates, _ = network.get_exchange_rates()
+    assert time.perf_counter() - start < 0.1
+    assert ok and rates["EUR"] == 0.5
+
+    time.sleep(0.05)
+    _wait_for_refresh()
+    ok, rates, _ = network.get_exchange_rates()
+    assert rates["EUR"] == 0.9
+    assert rates_server.hits == 1
+
+
+def test_refresher_renews_before_expiry(rates_file, rates_server):
+    """
+    The background refresher fetches once the table is inside the margin.
+    """
+
+    rates_file.write_text(
+        json.dumps(
+            {
+                "timestamp": time.time() - network.CACHE_TTL + 30,
+                "rates": {"USD": 1.0, "EUR": 0.5},
+            }
+        )
+    )
+
+    async def run():
+        refresher = network.RatesRefresher(margin=60, retry=0.01)
+        refresher.start()
+        for _ in range(200):
+            await asyncio.sleep(0.01)
+            if network._cached_snapshot().rates["EUR"] == 0.9:
+                break
+        # the renewed table is not due again, the task goes back to sleep
+        await asyncio.sleep(0.05)
+        await refresher.stop()
+
+    asyncio.run(run())
+    assert network._cached_snapshot().rates["EUR"] == 0.9
+    assert rates_server.hits == 1
+    with pytest.raises(ValueError):
+        network.RatesRefresher(margin=network.CACHE_TTL)
+
+
+def test_async_fetch_retries_server_errors(rates_file, rates_server):
+    """
+    The async client retries a 503 and then succeeds.
+    """
+    rates_file.unlink()
+    rates_server.failures = 2
+
+    ok, rates, err = asyncio.run(network.get_exchange_rates_async())
+    assert ok and err is None
+    assert rates["EUR"] == 0.9
+    assert rates_server.hits == 3
+
+
+def test_async_fetch_saves_off_the_loop_and_closes_old_clients(
+    rates_file, rates_server, monkeypatch
+):
+    """
+    The cache file is written on a worker thread, and a new loop closes
+    the client the previous loop left behind.
+    """
+    save_cache = network.save_cache
+    threads = []
+
+    def spy(snapshot):
+        threads.append(threading.get_ident())
+        save_cache(snapshot)
+
+    monkeypatch.setattr(network, "save_cache", spy)
+    monkeypatch.setattr(network, "_async_client", None)
+    clients = []
+
+    async def run():
+        snapshot, err = await network.refresh_rates_async()
+        assert err is None
+        clients.append(network._async_client)
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(run())
+    asyncio.run(run())
+    assert threads and loop_thread not in threads
+    assert clients[0] is not clients[1]
+    assert clients[0]._client.is_closed
+    asyncio.run(network.close_async_client())
+    assert clients[1]._client.is_closed
+
+
+def test_circuit_breaker_stops_calling_a_failing_api(
+    rates_file, rates_server, monkeypatch
+):
+    """
+    After enough failed fetches the api is left alone until the reset timeout.
+    """
+    rates_file.unlink()
+    rates_server.failures = 1000
+    monkeypatch.setattr(network, "_breaker", network.CircuitBreaker(threshold=2))
+
+    async def run():
+        for _ in range(4):
+            ok, rates, err = await network.get_exchange_rates_async()
+            assert not ok and rates is None
+
+    asyncio.run(run())
+    assert rates_server.hits == 2 * network.FETCH_ATTEMPTS
+    assert network._breaker.state == "open"
+    ok, _, err = network.get_exchange_rates()
+    assert err == "Exchange rate api unavailable"
+
+
+def test_rate_matrix_cross_rates():
+    """
+    Cross rates are derived from the USD table.
+    """
+    matrix = RateMatrix({"USD": 1.0, "EUR": 0.5, "JPY": 150.0})
+    assert matrix.rate("usd", "eur") == 0.5
+    assert matrix.rate("EUR", "USD") == 2.0
+    assert matrix.rate("EUR", "JPY") == pytest.approx(300.0)
+    assert matrix.convert(10, "JPY", "EUR") == pytest.approx(10 / 300)
+    assert matrix.rate("EUR", "XXX") is None
+
+
+def test_rate_matrix_built_once_per_table(rates_file):
+    _, rates, _ = network.get_exchange_rates()
+    assert matrix_for(rates) is matrix_for(rates)
+    assert convert(4, "EUR", "USD") == (True, 8.0, None)
+
+
+def test_cross_rate_and_convert_endpoints(rates_file, client):
+    resp = client.get("/rates/eur/usd")
+    assert resp.status_code == 200
+    assert resp.json() == {"base": "EUR", "quote": "USD", "rate": 2.0}
+
+    resp = client.get("/convert", params={"amount": 3, "from": "USD", "to": "EUR"})
+    assert resp.status_code == 200
+    assert resp.json()["converted"] == 1.5
+
+    assert client.get("/rates/eur/xxx").status_code == 404
+
+
+def test_convert_many_and_accounts(rates_file, test_storage):
+    """
+    Bulk conversion gives one row per balance and one column per target.
+    """
+    ok, values, err = convert_many([1, 2, 4], ["EUR", "USD"])
+    assert ok and err is None
+    assert values.tolist() == [[0.5, 1.0], [1.0, 2.0], [2.0, 4.0]]
+    assert convert_many([1], ["XXX"])[2] == "Invalid or unsupported currency code"
+
+    test_storage.create_accounts([(1, "1111", 10), (2, "2222", 20)])
+    ok, ids, values, _ = convert_accounts(test_storage, ["EUR"], ids=[2, 3, 1])
+    assert ids == [2, 1]
+    assert values.tolist() == [[10.0], [5.0]]
+
+
+def test_convert_batch_endpoint(rates_file, client, test_storage):
+    test_storage.create_accounts([(1, "1111", 10), (2, "2222", 20)])
+
+    resp = client.post(
+        "/convert:batch", json={"targets": ["eur"], "account_ids": [1, 2, 9]}
+    )
+    assert resp.status_code == 200
+    assert resp.json() == {
+        "base": "USD",
+        "targets": ["EUR"],
+        "account_ids": [1, 2],
+        "missing": [9],
+        "values": [[5.0], [10.0]],
+    }
+
+    resp = client.post(
+        "/convert:batch", json={"base": "EUR", "targets": ["USD"], "balances": [1.5]}
+    )
+    assert resp.json()["values"] == [[3.0]]
+
+    resp = client.post("/convert:batch", json={"targets": ["USD"]})
+    assert resp.status_code == 422
@@ -0,0 +1,63 @@
+"""
+test_session.py
+
+Used to implement pytest for the SessionStore
+"""
+
+import time
+
+from app import Action
+from app.core import App
+from app.domain import MemoryAccountStorage, PinHasher, SessionStore
+from app.states import InputAmountState, LoginState
+
+
+def test_session_expires():
+    """
+    A token stops resolving once its ttl is over.
+    """
+    sessions = SessionStore(ttl=0.05)
+    token = sessions.issue(1)
+    assert sessions.resolve(token) == 1
+    time.sleep(0.1)
+    assert sessions.resolve(token) is None
+    assert len(sessions) == 0
+
+
+def test_session_store_is_bounded():
+    """
+    The least recently used token is dropped once the store is full.
+    """
+    sessions = SessionStore(max_sessions=2)
+    first = sessions.issue(1)
+    second = sessions.issue(2)
+    sessions.resolve(first)
+    third = sessions.issue(3)
+    assert sessions.resolve(second) is None
+    assert sessions.resolve(first) == 1
+    assert sessions.resolve(third) == 3
+    assert sessions.revoke(third)
+    assert not sessions.revoke(third)
+
+
+def test_app_sends_an_expired_session_back_to_login():
+    """
+    The tui checks its session before every write, a revoked one logs out.
+    """
+    storage = MemoryAccountStorage(hasher=PinHasher(rounds=4))
+    storage.create_account(1, "1234", 10)
+    sessions = SessionStore()
+    app = App(sessions=sessions, storage=storage)
+    assert app.login(1, "1234")
+    app.deposit(5)
+    assert app.balance == 15
+
+    sessions.revoke(app._token)
+    app.state = InputAmountState(kind="deposit")
+    app.dispatch("5")
+    app.dispatch(Action.CONFIRM)
+    assert isinstance(app.state, LoginState)
+    assert app.state.status.text == "Session expired, log in again."
+    assert app.balance == 0
+    assert storage.get_balances() == {1: 15}
+    storage.close()
@@ -0,0 +1,106 @@
+"""
+test_sharding.py
+
+Used to implement pytest for the ShardedAccountStorage
+"""
+
+import threading
+
+import pytest
+
+from app.api.api import app, get_storage
+from app.domain import ShardedAccountStorage
+
+
+@pytest.fixture
+def sharded(tmp_path):
+    storage = ShardedAccountStorage(str(tmp_path / "bank.db"), shards=3)
+    yield storage
+    storage.close()
+
+
+def test_accounts_are_spread_by_id(sharded, tmp_path):
+    """
+    Every account lives in the file of id % shards.
+    """
+    results = sharded.create_accounts(
+        [(id, "1234", id) for id in range(10)] + [(4, "1234", 0), ("x", "1", 0)]
+    )
+    assert results[-2:] == [(4, "Duplicate id in batch"), ("x", "Invalid id")]
+    assert all(err is None for _, err in results[:10])
+    assert sorted(p.name for p in tmp_path.glob("bank-*.db")) == [
+        "bank-0.db",
+        "bank-1.db",
+        "bank-2.db",
+    ]
+    assert sharded.shards[1].get_balances() == {1: 1, 4: 4, 7: 7}
+    assert sharded.get_balances([9, 2, 42]) == {9: 9, 2: 2}
+    assert [row for chunk in sharded.iter_accounts(4) for row in chunk] == [
+        (id, id) for id in range(10)
+    ]
+
+
+def test_cross_shard_batches(sharded):
+    """
+    Batches over several shards keep their order and the atomic rules.
+    """
+    sharded.create_accounts([(1, "1111", 100), (2, "2222", 0), (3, "3333", 0)])
+    committed, results = sharded.apply_batch(
+        [(1, "withdraw", 60), (2, "deposit", 60), (3, "withdraw", 1)]
+    )
+    assert not committed
+    assert results == [
+        (None, "Rolled back"),
+        (None, "Rolled back"),
+        (None, "Not enough balance"),
+    ]
+    assert sharded.get_balances() == {1: 100, 2: 0, 3: 0}
+
+    committed, results = sharded.apply_batch(
+        [(1, "withdraw", 60), (2, "deposit", 60), (3, "deposit", 5)]
+    )
+    assert committed
+    assert results == [(40, None), (60, None), (5, None)]
+
+    committed, results = sharded.apply_batch(
+        [(3, "withdraw", 50), (1, "withdraw", 10)], atomic=False
+    )
+    assert committed
+    assert results == [(None, "Not enough balance"), (30, None)]
+    assert sharded.get_account_by_id(1).get_balance() == 30
+
+
+def test_atomic_and_best_effort_batches_do_not_deadlock(tmp_path):
+    """
+    Atomic batches hold the write locks of both shards while best-effort batches
+    keep the shard pool busy waiting on those same locks.
+    """
+    storage = ShardedAccountStorage(str(tmp_path / "bank.db"), shards=2)
+    storage.create_accounts((id, "1234", 1000) for id in range(4))
+
+    def atomic():
+        for _ in range(50):
+            storage.apply_batch([(0, "withdraw", 1), (1, "deposit", 1)])
+
+    def best_effort():
+        for _ in range(50):
+            storage.apply_batch([(2, "deposit", 1), (3, "deposit", 1)], atomic=False)
+            storage.get_balances([2, 3])
+
+    threads = [threading.Thread(target=atomic, daemon=True) for _ in range(2)]
+    threads += [threading.Thread(target=best_effort, daemon=True) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=30)
+    assert not any(t.is_alive() for t in threads), "sharded batches deadlocked"
+    assert storage.get_balances() == {0: 900, 1: 1100, 2: 1200, 3: 1200}
+    storage.close()
+
+
+def test_sharded_storage_behind_the_api(client, sharded):
+    app.dependency_overrides[get_storage] = lambda: sharded
+    sharded.create_account(5, "5555", 10)
+    resp = client.post("/accounts/5/deposit", json={"pin": "5555", "amount": 5})
+    assert resp.json() == {"id": 5, "balance": 15}
+    assert client.get("/metrics").status_code == 200
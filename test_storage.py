@@ -0,0 +1,555 @@
+"""
+test_storage.py
+
+Used to implement pytest for the sqlite AccountStorage
+"""
+
+import asyncio
+import gzip
+import json
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import pytest
+
+from app import cli
+from app.core import App
+from app.domain import (
+    AccountExistsError,
+    AccountStorage,
+    AsyncAccountStorage,
+    BankAccount,
+    PinHasher,
+    StorageConfig,
+)
+
+
+@pytest.mark.sqlite_only
+def test_storage_reuses_pooled_connections(test_storage):
+    """
+    Many calls should not open more connections than the pool allows.
+    """
+    for _ in range(50):
+        test_storage.get_account_by_id(1)
+    assert len(test_storage._opened) == 1
+
+
+@pytest.mark.sqlite_only
+def test_storage_pool_is_bounded_across_threads(test_storage):
+    """
+    Concurrent readers share at most pool_size connections.
+    """
+    test_storage.create_account(id=1, pin="1234", initial_balance=10)
+
+    def read():
+        for _ in range(20):
+            assert test_storage.get_account_by_id(1).get_balance() == 10
+
+    threads = [threading.Thread(target=read) for _ in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(test_storage._opened) <= test_storage.pool_size
+
+
+@pytest.mark.sqlite_only
+def test_storage_uses_wal(test_storage):
+    """
+    Pooled connections run in WAL mode.
+    """
+    with test_storage._connection() as conn:
+        mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+    assert mode == "wal"
+
+
+def test_durability_profiles_set_synchronous(tmp_path):
+    """
+    Each profile opens its connections with its own synchronous level.
+    """
+    for durability, level in (("strict", 2), ("balanced", 1), ("fast", 0)):
+        config = StorageConfig(durability=durability)
+        storage = AccountStorage(str(tmp_path / f"{durability}.db"), config=config)
+        with storage._connection() as conn:
+            assert conn.execute("PRAGMA synchronous").fetchone()[0] == level
+            assert conn.execute("PRAGMA temp_store").fetchone()[0] == 2
+        storage.close()
+    with pytest.raises(ValueError):
+        StorageConfig(durability="reckless")
+
+
+def test_storage_close_rejects_further_use(test_storage):
+    """
+    After close the storage refuses to hand out connections.
+    """
+    test_storage.get_account_by_id(1)
+    test_storage.close()
+    with pytest.raises(RuntimeError):
+        test_storage.get_account_by_id(1)
+
+
+def test_apply_delta_and_try_withdraw(test_storage):
+    """
+    Deltas are applied in sqlite and withdrawals never overdraw.
+    """
+    test_storage.create_account(id=1, pin="1234", initial_balance=100)
+    assert test_storage.apply_delta(1, 50) == 150
+    assert test_storage.try_withdraw(1, 120) == 30
+    assert test_storage.try_withdraw(1, 31) is None
+    assert test_storage.get_account_by_id(1).get_balance() == 30
+    assert test_storage.apply_delta(2, 10) is None
+
+
+def test_parallel_deposits_are_not_lost(test_storage):
+    """
+    Thousands of concurrent deposits must add up exactly.
+    """
+    test_storage.create_account(id=1, pin="1234", initial_balance=0)
+    with ThreadPoolExecutor(max_workers=32) as pool:
+        list(pool.map(lambda _: test_storage.apply_delta(1, 1), range(5000)))
+    assert test_storage.get_account_by_id(1).get_balance() == 5000
+
+
+def test_parallel_withdrawals_never_overdraw(test_storage):
+    """
+    Racing withdrawals can only take out what is there.
+    """
+    test_storage.create_account(id=1, pin="1234", initial_balance=1000)
+    with ThreadPoolExecutor(max_workers=32) as pool:
+        results = list(pool.map(lambda _: test_storage.try_withdraw(1, 3), range(1000)))
+    assert sum(r is not None for r in results) == 333
+    assert test_storage.get_account_by_id(1).get_balance() == 1
+
+
+def test_pin_hasher_process_pool(tmp_path):
+    """
+    A storage backed by a process pool hashes and checks pins the same way.
+    """
+    storage = AccountStorage(
+        str(tmp_path / "pool.db"), hasher=PinHasher(workers=1, rounds=4)
+    )
+    try:
+        storage.create_account(id=1, pin="1234", initial_balance=10)
+        assert storage.get_account(1, "1234").get_balance() == 10
+        assert storage.get_account(1, "0000") is None
+        front = AsyncAccountStorage(storage)
+        assert asyncio.run(front.get_account(1, "1234")).get_balance() == 10
+        front.close()
+        metrics = storage.hasher.metrics()
+        assert metrics["pending"] == 0
+        assert metrics["completed"] == 4
+    finally:
+        storage.close()
+
+
+def test_create_accounts_reports_each_row(test_storage):
+    """
+    Bulk creation inserts the good rows and explains the bad ones.
+    """
+    test_storage.create_account(id=1, pin="1234", initial_balance=0)
+    results = test_storage.create_accounts(
+        [
+            (1, "1111", 0),
+            (2, "2222", 20),
+            (2, "2222", 20),
+            (3, "", 0),
+            (4, "4444", -1),
+            ("x", "5555", 0),
+            (6, "6666", 60),
+        ],
+        chunk_size=3,
+    )
+    assert results == [
+        (1, "Account already exists"),
+        (2, None),
+        (2, "Duplicate id in batch"),
+        (3, "Invalid pin"),
+        (4, "Invalid initial balance"),
+        ("x", "Invalid id"),
+        (6, None),
+    ]
+    assert test_storage.get_account(2, "2222").get_balance() == 20
+    assert test_storage.get_account(6, "6666").get_balance() == 60
+
+
+def test_cli_provision_from_csv(tmp_path, capsys):
+    """
+    The provision command streams a csv into the database.
+    """
+    csv_path = tmp_path / "accounts.csv"
+    csv_path.write_text("id,pin,initial_balance\n1,1234,10\n2,0042,20\nbad,1,1\n")
+    db_path = str(tmp_path / "cli.db")
+
+    assert (
+        cli.main(["--db", db_path, "provision", str(csv_path), "--workers", "0"]) == 1
+    )
+    assert "created 2, failed 1" in capsys.readouterr().out
+
+    storage = AccountStorage(db_path)
+    try:
+        assert storage.get_account(2, "0042").get_balance() == 20
+    finally:
+        storage.close()
+
+
+def test_apply_batch_atomic_rolls_back(test_storage):
+    """
+    One failing operation undoes the whole atomic batch.
+    """
+    test_storage.create_accounts([(1, "1111", 100), (2, "2222", 0)])
+    committed, results = test_storage.apply_batch(
+        [(1, "withdraw", 50), (2, "deposit", 50), (2, "withdraw", 80)]
+    )
+    assert not committed
+    assert results == [
+        (None, "Rolled back"),
+        (None, "Rolled back"),
+        (None, "Not enough balance"),
+    ]
+    assert test_storage.get_account_by_id(1).get_balance() == 100
+    assert test_storage.get_account_by_id(2).get_balance() == 0
+
+
+def test_apply_batch_best_effort_skips_failures(test_storage):
+    """
+    A best effort batch keeps the operations that worked.
+    """
+    test_storage.create_accounts([(1, "1111", 100), (2, "2222", 0)])
+    committed, results = test_storage.apply_batch(
+        [
+            (1, "withdraw", 50),
+            (3, "deposit", 5),
+            (2, "deposit", 50),
+            (2, "withdraw", 80),
+        ],
+        atomic=False,
+    )
+    assert committed
+    assert results == [
+        (50, None),
+        (None, "Account not found"),
+        (50, None),
+        (None, "Not enough balance"),
+    ]
+    assert test_storage.get_account_by_id(2).get_balance() == 50
+
+
+def test_group_commit_batches_parallel_writes(test_storage):
+    """
+    With group commit on, parallel mutations share commits and still add up.
+    """
+    test_storage.create_account(id=1, pin="1234", initial_balance=0)
+    test_storage.enable_group_commit(max_delay_ms=20)
+    with ThreadPoolExecutor(max_workers=32) as pool:
+        list(pool.map(lambda _: test_storage.apply_delta(1, 2), range(1000)))
+    assert test_storage.try_withdraw(1, 5000) is None
+    assert test_storage.try_withdraw(1, 500) == 1500
+
+    metrics = test_storage.ledger.metrics()
+    assert metrics["committed"] == 1002
+    assert metrics["flushes"] < 1002
+    assert test_storage.get_account_by_id(1).get_balance() == 1500
+
+
+def test_group_commit_flushes_on_close(tmp_path):
+    """
+    Closing the storage writes out what is still in the ledger.
+    """
+    storage = AccountStorage(str(tmp_path / "ledger.db"))
+    storage.create_account(id=1, pin="1234", initial_balance=0)
+    storage.enable_group_commit(max_delay_ms=10_000, max_batch=1000)
+    future = storage.ledger.submit(1, "deposit", 7)
+    storage.close()
+    assert future.result() == (7, None)
+
+    storage = AccountStorage(str(tmp_path / "ledger.db"))
+    assert storage.get_account_by_id(1).get_balance() == 7
+    storage.close()
+
+
+@pytest.mark.parametrize("coalesce", [False, True])
+def test_group_commit_flushes_are_durable(tmp_path, monkeypatch, coalesce):
+    """
+    The committer fsyncs its flushes under the balanced profile too,
+    and hands the connection back with the profile's setting.
+    """
+    storage = AccountStorage(
+        str(tmp_path / "ledger.db"), config=StorageConfig(durability="balanced")
+    )
+    storage.create_account(id=1, pin="1234", initial_balance=0)
+    writer = storage._writer
+    seen = []
+
+    @contextmanager
+    def spy(durable=False):
+        with writer(durable) as conn:
+            seen.append(conn.execute("PRAGMA synchronous").fetchone()[0])
+            yield conn
+
+    monkeypatch.setattr(storage, "_writer", spy)
+    storage.enable_group_commit(max_delay_ms=1, coalesce=coalesce)
+    assert storage.apply_delta(1, 5) == 5
+    storage.ledger.close()
+    storage.ledger = None
+    assert storage.apply_delta(1, 5) == 10
+    # FULL is 2, NORMAL is 1
+    assert seen == [2, 1]
+    storage.close()
+
+
+def test_transactions_are_recorded_with_each_change(test_storage):
+    """
+    Every balance change leaves a row with the balance it produced.
+    """
+    test_storage.create_account(id=1, pin="1234", initial_balance=100)
+    test_storage.apply_delta(1, 20)
+    assert test_storage.try_withdraw(1, 500) is None
+    test_storage.try_withdraw(1, 70)
+    test_storage.apply_batch([(1, "deposit", 5), (1, "withdraw", 500)])
+    test_storage.update_balance(BankAccount(1, "", 1000, version=2))
+
+    page, cursor = test_storage.list_transactions(1)
+    assert cursor is None
+    assert [(t.kind, t.amount, t.balance) for t in page] == [
+        ("adjustment", 950, 1000),
+        ("withdraw", -70, 50),
+        ("deposit", 20, 120),
+        ("open", 100, 100),
+    ]
+
+
+def test_list_transactions_pages_with_cursor(test_storage):
+    """
+    Walking the cursor returns every row once, newest first.
+    """
+    test_storage.create_account(id=1, pin="1234", initial_balance=0)
+    test_storage.create_account(id=2, pin="1234", initial_balance=0)
+    for i in range(1, 26):
+        test_storage.apply_delta(1, i)
+        test_storage.apply_delta(2, 1)
+
+    seen = []
+    page, cursor = test_storage.list_transactions(1, limit=10)
+    seen += page
+    while cursor is not None:
+        page, cursor = test_storage.list_transactions(1, limit=10, before=cursor)
+        seen += page
+    assert len(seen) == 26
+    assert [t.amount for t in seen[:-1]] == list(range(25, 0, -1))
+    assert {t.account_id for t in seen} == {1}
+
+
+def test_iter_accounts_streams_in_chunks(test_storage):
+    """
+    The export cursor hands out fetchmany sized chunks in id order.
+    """
+    test_storage.create_accounts([(id, "1234", id * 10) for id in range(7, 0, -1)])
+    chunks = list(test_storage.iter_accounts(chunk_size=3))
+    assert [len(chunk) for chunk in chunks] == [3, 3, 1]
+    assert [row for chunk in chunks for row in chunk] == [
+        (id, id * 10) for id in range(1, 8)
+    ]
+
+
+def test_cli_export_gzip_csv(tmp_path):
+    """
+    The export command writes a gzipped csv with a header line.
+    """
+    db_path = str(tmp_path / "cli.db")
+    storage = AccountStorage(db_path)
+    storage.create_accounts([(1, "1234", 10), (2, "0042", 20)])
+    storage.apply_delta(2, 5)
+    storage.close()
+
+    out = tmp_path / "accounts.csv.gz"
+    argv = ["--db", db_path, "export", "accounts", "--format", "csv", "--gzip"]
+    assert cli.main(argv + ["-o", str(out)]) == 0
+    assert gzip.decompress(out.read_bytes()) == b"id,balance\n1,10\n2,25\n"
+
+    out = tmp_path / "statement.ndjson"
+    argv = ["--db", db_path, "export", "transactions", "--account", "2"]
+    assert cli.main(argv + ["-o", str(out)]) == 0
+    rows = [json.loads(line) for line in out.read_text().splitlines()]
+    assert [(r["kind"], r["amount"], r["balance"]) for r in rows] == [
+        ("open", 20, 20),
+        ("deposit", 5, 25),
+    ]
+
+
+def test_version_column_is_added_and_bumped(tmp_path):
+    """
+    An old database gets the version column, every write bumps it.
+    """
+    path = str(tmp_path / "old.db")
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE accounts (id INTEGER PRIMARY KEY, pin TEXT NOT NULL, "
+        "balance INTEGER NOT NULL DEFAULT 0)"
+    )
+    conn.execute("INSERT INTO accounts VALUES (1, 'x', 10)")
+    conn.commit()
+    conn.close()
+
+    storage = AccountStorage(path)
+    try:
+        assert storage.get_account_by_id(1).version == 0
+        storage.apply_delta(1, 5)
+        storage.try_withdraw(1, 100)
+        storage.apply_batch([(1, "withdraw", 5)])
+        storage.update_balance(BankAccount(1, "", 3, version=2))
+        account = storage.get_account_by_id(1)
+        assert (account.get_balance(), account.version) == (3, 3)
+    finally:
+        storage.close()
+
+
+def test_update_balance_is_compare_and_swap(test_storage):
+    """
+    A write based on an old read is refused instead of overwriting.
+    """
+    test_storage.create_account(id=1, pin="1234", initial_balance=100)
+    first = test_storage.get_account_by_id(1)
+    second = test_storage.get_account_by_id(1)
+    first.deposit(10)
+    second.deposit(20)
+    assert test_storage.update_balance(first)
+    assert first.version == 1
+    assert not test_storage.update_balance(second)
+    assert test_storage.get_account_by_id(1).get_balance() == 110
+    assert test_storage.contention_metrics()["cas_failures"] == 1
+
+
+def test_mutate_retries_lost_updates(test_storage):
+    """
+    Parallel read-modify-write through mutate loses no deposit.
+    """
+    test_storage.create_account(id=1, pin="1234", initial_balance=0)
+
+    def deposit(_):
+        return test_storage.mutate(1, lambda a: a.deposit(1), retries=1000)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(deposit, range(200)))
+    assert all(err is None for _, err in results)
+    assert test_storage.get_account_by_id(1).get_balance() == 200
+
+    assert test_storage.mutate(1, lambda a: a.withdraw(500)[1]) == (
+        None,
+        "Not enough balance",
+    )
+    assert test_storage.mutate(2, lambda a: None) == (None, "Account not found")
+
+
+def test_apply_if_match(test_storage):
+    """
+    A guarded write only goes through at the expected version.
+    """
+    test_storage.create_account(id=1, pin="1234", initial_balance=10)
+    assert test_storage.apply_if_match(1, "withdraw", 5, 1) == (
+        None,
+        "Version mismatch",
+    )
+    assert test_storage.apply_if_match(1, "withdraw", 50, 0) == (
+        None,
+        "Not enough balance",
+    )
+    assert test_storage.apply_if_match(1, "withdraw", 5, 0) == (5, None)
+    assert test_storage.get_account_by_id(1).version == 1
+    assert test_storage.contention_metrics()["version_mismatches"] == 1
+
+
+def test_async_storage_runs_on_its_own_executor(test_storage):
+    """
+    The async front hashes, reads and writes off the event loop, ledger included.
+    """
+    front = AsyncAccountStorage(test_storage, workers=2)
+
+    async def scenario():
+        await front.create_account(id=1, pin="1234", initial_balance=10)
+        assert await front.get_account(1, "0000") is None
+        account = await front.get_account(1, "1234")
+        account.deposit(5)
+        assert await front.update_balance(account)
+        assert (await front.get_account_by_id(1)).get_balance() == 15
+
+        test_storage.enable_group_commit(max_delay_ms=5)
+        results = await asyncio.gather(*(front.apply_delta(1, 1) for _ in range(50)))
+        assert sorted(results) == list(range(16, 66))
+        assert await front.try_withdraw(1, 1000) is None
+        return await front.get_balances([1])
+
+    try:
+        assert asyncio.run(scenario()) == {1: 65}
+    finally:
+        front.close()
+
+
+def test_write_coalescer_folds_an_account_into_one_update(test_storage):
+    """
+    A batch of one account is one UPDATE, each caller still sees its own balance
+    and a withdraw is checked against the entries before it.
+    """
+    test_storage.create_account(id=1, pin="1234", initial_balance=10)
+    test_storage.create_account(id=2, pin="1234", initial_balance=0)
+    test_storage.enable_group_commit(max_delay_ms=10_000, max_batch=6, coalesce=True)
+    ledger = test_storage.ledger
+    futures = [
+        ledger.submit(1, "deposit", 5),
+        ledger.submit(1, "withdraw", 20),
+        ledger.submit(2, "deposit", 3),
+        ledger.submit(1, "withdraw", 15),
+        ledger.submit(1, "deposit", 1),
+        ledger.submit(3, "deposit", 1),
+    ]
+    assert [f.result(timeout=10) for f in futures] == [
+        (15, None),
+        (None, "Not enough balance"),
+        (3, None),
+        (0, None),
+        (1, None),
+        (None, "Account not found"),
+    ]
+    metrics = ledger.metrics()
+    assert metrics["flushes"] == 1
+    assert metrics["updates"] == 3
+
+    account = test_storage.get_account_by_id(1)
+    assert (account.get_balance(), account.version) == (1, 3)
+    page, _ = test_storage.list_transactions(1)
+    assert [(t.kind, t.amount, t.balance) for t in reversed(page)] == [
+        ("open", 10, 10),
+        ("deposit", 5, 15),
+        ("withdraw", -15, 0),
+        ("deposit", 1, 1),
+    ]
+
+
+def test_insert_account_rejects_a_taken_id(test_storage):
+    """
+    Every engine raises AccountExistsError for an id that is taken.
+    """
+    test_storage.create_account(id=1, pin="1234", initial_balance=10)
+    with pytest.raises(AccountExistsError):
+        test_storage.create_account(id=1, pin="0000", initial_balance=99)
+    assert test_storage.get_balances() == {1: 10}
+    assert len(test_storage.list_transactions(1)[0]) == 1
+
+
+def test_app_turns_on_group_commit_from_the_env(monkeypatch):
+    """
+    The tui reads BANK_GROUP_COMMIT_MS like the api does.
+    """
+    monkeypatch.setenv("BANK_ENGINE", "memory")
+    monkeypatch.setenv("BANK_GROUP_COMMIT_MS", "1")
+    app = App()
+    try:
+        assert app.storage.ledger is not None
+        app.storage.create_account(1, "1234", 10)
+        assert app.login(1, "1234")
+        app.deposit(5)
+        assert app.balance == 15
+        assert app.storage.ledger.metrics()["committed"] == 1
+    finally:
+        app.close()